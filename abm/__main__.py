@@ -7,38 +7,28 @@ Copyright 2025 The Galaxy Project. All rights reserved.
 
 """
 
+import argparse
+import contextlib
+import importlib
+import io
+import json
 import logging
 import os
+import shlex
+import socket
+import socketserver
 import sys
 import warnings
 from pprint import pprint
 
 warnings.filterwarnings('ignore', category=UserWarning, module='pydantic')
 
-import yaml
-
-# These imports are required because we need Python to be load them to the
-# symbol table so the parse_menu method can find them in globals()
-from lib import (
-    benchmark,
-    config,
-    dataset,
-    experiment,
-    folder,
-    helm,
-    history,
-    invocation,
-    job,
-    kubectl,
-    library,
-    tools,
-    users,
-    workflow,
-)
-from lib.common import Context
-
 from abm import getVersion
 
+# The parsed menu.yml is cached here so that PyYAML is only needed when the
+# menu changes.
+MENU_CACHE = '~/.abm/cache/menu.json'
+
 log = logging.getLogger('abm')
 handler = logging.StreamHandler()
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
@@ -102,6 +92,8 @@ def print_main_help(menu_data):
     print("            print the program version and exit")
     print(f"        {command_list(help_args)}")
     print("            print this help screen and exit")
+    print(f"        {bold('batch')} [FILE] [--listen SOCKET] [--stop-on-error]")
+    print("            run commands read one per line from a file, stdin or a socket")
     print()
     head("    NOTES")
     print(
@@ -165,6 +157,65 @@ def alias(shortcut, fullname):
     all_commands[shortcut] = all_commands[fullname]
 
 
+class LazyHandler:
+    """
+    A menu handler, given as *module.function*, whose module is only imported
+    when the command is run.  Importing every module up front pulls in
+    bioblend and the Terra libraries, which made every command, even
+    ``abm help``, slow to start.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._function = None
+
+    def resolve(self):
+        if self._function is None:
+            module_name, function_name = self.name.rsplit('.', 1)
+            try:
+                module = importlib.import_module(f"lib.{module_name}")
+                self._function = getattr(module, function_name)
+            except (ImportError, AttributeError) as e:
+                log.error(f"Handler not found {self.name}: {e}")
+                # TODO Throw and excpetion that can be caught at the appropriate level.
+                sys.exit(1)
+        return self._function
+
+    def __call__(self, context, args: list):
+        return self.resolve()(context, args)
+
+
+def load_menu(menu_config: str) -> list:
+    """
+    Loads the menu from the cache if it was written for the current version
+    of *menu_config*, otherwise parses the YAML and updates the cache.
+    """
+    stat = os.stat(menu_config)
+    key = [menu_config, stat.st_mtime_ns, stat.st_size]
+    cache_path = os.path.expanduser(MENU_CACHE)
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached.get('key') == key:
+            return cached['menu']
+    except (OSError, ValueError):
+        pass
+
+    import yaml
+
+    with open(menu_config) as f:
+        menu_data = yaml.safe_load(f)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp, 'w') as f:
+            json.dump({'key': key, 'menu': menu_data}, f)
+        os.replace(temp, cache_path)
+    except OSError as e:
+        log.debug("Unable to cache the menu: %s", e)
+    return menu_data
+
+
 def parse_menu():
     log.debug('parse_menu')
     menu_config = f'{os.path.dirname(os.path.abspath(__file__))}/lib/menu.yml'
@@ -172,8 +223,7 @@ def parse_menu():
         log.error(f"ERROR: Unable to load the menu configuration from {menu_config}")
         # TODO Throw an exception that can be caught at the appropriate level
         sys.exit(1)
-    with open(menu_config) as f:
-        menu_data = yaml.safe_load(f)
+    menu_data = load_menu(menu_config)
     for main_menu_item in menu_data:
         # Use the first name in the list as the main name for the item. The
         # others will be aliased below.
@@ -183,22 +233,9 @@ def parse_menu():
                 stand_alone_commands.append(item_name)
         log.debug('Menu name: %s', name)
         for submenu_item in main_menu_item['menu']:
-            handler = globals()
             handler_name = submenu_item['handler']
             log.debug('Submenu item: %s', handler_name)
-            for part in handler_name.split('.'):
-                # log.debug("Part: %s", part)
-                if type(handler) is not dict:
-                    handler = handler.__dict__
-                if not part in handler:
-                    print(f"ERROR: {part} not found")
-                else:
-                    handler = handler[part]
-            if isinstance(handler, dict):
-                log.error(f"Handler not found {handler_name}")
-                # TODO Throw and excpetion that can be caught at the appropriate level.
-                sys.exit(1)
-            register_handler(name, submenu_item['name'], handler)
+            register_handler(name, submenu_item['name'], LazyHandler(handler_name))
         for command_alias in main_menu_item['name'][1:]:
             alias(command_alias, name)
     return menu_data
@@ -248,12 +285,39 @@ def entrypoint():
 
     menu_data = parse_menu()
 
-    if len(sys.argv) < 2 or sys.argv[1] in help_args:
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        batch(menu_data, sys.argv[2:])
+        return
+    run_command(menu_data, sys.argv[0], sys.argv[1:])
+
+
+# Contexts are created once per profile and reused by every command in a batch.
+contexts = {}
+
+
+def get_context(profile: str):
+    if profile not in contexts:
+        # Imported here as it loads bioblend.
+        from lib.common import Context
+
+        contexts[profile] = Context(profile)
+    return contexts[profile]
+
+
+def run_command(menu_data, program: str, args: list):
+    """
+    Runs a single command.
+
+    :param menu_data: the parsed menu
+    :param program: the program name used in error messages
+    :param args: the command line without the program name
+    :return: the value returned by the command's handler
+    """
+    if len(args) < 1 or args[0] in help_args:
         print_main_help(menu_data)
         return
 
-    program = sys.argv[0]
-    profile = sys.argv[1]
+    profile = args[0]
     if profile in version_args:
         version()
         return
@@ -261,29 +325,23 @@ def entrypoint():
     if profile in stand_alone_commands:
         command = profile
         profile = None
-        if len(sys.argv) < 3:
+        if len(args) < 2:
             print_help(menu_data, command)
             return
-        subcommand = sys.argv[2]
-        if len(sys.argv) > 3:
-            params = sys.argv[3:]
-        else:
-            params = []
+        subcommand = args[1]
+        params = args[2:]
     else:
-        if len(sys.argv) < 3:
+        if len(args) < 2:
             print(f"{bold('ERROR')} Invalid command {bold(profile)}")
             return
-        command = sys.argv[2]
+        command = args[1]
         if command in version_args:
             version()
             return
         subcommand = None
-        if len(sys.argv) > 3:
-            subcommand = sys.argv[3]
-        if len(sys.argv) > 4:
-            params = sys.argv[4:]
-        else:
-            params = []
+        if len(args) > 2:
+            subcommand = args[2]
+        params = args[3:]
 
     if command in help_args:
         print_help(menu_data, profile)
@@ -294,7 +352,7 @@ def entrypoint():
 
     context = None
     if profile is not None:
-        context = Context(profile)
+        context = get_context(profile)
     if command in all_commands:
         subcommands = all_commands[command]
         if subcommand not in subcommands:
@@ -302,11 +360,137 @@ def entrypoint():
             print(f'Type "{program} {command} help" for more help.')
             return
         handler = subcommands[subcommand]
-        handler(context, params)
+        return handler(context, params)
     else:
         print(f'\n{bold("ERROR:")} Unknown command {bold({command})}')
         print_main_help(menu_data)
 
 
+def batch(menu_data, args: list):
+    """
+    Runs many commands in a single process so the start up cost, the profile
+    parsing and the connections to Galaxy are shared between them.  Commands
+    are read one per line, without the leading ``abm``, from a file, stdin,
+    or from clients of a Unix socket.
+    """
+    parser = argparse.ArgumentParser(
+        prog='abm batch', description='Run abm commands read one per line.'
+    )
+    parser.add_argument(
+        'file', nargs='?', default='-', help='the commands to run, stdin by default'
+    )
+    parser.add_argument(
+        '--listen',
+        metavar='SOCKET',
+        help='accept commands on a Unix socket instead of reading a file',
+    )
+    parser.add_argument(
+        '--stop-on-error',
+        action='store_true',
+        help='stop at the first command that fails, i.e. raises an error or returns False',
+    )
+    params = parser.parse_args(args)
+
+    if params.listen is not None:
+        serve(menu_data, params.listen)
+        return
+    if params.file == '-':
+        failed = run_batch(menu_data, sys.stdin, params.stop_on_error)
+    else:
+        if not os.path.exists(params.file):
+            print(f"ERROR: file not found {params.file}")
+            return
+        with open(params.file) as f:
+            failed = run_batch(menu_data, f, params.stop_on_error)
+    if failed > 0:
+        print(f"WARNING: {failed} commands failed")
+
+
+def run_batch(menu_data, lines, stop_on_error: bool = False) -> int:
+    """
+    Runs each command in *lines*.  Blank lines and lines starting with # are
+    ignored.
+
+    :return: the number of commands that failed
+    """
+    failed = 0
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        try:
+            args = shlex.split(line)
+        except ValueError as e:
+            print(f"ERROR: line {number}: {e}")
+            failed += 1
+            continue
+        if args[0] == 'abm':
+            args = args[1:]
+        if len(args) > 0 and args[0] == 'batch':
+            print(f"ERROR: line {number}: batch can not be nested")
+            failed += 1
+            continue
+        try:
+            ok = run_command(menu_data, 'abm', args) is not False
+        except (Exception, SystemExit) as e:
+            print(f"ERROR: line {number}: {line}: {e}")
+            ok = False
+        sys.stdout.flush()
+        if not ok:
+            failed += 1
+            if stop_on_error:
+                break
+    return failed
+
+
+def serve(menu_data, path: str):
+    """
+    Runs the commands sent to the Unix socket at *path*, one client at a
+    time.  Everything a command prints is sent back to the client, e.g.
+
+        echo "aws workflow list" | nc -U ~/.abm/abm.sock
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        print("ERROR: Unix sockets are not supported on this platform")
+        return
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            # Names resolved for one client are not reused by the next, so a
+            # long running server does not keep stale IDs forever.
+            from lib import cache
+
+            cache.reset()
+            out = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+            lines = (line.decode('utf-8') for line in self.rfile)
+            try:
+                with contextlib.redirect_stdout(out):
+                    run_batch(menu_data, lines)
+            except OSError:
+                # The client went away.
+                pass
+            finally:
+                out.detach()
+
+    path = os.path.expanduser(path)
+    if os.path.exists(path):
+        os.remove(path)
+    # Create the socket accessible to this user only, changing its mode
+    # after bind would let other users connect in the meantime.
+    umask = os.umask(0o077)
+    try:
+        server = socketserver.UnixStreamServer(path, Handler)
+    finally:
+        os.umask(umask)
+    print(f"Listening for commands on {path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
 if __name__ == '__main__':
     entrypoint()
@@ -1,3 +1,4 @@
+import contextvars
 import json
 import os
 import sys
@@ -12,6 +13,30 @@ METRICS_DIR = "metrics"
 # Global instance of a YAML parser so we can reuse it if needed.
 parser = None
 
+# The parsed profile.yml and the (path, modification time) it was read from.
+# See common.read_profiles()
+profiles = None
+
+# Global cache of resolved workflow, dataset and collection names.
+# See cache.get_resolution_cache()
+resolutions = None
+
+# Global registry of pooled connections to Galaxy servers.
+# See connection.get_registry()
+connections = None
+
+# Global runner for the helm and kubectl executables.
+# See shell.get_runner()
+commands = None
+
+# Global cache of the details and metrics of finished jobs.
+# See job_cache.get_job_cache()
+jobs = None
+
+# True while a command bypasses the job cache.
+# See job_cache.bypass()
+jobs_bypassed = contextvars.ContextVar('jobs_bypassed', default=False)
+
 
 # Keys used in various dictionaries.
 class Keys:
@@ -0,0 +1,320 @@
+"""
+Aggregate statistics for the job metrics of an experiment.
+
+The summary rows produced by *experiment.make_table_row* are loaded into
+typed columns, one NumPy array per field, and the jobs are grouped by cloud,
+job configuration and tool.  The mean, median and 95th percentile of the
+runtime and the peak memory usage are then computed for each group so a
+summary of an experiment with a million jobs is a few hundred lines.
+
+The rows produced by *experiment.make_model_row* are used to fit a linear
+model of the runtime and peak memory of each tool against the size of its
+inputs.  The models of every tool are fitted together, in one pass over the
+arrays, and are used to recommend the resources for each tool.
+
+NumPy is optional; the ``--stats`` option of ``abm experiment summarize``
+is only available when it is installed.
+"""
+
+import math
+
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Columns in the rows produced by experiment.make_table_row
+CLOUD = 1
+JOB_CONF = 2
+TOOL = 6
+STATE = 7
+RUNTIME = 10
+MEMORY = 13
+
+# Columns in the rows produced by experiment.make_model_row
+MODEL_TOOL = 1
+MODEL_STATE = 3
+MODEL_MEMORY = 4
+MODEL_CPU = 5
+MODEL_SLOTS = 7
+MODEL_RUNTIME = 8
+MODEL_INPUTS = 10
+
+GB = float(1073741824)
+
+HEADER = [
+    'Cloud',
+    'Job Conf',
+    'Tool',
+    'Jobs',
+    'Runtime Mean (Sec)',
+    'Runtime Median (Sec)',
+    'Runtime p95 (Sec)',
+    'Memory Mean (GB)',
+    'Memory Median (GB)',
+    'Memory p95 (GB)',
+]
+
+
+class MetricsTable:
+    """
+    The job metrics from the summary rows as columns.  The cloud, job conf,
+    tool and state columns are integer codes into the *names* of each
+    column, the runtime and memory are floats with NaN for missing values.
+    """
+
+    def __init__(self, columns: dict, names: dict, runtime, memory):
+        self.columns = columns
+        self.names = names
+        self.runtime = runtime
+        self.memory = memory
+
+    def __len__(self):
+        return len(self.runtime)
+
+    @staticmethod
+    def from_rows(rows) -> 'MetricsTable':
+        """
+        Loads the summary *rows*, which may be a generator, into columns.
+        """
+        keys = {CLOUD: [], JOB_CONF: [], TOOL: [], STATE: []}
+        runtime = []
+        memory = []
+        for row in rows:
+            keys[CLOUD].append(row[CLOUD])
+            keys[JOB_CONF].append(row[JOB_CONF])
+            # The tool column is "repository,version"
+            keys[TOOL].append(row[TOOL].split(',')[0])
+            keys[STATE].append(row[STATE])
+            runtime.append(_to_float(row[RUNTIME]))
+            memory.append(_to_float(row[MEMORY]))
+        columns = {}
+        names = {}
+        for index, values in keys.items():
+            names[index], columns[index] = np.unique(
+                np.array(values, dtype=str), return_inverse=True
+            )
+        return MetricsTable(
+            columns,
+            names,
+            np.array(runtime, dtype=np.float64),
+            np.array(memory, dtype=np.float64),
+        )
+
+    def aggregate(self, states: list = None) -> list:
+        """
+        Groups the jobs by cloud, job conf and tool.
+
+        :param states: only include jobs in these states, e.g. ['ok']. All
+          jobs are included by default.
+        :return: one row of strings per group, see HEADER, sorted by cloud,
+          job conf and tool.
+        """
+        if len(self) == 0:
+            return []
+        mask = np.ones(len(self), dtype=bool)
+        if states:
+            wanted = np.isin(self.names[STATE], states)
+            mask = wanted[self.columns[STATE]]
+
+        # Combine the key columns into a single group code.
+        group = np.zeros(len(self), dtype=np.int64)
+        for index in (CLOUD, JOB_CONF, TOOL):
+            group = group * len(self.names[index]) + self.columns[index]
+        group = group[mask]
+        runtime = self.runtime[mask]
+        memory = self.memory[mask] / GB
+        if len(group) == 0:
+            return []
+
+        codes, counts = np.unique(group, return_counts=True)
+        order = np.argsort(group, kind='stable')
+        bounds = np.cumsum(counts)[:-1]
+        runtimes = np.split(runtime[order], bounds)
+        memories = np.split(memory[order], bounds)
+
+        table = []
+        for code, count, rt, mem in zip(codes, counts, runtimes, memories):
+            key = []
+            rest = code
+            for index in (TOOL, JOB_CONF, CLOUD):
+                rest, value = divmod(rest, len(self.names[index]))
+                key.insert(0, str(self.names[index][value]))
+            row = key + [str(count)]
+            row.extend(_stats(rt, '{:.1f}'))
+            row.extend(_stats(mem, '{:.3f}'))
+            table.append(row)
+        return table
+
+
+def aggregate(rows, states: list = None) -> list:
+    """
+    Returns the grouped statistics for the summary *rows*.  See
+    MetricsTable.aggregate
+    """
+    return MetricsTable.from_rows(rows).aggregate(states)
+
+
+MODEL_HEADER = [
+    'Tool',
+    'Jobs',
+    'Max Input (GB)',
+    'Runtime Intercept (Sec)',
+    'Runtime Slope (Sec/GB)',
+    'Runtime R2',
+    'Memory Intercept (GB)',
+    'Memory Slope (GB/GB)',
+    'Memory R2',
+    'Max Memory (GB)',
+    'Max CPU',
+]
+
+
+class ToolModels:
+    """
+    The runtime and memory models for every tool in the model rows.  Each
+    attribute is an array with one entry per tool in *tools*.
+
+    The runtime (seconds) and memory (GB) are modelled as
+    ``intercept + slope * input size (GB)``.  The cores used by a job are
+    its CPU time over its runtime, or its galaxy_slots if the CPU time was
+    not reported; *missing_cpu* counts those jobs.
+    """
+
+    def __init__(self, rows, states: list = None):
+        """
+        :param rows: the rows from experiment.make_model_row, which may be a
+          generator.
+        :param states: only include jobs in these states. Defaults to ['ok']
+        """
+        if states is None:
+            states = ['ok']
+        tools = []
+        size = []
+        runtime = []
+        memory = []
+        cpu = []
+        slots = []
+        for row in rows:
+            if row[MODEL_STATE] not in states:
+                continue
+            tools.append(row[MODEL_TOOL])
+            size.append(sum(_to_float(s) for s in row[MODEL_INPUTS:]))
+            runtime.append(_to_float(row[MODEL_RUNTIME]))
+            memory.append(_to_float(row[MODEL_MEMORY]))
+            cpu.append(_to_float(row[MODEL_CPU]))
+            slots.append(_to_float(row[MODEL_SLOTS]))
+        self.tools, group = np.unique(np.array(tools, dtype=str), return_inverse=True)
+        count = len(self.tools)
+        size = np.nan_to_num(np.array(size, dtype=np.float64)) / GB
+        runtime = np.array(runtime, dtype=np.float64)
+        # Missing memory metrics are reported as 0
+        memory = np.array(memory, dtype=np.float64) / GB
+        memory[memory <= 0] = np.nan
+        # The CPU time is in nanoseconds, 0 when it was not reported
+        cores = np.array(cpu, dtype=np.float64) / 1e9
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cores = cores / runtime
+        missing = ~(cores > 0)
+        cores[missing] = np.array(slots, dtype=np.float64)[missing]
+        self.missing_cpu = int(missing.sum())
+
+        self.jobs = np.bincount(group, minlength=count)
+        self.max_size = _group_max(group, size, count)
+        self.runtime = fit_linear(group, size, runtime, count)
+        self.memory = fit_linear(group, size, memory, count)
+        self.max_memory = _group_max(group, memory, count)
+        self.max_cpu = _group_max(group, cores, count)
+
+    def __len__(self):
+        return len(self.tools)
+
+    def predict_memory(self, size=None):
+        """
+        The predicted memory (GB) of every tool for inputs of *size* GB, by
+        default the largest input seen for each tool.
+        """
+        if size is None:
+            size = self.max_size
+        intercept, slope, _ = self.memory
+        return intercept + slope * size
+
+    def table(self) -> list:
+        """
+        :return: one row of strings per tool, see MODEL_HEADER
+        """
+        table = []
+        for i, tool in enumerate(self.tools):
+            row = [str(tool), str(self.jobs[i]), _format(self.max_size[i], '{:.3f}')]
+            for intercept, slope, r2 in (self.runtime, self.memory):
+                row.append(_format(intercept[i], '{:.1f}'))
+                row.append(_format(slope[i], '{:.3f}'))
+                row.append(_format(r2[i], '{:.3f}'))
+            row.append(_format(self.max_memory[i], '{:.3f}'))
+            row.append(_format(self.max_cpu[i], '{:.2f}'))
+            table.append(row)
+        return table
+
+
+def fit_linear(group, x, y, count: int) -> tuple:
+    """
+    Fits ``y = intercept + slope * x`` by least squares for every group at
+    once.  Points where *y* is NaN are ignored.  Groups with a single input
+    size get a slope of 0 and groups without any points are NaN.
+
+    :param group: the group of each point, 0 to *count* - 1
+    :return: (intercept, slope, r2) arrays with *count* entries
+    """
+    valid = ~np.isnan(y)
+    group, x, y = group[valid], x[valid], y[valid]
+    n = np.bincount(group, minlength=count).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = np.bincount(group, x, count) / n
+        mean_y = np.bincount(group, y, count) / n
+        dx = x - mean_x[group]
+        dy = y - mean_y[group]
+        sxx = np.bincount(group, dx * dx, count)
+        sxy = np.bincount(group, dx * dy, count)
+        syy = np.bincount(group, dy * dy, count)
+        slope = np.where(sxx > 0, sxy / sxx, 0.0)
+        r2 = np.where((sxx > 0) & (syy > 0), sxy * sxy / (sxx * syy), 0.0)
+    slope[n == 0] = np.nan
+    r2[n == 0] = np.nan
+    intercept = mean_y - slope * mean_x
+    return intercept, slope, r2
+
+
+def _group_max(group, values, count: int):
+    """
+    The largest finite value in each group, NaN for groups without one.
+    """
+    result = np.full(count, -np.inf)
+    valid = np.isfinite(values)
+    np.maximum.at(result, group[valid], values[valid])
+    result[np.isinf(result)] = np.nan
+    return result
+
+
+def _format(value, fmt: str) -> str:
+    return '' if np.isnan(value) else fmt.format(value)
+
+
+def _stats(values, fmt: str) -> list:
+    """
+    The mean, median and 95th percentile of the *values* that are not NaN.
+    """
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return ['', '', '']
+    mean = values.mean()
+    median, p95 = np.percentile(values, [50, 95])
+    return [fmt.format(mean), fmt.format(median), fmt.format(p95)]
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
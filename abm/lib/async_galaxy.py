@@ -0,0 +1,132 @@
+"""
+An asyncio facade over the bioblend GalaxyInstance.
+
+bioblend is synchronous, so each call is run on a thread pool that belongs to
+the Galaxy server being called.  The size of that pool is the maximum number of
+requests in flight to the server, across every event loop and thread in the
+process, so commands can fan out freely without overloading a server.
+
+    agi = AsyncGalaxy(connect(context))
+    jobs = await agi.jobs.get_jobs(history_id=hid)
+    metrics = await asyncio.gather(*[agi.jobs.get_metrics(j['id']) for j in jobs])
+
+The jobs, histories, datasets, invocations and workflows clients are
+available.  Any method of the corresponding bioblend client can be awaited.
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from lib import cache, retry
+
+# The default maximum number of concurrent requests to a single server.
+DEFAULT_LIMIT = 8
+
+_executors = {}
+_limits = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(server: str, limit: int = DEFAULT_LIMIT) -> ThreadPoolExecutor:
+    """
+    Returns the thread pool used for requests to *server*. The pool is created
+    with *limit* threads the first time the server is used.
+    """
+    with _executors_lock:
+        if server not in _executors:
+            _limits[server] = max(1, limit)
+            _executors[server] = ThreadPoolExecutor(
+                max_workers=_limits[server], thread_name_prefix=f"abm-{server}"
+            )
+        return _executors[server]
+
+
+def get_limit(server: str) -> int:
+    """
+    The maximum number of concurrent requests to *server*.  Callers that
+    fan out wider, e.g. ``--metrics-threads``, still wait for a free thread.
+    """
+    with _executors_lock:
+        return _limits.get(server, DEFAULT_LIMIT)
+
+
+def set_limit(server: str, limit: int):
+    """
+    Sets the maximum number of concurrent requests to *server*. Requests that
+    are already running on the old pool are allowed to finish.
+    """
+    with _executors_lock:
+        old = _executors.pop(server, None)
+    if old is not None:
+        old.shutdown(wait=False)
+    get_executor(server, limit)
+
+
+class AsyncGalaxy:
+    """
+    Wraps a GalaxyInstance so its API calls can be awaited.
+
+    :param gi: the connection object to the Galaxy instance
+    :param attempts: how many times each call is attempted before the last
+      transient error is raised, see *retry.DEFAULT_POLICY*.  Calls are not
+      retried here if *gi* already retries its own requests.
+    """
+
+    CLIENTS = ['jobs', 'histories', 'datasets', 'invocations', 'workflows']
+
+    def __init__(self, gi, attempts: int = None):
+        self.gi = gi
+        self.attempts = 1 if retry.retries_requests(gi) else attempts
+        self.server = cache.server_key(gi)
+        self.executor = get_executor(self.server)
+        for name in AsyncGalaxy.CLIENTS:
+            setattr(self, name, _AsyncClient(self, getattr(gi, name)))
+
+    async def call(self, f, *args, **kwargs):
+        """
+        Runs ``f(*args, **kwargs)`` on the server's thread pool, retrying
+        transient errors. See *retry.call_async*
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(f, *args, **kwargs)
+        return await retry.call_async(
+            lambda: loop.run_in_executor(self.executor, call),
+            self.attempts,
+            self.server,
+        )
+
+
+class _AsyncClient:
+    """
+    Proxies a bioblend client, e.g. ``gi.jobs``, returning coroutines.
+    """
+
+    def __init__(self, agi: AsyncGalaxy, client):
+        self._agi = agi
+        self._client = client
+
+    def __getattr__(self, name: str):
+        method = getattr(self._client, name)
+
+        async def call(*args, **kwargs):
+            return await self._agi.call(method, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+
+async def bounded_gather(limit: int, coroutines, return_exceptions: bool = False):
+    """
+    Like *asyncio.gather* but runs at most *limit* of the coroutines at once.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(
+        *[run(c) for c in coroutines], return_exceptions=return_exceptions
+    )
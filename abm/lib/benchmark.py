@@ -3,10 +3,13 @@ import json
 import logging
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 import yaml
 from bioblend.galaxy import GalaxyInstance, dataset_collections
-from lib import INVOCATIONS_DIR, METRICS_DIR, Keys
+from lib import INVOCATIONS_DIR, METRICS_DIR, Keys, async_galaxy, cache, metrics, retry
 from lib.common import (
     Context,
     _get_dataset_data,
@@ -31,21 +34,61 @@ def run_cli(context: Context, args: list):
     """
     if len(args) == 0:
         print('ERROR: no workflow configuration specified')
-        return
+        return False
 
     parser = argparse.ArgumentParser()
     parser.add_argument('workflow_path')
     parser.add_argument('-p', '--prefix')
     parser.add_argument('-e', '--experiment')
+    parser.add_argument(
+        '--parallel',
+        type=int,
+        default=1,
+        help='number of workflow runs to keep in flight at the same time',
+    )
+    parser.add_argument(
+        '--metrics-threads',
+        type=int,
+        default=metrics.DEFAULT_THREADS,
+        help='number of jobs whose metrics are fetched concurrently',
+    )
+    parser.add_argument(
+        '--metrics-db',
+        help='save job metrics to this SQLite database instead of JSON files',
+    )
+    parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        default=0,
+        help='save resolved workflow and dataset IDs to disk for this many seconds',
+    )
     a = parser.parse_args(args)
     # workflow_path = args[0]
     if not os.path.exists(a.workflow_path):
         print(f'ERROR: can not find workflow configuration {a.workflow_path}')
-        return
-    run(context, a.workflow_path, a.prefix, a.experiment)
+        return False
+    cache.configure(a.cache_ttl)
+    return run(
+        context,
+        a.workflow_path,
+        a.prefix,
+        a.experiment,
+        a.parallel,
+        a.metrics_threads,
+        a.metrics_db,
+    )
 
 
-def run(context: Context, workflow_path, history_prefix: str, experiment: str):
+def run(
+    context: Context,
+    workflow_path,
+    history_prefix: str,
+    experiment: str,
+    parallel: int = 1,
+    threads: int = metrics.DEFAULT_THREADS,
+    metrics_db: str = None,
+    ledger=None,
+):
     """
     Does the actual work of running a benchmark.
 
@@ -53,6 +96,10 @@ def run(context: Context, workflow_path, history_prefix: str, experiment: str):
     :param workflow_path: path to the ABM workflow file. (benchmark really). NOTE this is NOT the Galaxy .ga file.
     :param history_prefix: a prefix value used when generating new history names.
     :param experiment: the name of the experiment (arbitrary string). Used to generate new history names.
+    :param parallel: the maximum number of workflow runs that will be in flight at the same time.
+    :param threads: the number of jobs whose metrics are fetched concurrently after each run.
+    :param metrics_db: optional SQLite database the job metrics are saved to instead of JSON files.
+    :param ledger: optional *ledger.ItemLedger* used to record, and resume, the workflow invocations.
     :return: True if the workflow run completed successfully. False otherwise.
     """
     if os.path.exists(INVOCATIONS_DIR):
@@ -80,205 +127,427 @@ def run(context: Context, workflow_path, history_prefix: str, experiment: str):
             os.makedirs(metrics_dir, exist_ok=True)
 
     gi = connect(context)
+    limit = async_galaxy.get_limit(cache.server_key(gi))
+    if threads > limit:
+        # Requests to a server never exceed the pool_size of its profile.
+        print(
+            f"WARNING: metrics will be fetched {limit} jobs at a time, not {threads}. "
+            "Increase pool_size in the profile to fetch more at once."
+        )
     workflows = parse_workflow(workflow_path)
     if not workflows:
         print(f"Unable to load any workflow definitions from {workflow_path}")
         return False
 
     print(f"Found {len(workflows)} workflow definitions")
-    for workflow in workflows:
-        wf_name = workflow[Keys.WORKFLOW_ID]
-        wfid = find_workflow_id(gi, wf_name)
-        if wfid is None:
-            print(f"Unable to load the workflow ID for {workflow[Keys.WORKFLOW_ID]}")
-            return False
-        else:
-            print(f"Found workflow id {wfid}")
-        inputs = {}
-        input_names = []
-        history_base_name = wfid
-        if Keys.HISTORY_BASE_NAME in workflow:
-            history_base_name = workflow[Keys.HISTORY_BASE_NAME]
-        ref_data_size = []
-        if Keys.REFERENCE_DATA in workflow:
-            for spec in workflow[Keys.REFERENCE_DATA]:
-                input = gi.workflows.get_workflow_inputs(wfid, spec[Keys.NAME])
-                if input is None or len(input) == 0:
-                    print(f'ERROR: Invalid input specification for {spec[Keys.NAME]}')
-                    return False
-                dsname = spec[Keys.NAME]
-                # dsid = find_dataset_id(gi, dsname)
-                dsdata = _get_dataset_data(gi, dsname)
-                dsid = dsdata['id']
-                ref_data_size.append(dsdata['size'])
-                print(f"Reference input dataset {dsid}")
-                inputs[input[0]] = {'id': dsid, 'src': 'hda'}
-                input_names.append(dsname)
-
-        count = 0
-        for run in workflow[Keys.RUNS]:
-            count += 1
-
-            # Create a new history for this run
-            if Keys.HISTORY_NAME in run:
-                output_history_name = f"{history_base_name} {run[Keys.HISTORY_NAME]}"
+    tracker = RunTracker(parallel)
+    sink = metrics.open_sink(metrics_db)
+    try:
+        for workflow in workflows:
+            wf_name = workflow[Keys.WORKFLOW_ID]
+            wfid = find_workflow_id(gi, wf_name)
+            if wfid is None:
+                print(
+                    f"Unable to load the workflow ID for {workflow[Keys.WORKFLOW_ID]}"
+                )
+                return False
             else:
-                output_history_name = f"{history_base_name} run {count}"
-            new_history_name = output_history_name
-            if history_prefix is not None:
-                new_history_name = f"{history_prefix} {output_history_name}"
-            if experiment is not None:
-                new_history_name = f"{experiment} {new_history_name}"
-
-            input_data_size = []
-            if Keys.INPUTS in run and run[Keys.INPUTS] is not None:
-                for spec in run[Keys.INPUTS]:
+                print(f"Found workflow id {wfid}")
+            inputs = {}
+            input_names = []
+            history_base_name = wfid
+            if Keys.HISTORY_BASE_NAME in workflow:
+                history_base_name = workflow[Keys.HISTORY_BASE_NAME]
+            ref_data_size = []
+            if Keys.REFERENCE_DATA in workflow:
+                for spec in workflow[Keys.REFERENCE_DATA]:
                     input = gi.workflows.get_workflow_inputs(wfid, spec[Keys.NAME])
                     if input is None or len(input) == 0:
                         print(
                             f'ERROR: Invalid input specification for {spec[Keys.NAME]}'
                         )
                         return False
+                    dsname = spec[Keys.NAME]
+                    # dsid = find_dataset_id(gi, dsname)
+                    dsdata = _get_dataset_data(gi, dsname)
+                    dsid = dsdata['id']
+                    ref_data_size.append(dsdata['size'])
+                    print(f"Reference input dataset {dsid}")
+                    inputs[input[0]] = {'id': dsid, 'src': 'hda'}
+                    input_names.append(dsname)
 
-                    if 'value' in spec:
-                        inputs[input[0]] = spec['value']
-                        print(f"Input data value: {spec['value']}")
-                    elif 'collection' in spec:
-                        dsname = spec['collection']
-                        input_names.append(dsname)
-                        # inputs.append(dsname)
-                        # dsid = find_dataset_id(gi, dsname)
-                        dsid = find_collection_id(gi, dsname)
-                        dsdata = _get_dataset_data(gi, dsid)
-                        if dsdata is None:
-                            # raise Exception(
-                            #     f"ERROR: unable to resolve {dsname} to a dataset."
-                            # )
-                            dssize = 0
-                        else:
-                            dsid = dsdata['id']
-                            dssize = dsdata['size']
-                        input_data_size.append(dssize)
-                        print(f"Input collection ID: {dsname} [{dsid}] {dssize}")
-                        inputs[input[0]] = {'id': dsid, 'src': 'hdca'}
-                    elif 'paired' in spec:
-                        name = spec['name']
-                        input_names.append(name)
-                        dsdata = _get_dataset_data(gi, name)
-                        if dsdata is not None:
-                            print(f"Found an existing dataset named {name}")
-                            print_json(dsdata)
-                            # Reuse the previously defined collection
-                            dsid = dsdata['id']
-                            dssize = dsdata['size']
+            count = 0
+            for run in workflow[Keys.RUNS]:
+                count += 1
+
+                # Create a new history for this run
+                if Keys.HISTORY_NAME in run:
+                    output_history_name = (
+                        f"{history_base_name} {run[Keys.HISTORY_NAME]}"
+                    )
+                else:
+                    output_history_name = f"{history_base_name} run {count}"
+                new_history_name = output_history_name
+                if history_prefix is not None:
+                    new_history_name = f"{history_prefix} {output_history_name}"
+                if experiment is not None:
+                    new_history_name = f"{experiment} {new_history_name}"
+
+                # Check the ledger before the inputs are resolved, which may
+                # create collections.
+                if ledger is not None:
+                    previous = ledger.invocation(new_history_name)
+                    if previous is not None and previous['state'] == 'complete':
+                        print(f"Skipping completed run in history {new_history_name}")
+                        continue
+
+                # Each run gets its own copy of the inputs since runs may be in
+                # flight concurrently.
+                run_inputs = dict(inputs)
+                run_input_names = list(input_names)
+                input_data_size = []
+                if Keys.INPUTS in run and run[Keys.INPUTS] is not None:
+                    for spec in run[Keys.INPUTS]:
+                        input = gi.workflows.get_workflow_inputs(wfid, spec[Keys.NAME])
+                        if input is None or len(input) == 0:
+                            print(
+                                f'ERROR: Invalid input specification for {spec[Keys.NAME]}'
+                            )
+                            return False
+
+                        if 'value' in spec:
+                            run_inputs[input[0]] = spec['value']
+                            print(f"Input data value: {spec['value']}")
+                        elif 'collection' in spec:
+                            dsname = spec['collection']
+                            run_input_names.append(dsname)
+                            # inputs.append(dsname)
+                            # dsid = find_dataset_id(gi, dsname)
+                            dsid = find_collection_id(gi, dsname)
+                            dsdata = _get_dataset_data(gi, dsid)
+                            if dsdata is None:
+                                # raise Exception(
+                                #     f"ERROR: unable to resolve {dsname} to a dataset."
+                                # )
+                                dssize = 0
+                            else:
+                                dsid = dsdata['id']
+                                dssize = dsdata['size']
                             input_data_size.append(dssize)
-                            print(f"Input dataset ID: {name} [{dsid}] {dssize}")
-                            inputs[input[0]] = {
-                                'id': dsid,
-                                'src': 'hdca',
-                            }
-                        else:
-                            histories = gi.histories.get_histories(name=spec['history'])
-                            if len(histories) == 0:
-                                print(f"ERROR: History {spec['history']} not foune")
-                                return False
-                            hid = histories[0]['id']
-                            pairs = 0
-                            paired_list = spec['paired']
-                            for item in paired_list:
-                                elements = []
-                                size = 0
-                                for key in item.keys():
-                                    # print(f"Getting dataset for {key} = {item[key]}")
-                                    value = _get_dataset_data(gi, item[key])
-                                    if value is None:
-                                        print(
-                                            f"ERROR: Unable to find dataset {item[key]}"
+                            print(f"Input collection ID: {dsname} [{dsid}] {dssize}")
+                            run_inputs[input[0]] = {'id': dsid, 'src': 'hdca'}
+                        elif 'paired' in spec:
+                            name = spec['name']
+                            run_input_names.append(name)
+                            dsdata = _get_dataset_data(gi, name)
+                            if dsdata is not None:
+                                print(f"Found an existing dataset named {name}")
+                                print_json(dsdata)
+                                # Reuse the previously defined collection
+                                dsid = dsdata['id']
+                                dssize = dsdata['size']
+                                input_data_size.append(dssize)
+                                print(f"Input dataset ID: {name} [{dsid}] {dssize}")
+                                run_inputs[input[0]] = {
+                                    'id': dsid,
+                                    'src': 'hdca',
+                                }
+                            else:
+                                histories = gi.histories.get_histories(
+                                    name=spec['history']
+                                )
+                                if len(histories) == 0:
+                                    print(f"ERROR: History {spec['history']} not foune")
+                                    return False
+                                hid = histories[0]['id']
+                                pairs = 0
+                                paired_list = spec['paired']
+                                for item in paired_list:
+                                    elements = []
+                                    size = 0
+                                    for key in item.keys():
+                                        # print(f"Getting dataset for {key} = {item[key]}")
+                                        value = _get_dataset_data(gi, item[key])
+                                        if value is None:
+                                            print(
+                                                f"ERROR: Unable to find dataset {item[key]}"
+                                            )
+                                            return False
+                                        if size in value:
+                                            size += value['size']
+                                        elements.append(
+                                            _make_dataset_element(key, value['id'])
                                         )
-                                        return
-                                    if size in value:
-                                        size += value['size']
-                                    elements.append(
-                                        _make_dataset_element(key, value['id'])
+                                    description = dataset_collections.CollectionDescription(
+                                        name=name,
+                                        # type='paired',
+                                        elements=elements,
                                     )
-                                description = dataset_collections.CollectionDescription(
-                                    name=name,
-                                    # type='paired',
-                                    elements=elements,
-                                )
-                                pairs += 1
-                                # print(json.dumps(description.__dict__, indent=4))
-                                # pprint(description)
-                                collection = gi.histories.create_dataset_collection(
-                                    history_id=hid, collection_description=description
-                                )
-                                print(
-                                    f"Input dataset paired list: {collection['id']} {size}"
+                                    pairs += 1
+                                    # print(json.dumps(description.__dict__, indent=4))
+                                    # pprint(description)
+                                    collection = gi.histories.create_dataset_collection(
+                                        history_id=hid,
+                                        collection_description=description,
+                                    )
+                                    print(
+                                        f"Input dataset paired list: {collection['id']} {size}"
+                                    )
+                                    run_inputs[input[0]] = {
+                                        'id': collection['id'],
+                                        'src': 'hdca',
+                                    }
+                        elif Keys.DATASET_ID in spec:
+                            dsname = spec[Keys.DATASET_ID]
+                            run_input_names.append(dsname)
+                            # inputs.append(dsname)
+                            # dsid = find_dataset_id(gi, dsname)
+                            dsdata = _get_dataset_data(gi, dsname)
+                            if dsdata is None:
+                                raise Exception(
+                                    f"ERROR: unable to resolve {dsname} to a dataset."
                                 )
-                                inputs[input[0]] = {
-                                    'id': collection['id'],
-                                    'src': 'hdca',
-                                }
-                    elif Keys.DATASET_ID in spec:
-                        dsname = spec[Keys.DATASET_ID]
-                        input_names.append(dsname)
-                        # inputs.append(dsname)
-                        # dsid = find_dataset_id(gi, dsname)
-                        dsdata = _get_dataset_data(gi, dsname)
-                        if dsdata is None:
-                            raise Exception(
-                                f"ERROR: unable to resolve {dsname} to a dataset."
-                            )
-                        dsid = dsdata['id']
-                        dssize = dsdata['size']
-                        input_data_size.append(dssize)
-                        print(f"Input dataset ID: {dsname} [{dsid}] {dssize}")
-                        inputs[input[0]] = {'id': dsid, 'src': 'hda'}
-                    else:
-                        raise Exception(f'Invalid input value')
-            print(f"Running workflow {wfid} in history {new_history_name}")
-            f = lambda: gi.workflows.invoke_workflow(
-                wfid, inputs=inputs, history_name=new_history_name
-            )
-            invocation = try_for(f, 3)
-            id = invocation['id']
-            # invocations = gi.invocations.wait_for_invocation(id, 86400, 10, False)
-            f = lambda: gi.invocations.wait_for_invocation(id, 86400, 10, False)
-            try:
-                invocations = try_for(f, 2)
-            except Exception as e:
-                print(f"Exception waiting for invocations")
-                pprint(invocation)
-                sys.exc_info()
-                raise e
-            print("Waiting for jobs")
-            if history_prefix is not None:
-                parts = history_prefix.split()
-                invocations['run'] = parts[0]
-                if len(parts) > 1:
-                    invocations['cloud'] = parts[1]
-                else:
-                    invocations['cloud'] = 'Unknown'
-                if len(parts) > 2:
-                    invocations['job_conf'] = parts[2]
+                            dsid = dsdata['id']
+                            dssize = dsdata['size']
+                            input_data_size.append(dssize)
+                            print(f"Input dataset ID: {dsname} [{dsid}] {dssize}")
+                            run_inputs[input[0]] = {'id': dsid, 'src': 'hda'}
+                        else:
+                            raise Exception(f'Invalid input value')
+                print(f"Running workflow {wfid} in history {new_history_name}")
+                if history_prefix is not None:
+                    parts = history_prefix.split()
+                    details = {
+                        'run': parts[0],
+                        'cloud': parts[1] if len(parts) > 1 else 'Unknown',
+                        'job_conf': parts[2] if len(parts) > 2 else 'Default',
+                    }
                 else:
-                    invocations['job_conf'] = 'Default'
-            else:
-                invocations['run'] = 0
-                invocations['cloud'] = "N/A"
-                invocations['job_conf'] = "Unknown"
-            invocations['output_dir'] = metrics_dir
-            invocations['inputs'] = ' '.join(input_names)
-            invocations['ref_data_size'] = ref_data_size
-            invocations['input_data_size'] = input_data_size
-            # TODO Change this output path. (Change it to what? KS)
-            output_path = os.path.join(invocations_dir, id + '.json')
-            with open(output_path, 'w') as f:
-                json.dump(invocations, f, indent=4)
-                print(f"Wrote invocation data to {output_path}")
-            wait_for_jobs(context, gi, invocations)
+                    details = {'run': 0, 'cloud': "N/A", 'job_conf': "Unknown"}
+                details['output_dir'] = metrics_dir
+                details['inputs'] = ' '.join(run_input_names)
+                details['ref_data_size'] = ref_data_size
+                details['input_data_size'] = input_data_size
+                tracker.submit(
+                    new_history_name,
+                    _invoke_and_wait,
+                    context,
+                    gi,
+                    wfid,
+                    run_inputs,
+                    new_history_name,
+                    details,
+                    invocations_dir,
+                    threads,
+                    sink,
+                    ledger,
+                )
+    finally:
+        completed = tracker.wait()
+        sink.close()
+        cache.get_resolution_cache().save()
     print("Benchmarking run complete")
-    return True
+    return completed
+
+
+# Invocations in these states will not produce results, see _invoke_and_wait
+FAILED_INVOCATION_STATES = ['failed', 'cancelled']
+
+
+def _invoke_and_wait(
+    context: Context,
+    gi: GalaxyInstance,
+    wfid: str,
+    inputs: dict,
+    history_name: str,
+    details: dict,
+    invocations_dir: str,
+    threads: int = metrics.DEFAULT_THREADS,
+    sink=None,
+    ledger=None,
+):
+    """
+    Invokes a single workflow run and blocks until all of its jobs are in a
+    terminal state and their metrics have been collected.
+
+    If the *ledger* shows the workflow was already invoked in *history_name*
+    but did not finish, that invocation is waited for instead.
+
+    :param context: a context object the defines how to connect to the Galaxy server.
+    :param gi: the connection object to the Galaxy instance
+    :param wfid: the Galaxy ID of the workflow to invoke
+    :param inputs: the workflow inputs for this run
+    :param history_name: the name of the history that will be created for the run
+    :param details: run, cloud, job_conf and input information recorded with the invocation
+    :param invocations_dir: where the invocation data will be saved
+    :param threads: the number of jobs whose metrics are fetched concurrently
+    :param sink: where the job metrics are saved. See *metrics.open_sink*
+    :param ledger: optional *ledger.ItemLedger* the invocation is recorded in
+    :return: the ID of the history the workflow was run in
+    """
+    previous = None
+    if ledger is not None:
+        previous = ledger.invocation(history_name)
+    if previous is not None and previous['state'] == 'invoked':
+        invocation = {'id': previous['invocation_id']}
+        print(f"Reattaching to invocation {invocation['id']} in {history_name}")
+    else:
+        invocation = _invoke_workflow(gi, wfid, inputs, history_name)
+        if ledger is not None:
+            ledger.invoked(history_name, invocation['id'])
+    id = invocation['id']
+    # Runs that are interrupted, or fail while waiting, stay 'invoked' in the
+    # ledger so --resume reattaches to the invocation that may still be
+    # running on the server instead of starting another one.
+    # invocations = gi.invocations.wait_for_invocation(id, 86400, 10, False)
+    f = lambda: gi.invocations.wait_for_invocation(id, 86400, 10, False)
+    try:
+        invocations = try_for(f, gi=gi)
+    except Exception as e:
+        print(f"Exception waiting for invocations")
+        pprint(invocation)
+        sys.exc_info()
+        raise e
+    print("Waiting for jobs")
+    invocations.update(details)
+    # TODO Change this output path. (Change it to what? KS)
+    output_path = os.path.join(invocations_dir, id + '.json')
+    with open(output_path, 'w') as f:
+        json.dump(invocations, f, indent=4)
+        print(f"Wrote invocation data to {output_path}")
+    wait_for_jobs(context, gi, invocations, threads, sink)
+    if ledger is not None:
+        # Only the server can say the invocation failed.
+        ok = invocations.get('state') not in FAILED_INVOCATION_STATES
+        ledger.invocation_finished(history_name, id, ok)
+    return invocations['history_id']
+
+
+def _invoke_workflow(gi: GalaxyInstance, wfid: str, inputs: dict, history_name: str):
+    """
+    Invokes the workflow once.  Invoking is not idempotent, so the request is
+    never sent again: if it fails with a transient error the server may still
+    have created the invocation, which is looked up in the history instead.
+    History names are reused by later runs, so only an invocation created
+    after this request was sent is accepted.
+
+    :return: the invocation
+    """
+    sent = _utcnow()
+    try:
+        return gi.workflows.invoke_workflow(
+            wfid, inputs=inputs, history_name=history_name
+        )
+    except Exception as e:
+        if not retry.is_retryable(e):
+            raise
+        invocation = _find_invocation(gi, wfid, history_name, sent)
+        if invocation is None:
+            raise
+        print(f"Found invocation {invocation['id']} despite the error: {e}")
+        return invocation
+
+
+def _find_invocation(gi: GalaxyInstance, wfid: str, history_name: str, since: datetime):
+    """
+    Returns the newest invocation of the workflow, created at or after
+    *since*, in a history named *history_name* created at or after *since*,
+    or None.
+    """
+    for history in gi.histories.get_histories(name=history_name):
+        if not _created_since(history, since):
+            continue
+        invocations = [
+            invocation
+            for invocation in gi.invocations.get_invocations(
+                workflow_id=wfid, history_id=history['id']
+            )
+            if _created_since(invocation, since)
+        ]
+        if len(invocations) > 0:
+            return max(invocations, key=lambda i: i['create_time'])
+    return None
+
+
+def _utcnow() -> datetime:
+    """
+    The current time in UTC without a time zone, like Galaxy's create_time.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _created_since(item: dict, since: datetime) -> bool:
+    """
+    True if the *create_time* of a Galaxy history or invocation is at or
+    after *since*.  Items without a valid create_time are never accepted.
+    """
+    try:
+        created = datetime.fromisoformat(item['create_time'])
+    except (KeyError, TypeError, ValueError):
+        return False
+    if created.tzinfo is not None:
+        created = created.astimezone(timezone.utc).replace(tzinfo=None)
+    return created >= since
+
+
+class RunTracker:
+    """
+    Keeps up to *parallel* workflow runs in flight and records the outcome of
+    each run as its history finishes.
+
+    With *parallel* set to 1 runs are executed in the calling thread, one
+    after the other, exactly as before.
+    """
+
+    def __init__(self, parallel: int = 1):
+        self.parallel = max(1, parallel)
+        self.submitted = 0
+        self.finished = []
+        self.failed = []
+        self._lock = threading.Lock()
+        self._executor = None
+        if self.parallel > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.parallel)
+
+    def submit(self, name: str, f, *args):
+        """
+        Schedules *f* to be called with *args*. Blocks until the run is complete
+        when running serially.
+
+        :param name: the history name, used when reporting progress
+        :param f: the function that performs the run
+        """
+        self.submitted += 1
+        if self._executor is None:
+            self._record(name, f(*args), None)
+            return
+        future = self._executor.submit(f, *args)
+        future.add_done_callback(lambda fut: self._done(name, fut))
+
+    def _done(self, name: str, future):
+        error = future.exception()
+        self._record(name, None if error else future.result(), error)
+
+    def _record(self, name: str, history_id, error):
+        with self._lock:
+            if error is None:
+                self.finished.append(history_id)
+            else:
+                self.failed.append(name)
+                print(f"ERROR: run {name} failed: {error}")
+            done = len(self.finished) + len(self.failed)
+            print(f"Finished {done} of {self.submitted} runs: {name}")
+
+    def wait(self) -> bool:
+        """
+        Blocks until all submitted runs have finished.
+
+        :return: True if none of the runs failed. False otherwise.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        return len(self.failed) == 0
 
 
 def translate(context: Context, args: list):
@@ -444,42 +713,27 @@ def validate(context: Context, args: list):
     return total_errors == 0
 
 
-def wait_for_jobs(context, gi: GalaxyInstance, invocations: dict):
+def wait_for_jobs(
+    context,
+    gi: GalaxyInstance,
+    invocations: dict,
+    threads: int = metrics.DEFAULT_THREADS,
+    sink=None,
+):
     """Blocks until all jobs defined in *invocations* are complete (in a terminal state).
 
     :param gi: The *GalaxyInstance** running the jobs
     :param invocations: a dictionary containing information about the jobs invoked
+    :param threads: the number of jobs whose metrics are fetched concurrently
+    :param sink: where the job metrics are saved. JSON files by default.
     :return:
     """
-    wfid = invocations['workflow_id']
     hid = invocations['history_id']
-    run = invocations['run']
-    cloud = invocations['cloud']
-    conf = invocations['job_conf']
-    inputs = invocations['inputs']
-    output_dir = invocations['output_dir']
     wait_for(gi, hid)
-    jobs = gi.jobs.get_jobs(history_id=hid)
-    for job in jobs:
-        data = gi.jobs.show_job(job['id'], full_details=True)
-        data['job_metrics'] = gi.jobs.get_metrics(job['id'])
-        metrics = {
-            'run': run,
-            'cloud': cloud,
-            'job_conf': conf,
-            'workflow_id': wfid,
-            'history_id': hid,
-            'inputs': inputs,
-            'metrics': data,
-            'status': job['state'],
-            'server': context.GALAXY_SERVER,
-            'ref_data_size': invocations['ref_data_size'],
-            'input_data_size': invocations['input_data_size'],
-        }
-        output_path = os.path.join(output_dir, f"{job['id']}.json")
-        with open(output_path, "w") as f:
-            json.dump(metrics, f, indent=4)
-            print(f"Wrote metrics to {output_path}")
+    jobs = try_for(lambda: gi.jobs.get_jobs(history_id=hid), gi=gi)
+    failed = metrics.harvest(context, gi, invocations, jobs, threads, sink)
+    if failed > 0:
+        print(f"WARNING: unable to collect metrics for {failed} jobs in {hid}")
 
     # for step in invocations['steps']:
     #     job_id = step['job_id']
@@ -550,6 +804,12 @@ def find_workflow_id(gi, name_or_id):
     :param name_or_id: the name of the workflow
     :return: The Galaxy workflow ID or None if the workflow could not be located
     """
+    return cache.resolve(
+        gi, cache.WORKFLOW, name_or_id, lambda: _find_workflow_id(gi, name_or_id)
+    )
+
+
+def _find_workflow_id(gi, name_or_id):
     try:
         wf = gi.workflows.show_workflow(name_or_id)
         return wf['id']
@@ -582,6 +842,12 @@ def find_dataset_id(gi, name_or_id):
     :param name_or_id: the name of the dataset.
     :return: the Galaxy dataset ID or None if the dataset could not be located.
     """
+    return cache.resolve(
+        gi, cache.DATASET, name_or_id, lambda: _find_dataset_id(gi, name_or_id)
+    )
+
+
+def _find_dataset_id(gi, name_or_id):
     try:
         ds = gi.datasets.show_dataset(name_or_id)
         return ds['id']
@@ -617,23 +883,238 @@ def find_collection_id(gi, name):
     :return: The unique Galaxy ID of the collection or None if the collection
     can not be located.
     """
-    active_histories = _get_active_history_ids(gi)
-    kwargs = {'limit': 10000, 'offset': 0}
-    datasets = gi.datasets.get_datasets(**kwargs)
-    if len(datasets) == 0:
-        print('No datasets found')
-        return None
-    for dataset in datasets:
-        if dataset['type'] == 'collection' and dataset['name'].strip() == name:
+    return cache.resolve(
+        gi, cache.COLLECTION, name, lambda: _find_collection_id(gi, name)
+    )
+
+
+def _find_collection_id(gi, name):
+    return get_collection_index(gi).find(gi, name)
+
+
+# CollectionIndex objects for each Galaxy server and user.
+_collection_indexes = {}
+_collection_indexes_lock = threading.Lock()
+
+
+def get_collection_index(gi):
+    """
+    Returns the CollectionIndex for the server *gi* is connected to and the
+    user of its API key.
+    """
+    server = cache.scope_key(gi)
+    with _collection_indexes_lock:
+        if server not in _collection_indexes:
+            _collection_indexes[server] = CollectionIndex()
+        return _collection_indexes[server]
+
+
+class CollectionIndex:
+    """
+    Finds dataset collections by name without loading every dataset on the
+    server.
+
+    Lookups first ask the server for collections with the given name, one page
+    at a time, and stop at the first valid match.  If that fails, for example
+    because the stored name has surrounding whitespace, the dataset list is
+    scanned page by page, again stopping at the first match.  Like the old
+    lookup, at most *scan_limit* datasets are scanned, so a misspelled name
+    does not page through every dataset on the server.  Every collection seen
+    along the way is added to a name to candidates map so later lookups
+    usually need no dataset listing at all, and a scan that was stopped early
+    is resumed where it left off.
+
+    Cached candidates are checked with the server before they are used, since
+    they may have been deleted.  Pages are fetched without holding the lock,
+    so parallel lookups scan different pages instead of waiting on each other.
+
+    Only the histories of candidate collections are checked, and each history
+    is only checked once.
+    """
+
+    PAGE_SIZE = 500
+
+    # The old lookup only considered the first 10,000 datasets.
+    SCAN_LIMIT = 10000
+
+    def __init__(self, page_size: int = PAGE_SIZE, scan_limit: int = SCAN_LIMIT):
+        self.page_size = page_size
+        self.scan_limit = scan_limit
+        self.candidates = {}
+        self.active_histories = {}
+        self.scan_offset = 0
+        self.scan_complete = False
+        self.scan_limited = False
+        # Offsets of pages that failed and must be fetched again.
+        self._retry_offsets = []
+        self._fetching = 0
+        self._lock = threading.Condition()
+
+    def find(self, gi, name: str):
+        """
+        :return: the ID of a valid collection named *name* or None
+        """
+        with self._lock:
+            cached = list(self.candidates.get(name, []))
+        dsid = self._first_valid(gi, cached, refresh=True)
+        if dsid is not None:
+            return dsid
+        pages = self._pages(gi, name=name, visible=True, deleted=False)
+        for page in pages:
+            with self._lock:
+                matches = self._add(page, name)
+            dsid = self._first_valid(gi, matches)
+            if dsid is not None:
+                return dsid
+        return self._scan(gi, name)
+
+    def _scan(self, gi, name: str):
+        """
+        Continues the scan of the dataset list until a valid collection named
+        *name* is found or the scan is complete.
+        """
+        while True:
+            with self._lock:
+                offset = self._claim()
+                if offset is None:
+                    # Wait for the pages other lookups are still fetching.
+                    while self._fetching > 0:
+                        self._lock.wait()
+                    matches = list(self.candidates.get(name, []))
+                    break
+                self._fetching += 1
+            try:
+                page = self._get_page(gi, offset)
+            except Exception:
+                with self._lock:
+                    self._fetching -= 1
+                    self._retry_offsets.append(offset)
+                    self._lock.notify_all()
+                raise
+            with self._lock:
+                self._fetching -= 1
+                if len(page) < self.page_size:
+                    self.scan_complete = True
+                    self.scan_offset = min(self.scan_offset, offset + len(page))
+                matches = self._add(page, name)
+                self._lock.notify_all()
+            dsid = self._first_valid(gi, matches)
+            if dsid is not None:
+                return dsid
+        # Collections found by other lookups while this one was waiting.
+        return self._first_valid(gi, matches)
+
+    def _claim(self):
+        """
+        Returns the offset of the next page to scan, or None if there is
+        nothing left to scan.  Must be called with the lock held.
+        """
+        if len(self._retry_offsets) > 0:
+            return self._retry_offsets.pop()
+        if self.scan_complete:
+            return None
+        if self.scan_offset >= self.scan_limit:
+            if not self.scan_limited:
+                self.scan_limited = True
+                print(
+                    f"WARNING: stopped looking for collections after {self.scan_limit} datasets"
+                )
+            return None
+        offset = self.scan_offset
+        self.scan_offset += self.page_size
+        return offset
+
+    def _pages(self, gi, **filters):
+        offset = 0
+        while True:
+            page = self._get_page(gi, offset, **filters)
+            yield page
+            if len(page) < self.page_size:
+                return
+            offset += len(page)
+
+    def _get_page(self, gi, offset: int, **filters) -> list:
+        return try_for(
+            lambda: gi.datasets.get_datasets(
+                limit=self.page_size, offset=offset, **filters
+            ),
+            gi=gi,
+        )
+
+    def _add(self, page: list, name: str) -> list:
+        """
+        Indexes the collections in *page* and returns those named *name*.
+        Must be called with the lock held.
+        """
+        matches = []
+        for dataset in page:
+            if dataset.get('type') != 'collection':
+                continue
+            key = dataset['name'].strip()
+            known = self.candidates.setdefault(key, [])
+            if all(c['id'] != dataset['id'] for c in known):
+                known.append(dataset)
+            if key == name:
+                matches.append(dataset)
+        return matches
+
+    def _first_valid(self, gi, collections: list, refresh: bool = False):
+        """
+        :param refresh: fetch the current state of each collection before it
+          is returned, for collections that were cached by earlier lookups.
+        """
+        for dataset in collections:
             if (
-                dataset['populated_state'] == 'ok'
-                and not dataset['deleted']
-                and dataset['visible']
+                self._usable(dataset)
+                and self._history_active(gi, dataset.get('history_id'))
+                and (not refresh or self._refresh(gi, dataset))
             ):
-                if dataset.get('history_id') not in active_histories:
-                    continue
                 return dataset['id']
-    return None
+        return None
+
+    @staticmethod
+    def _usable(dataset: dict) -> bool:
+        return (
+            dataset.get('populated_state') == 'ok'
+            and not dataset.get('deleted')
+            and dataset.get('visible')
+        )
+
+    def _refresh(self, gi, dataset: dict) -> bool:
+        """
+        Updates a cached collection with its current state on the server and
+        returns True if it can still be used.  Collections that no longer
+        exist, or can no longer be used, are removed from the index.
+        """
+        try:
+            current = gi.histories.show_dataset_collection(
+                dataset['history_id'], dataset['id']
+            )
+        except Exception:
+            current = None
+        with self._lock:
+            if current is not None:
+                for key in ['populated_state', 'deleted', 'visible']:
+                    if key in current:
+                        dataset[key] = current[key]
+                if self._usable(dataset):
+                    return True
+            known = self.candidates.get(dataset['name'].strip(), [])
+            if dataset in known:
+                known.remove(dataset)
+        return False
+
+    def _history_active(self, gi, history_id: str) -> bool:
+        if history_id is None:
+            return False
+        if history_id not in self.active_histories:
+            try:
+                history = gi.histories.show_history(history_id)
+                active = not history.get('deleted') and not history.get('purged')
+            except Exception:
+                active = False
+            self.active_histories[history_id] = active
+        return self.active_histories[history_id]
 
 
 from pprint import pprint
@@ -0,0 +1,266 @@
+"""
+Caches the results of resolving workflow, dataset and collection names to
+Galaxy IDs.
+
+A benchmark resolves the same names for every run of every workflow, for every
+run number and job configuration in an experiment.  The ResolutionCache keeps
+the results, per Galaxy server and user, for the life of the process so each
+name is looked up once.  ``abm batch --listen`` starts every client with an
+empty cache.  When a TTL is configured the cache is also saved to
+``~/.abm/cache/resolutions.json`` and entries younger than the TTL are reused
+by later processes.  ``abm <cloud> cache clear`` removes entries that are no
+longer valid.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import lib
+
+CACHE_DIR = '~/.abm/cache'
+RESOLUTIONS_FILE = 'resolutions.json'
+
+# The kinds of names that are cached.
+WORKFLOW = 'workflow'
+DATASET = 'dataset'
+DATASET_DATA = 'dataset_data'
+COLLECTION = 'collection'
+KINDS = [WORKFLOW, DATASET, DATASET_DATA, COLLECTION]
+
+# The kind used to clear the job cache.  See job_cache.JobCache
+JOBS = 'jobs'
+
+
+class ResolutionCache:
+    """
+    A thread safe map of (server, kind, name) to the resolved value.  The
+    server is a *scope_key*, the server URL and the user the names were
+    resolved for, since workflows and datasets are visible per user.
+
+    :param path: the file the cache is saved to, or None to keep the cache in
+      memory only.
+    :param ttl: the number of seconds saved entries remain valid for.
+    """
+
+    def __init__(self, path: str = None, ttl: float = 0):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path is not None and ttl > 0:
+            self._load()
+
+    def resolve(self, server: str, kind: str, name: str, lookup):
+        """
+        Returns the cached value for *name*, calling *lookup* to resolve the
+        name if it has not been cached.  Names that can not be resolved (the
+        lookup returns None) are not cached.
+        """
+        if name is None:
+            return lookup()
+        key = self._key(server, kind, name)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and not self._expired(entry):
+                self.hits += 1
+                return entry['value']
+            self.misses += 1
+        value = lookup()
+        if value is not None:
+            with self._lock:
+                self.entries[key] = {'value': value, 'time': time.time()}
+        return value
+
+    def invalidate(self, server: str = None, kind: str = None, name: str = None) -> int:
+        """
+        Removes the entries that match all of the given values.
+
+        :return: the number of entries removed.
+        """
+        with self._lock:
+            keys = [
+                key for key in self.entries if self._matches(key, server, kind, name)
+            ]
+            for key in keys:
+                del self.entries[key]
+        return len(keys)
+
+    def list(self) -> list:
+        """
+        Returns (server, kind, name, value, age) tuples for every entry.
+        """
+        now = time.time()
+        with self._lock:
+            items = list(self.entries.items())
+        return [
+            (*json.loads(key), entry['value'], now - entry['time'])
+            for key, entry in items
+        ]
+
+    def save(self):
+        """
+        Saves the unexpired entries if the cache is persistent.
+        """
+        if self.path is None or self.ttl <= 0:
+            return
+        with self._lock:
+            entries = {
+                key: entry
+                for key, entry in self.entries.items()
+                if not self._expired(entry)
+            }
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.replace(temp_path, self.path)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except Exception as e:
+            print(f"WARNING: ignoring unreadable cache {self.path}: {e}")
+            return
+        self.entries = {
+            key: entry for key, entry in entries.items() if not self._expired(entry)
+        }
+
+    def _expired(self, entry: dict) -> bool:
+        return self.ttl > 0 and time.time() - entry['time'] > self.ttl
+
+    @staticmethod
+    def _key(server: str, kind: str, name: str) -> str:
+        # JSON so the keys can be saved as they are.
+        return json.dumps([server, kind, name])
+
+    @staticmethod
+    def _matches(key: str, server: str, kind: str, name: str) -> bool:
+        s, k, n = json.loads(key)
+        return (
+            (server is None or _url(s) == server)
+            and (kind is None or k == kind)
+            and (name is None or n == name)
+        )
+
+
+def get_resolution_cache() -> ResolutionCache:
+    """
+    Returns the ResolutionCache shared by everything in this process.
+    """
+    if lib.resolutions is None:
+        lib.resolutions = ResolutionCache()
+    return lib.resolutions
+
+
+def configure(ttl: float):
+    """
+    Makes the shared cache persistent with the given TTL in seconds. A TTL of
+    zero keeps the cache in memory only.
+    """
+    path = os.path.join(os.path.expanduser(CACHE_DIR), RESOLUTIONS_FILE)
+    cache = get_resolution_cache()
+    if cache.ttl == ttl and (ttl <= 0 or cache.path == path):
+        return cache
+    lib.resolutions = ResolutionCache(path, ttl)
+    # Keep anything resolved so far.
+    lib.resolutions.entries = {**cache.entries, **lib.resolutions.entries}
+    return lib.resolutions
+
+
+def reset():
+    """
+    Discards the names resolved so far by this process.  Entries saved with a
+    TTL are loaded again by the next *configure*.
+    """
+    lib.resolutions = None
+
+
+def resolve(gi, kind: str, name: str, lookup):
+    """
+    Resolves *name* on the server *gi* is connected to, for the user of its
+    API key, using the shared cache.
+    """
+    return get_resolution_cache().resolve(scope_key(gi), kind, name, lookup)
+
+
+def scope_key(gi) -> str:
+    """
+    The *server_key* of *gi* followed by a hash of its API key, so users of
+    the same server do not share resolved names.
+    """
+    key = getattr(gi, 'key', None)
+    if not isinstance(key, str):
+        return server_key(gi)
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+    return f"{server_key(gi)} {digest}"
+
+
+def _url(scope: str) -> str:
+    # The server URL of a scope_key, which can not contain a space.
+    return scope.split(' ', 1)[0]
+
+
+def server_key(gi) -> str:
+    """
+    The key used for the server *gi* is connected to. *gi* may also be the
+    server URL.
+    """
+    return str(getattr(gi, 'base_url', gi)).rstrip('/')
+
+
+def show(context, args: list):
+    """
+    Lists the cached name resolutions, and the number of cached jobs, for the
+    current Galaxy server.
+    """
+    cache = _load_saved()
+    for scope, kind, name, value, age in cache.list():
+        if _url(scope) != server_key(context.GALAXY_SERVER):
+            continue
+        if isinstance(value, dict):
+            value = value.get('id')
+        print(f"{kind}\t{name}\t{value}\t{int(age)}s")
+    from lib import job_cache
+
+    count = job_cache.get_job_cache().count(server_key(context.GALAXY_SERVER))
+    print(f"{JOBS}\t{count} cached jobs")
+
+
+def clear(context, args: list):
+    """
+    Removes cached name resolutions, for every user, or cached jobs, for the
+    current Galaxy server.  Everything is removed if no kind is given.
+    """
+    from lib import job_cache
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('kind', nargs='?', choices=KINDS + [JOBS])
+    parser.add_argument('name', nargs='?')
+    argv = parser.parse_args(args)
+    server = server_key(context.GALAXY_SERVER)
+    count = 0
+    if argv.kind is None or argv.kind == JOBS:
+        count += job_cache.get_job_cache().clear(server)
+    if argv.kind != JOBS:
+        cache = _load_saved()
+        count += cache.invalidate(server, argv.kind, argv.name)
+        cache.save()
+        get_resolution_cache().invalidate(server, argv.kind, argv.name)
+    print(f"Removed {count} cached entries")
+
+
+def _load_saved() -> ResolutionCache:
+    # An infinite TTL so every saved entry is listed or cleared.
+    path = os.path.join(os.path.expanduser(CACHE_DIR), RESOLUTIONS_FILE)
+    return ResolutionCache(path, float('inf'))
@@ -1,13 +1,16 @@
+import asyncio
 import json
 import os
-import subprocess
 import sys
+import threading
+from collections import OrderedDict
 from math import ceil
 from pathlib import Path
 
-import bioblend.galaxy
 import lib
 from bioblend.galaxy import dataset_collections
+from lib import cache, connection, job_cache, retry, shell
+from lib.async_galaxy import AsyncGalaxy
 from ruamel.yaml import YAML
 
 # Where we will look for our configuration file.
@@ -27,27 +30,26 @@ datasets = {
 }
 
 
-def try_for(f, limit=3):
+def try_for(f, limit=None, gi=None):
     """
-    Tries to invoke the function f. If the function f fails it will be retried
-    *limit* number of times.
+    Tries to invoke the function f. If the function f fails with a transient
+    error it will be retried, with backoff, up to *limit* attempts in total.
+    See *retry.call*
+
+    Requests made through a connection returned by *connect* are already
+    retried by the connection, so f is only called once when *gi* is such a
+    connection.
 
     :param f: the function to invoke
-    :param limit: how many times the function will be retried
+    :param limit: how many times the function will be attempted, see
+      *retry.DEFAULT_POLICY*
+    :param gi: the connection used by f, whose server's RetryBudget is used
     :return: the result of calling f()
     """
-    count = 0
-    running = True
-    result = None
-    while running:
-        try:
-            count += 1
-            result = f()
-            running = False
-        except Exception as e:
-            if count >= limit:
-                raise e
-    return result
+    if gi is not None and retry.retries_requests(gi):
+        return f()
+    server = None if gi is None else cache.server_key(gi)
+    return retry.call(f, limit, server)
 
 
 class Context:
@@ -57,9 +59,15 @@ class Context:
     GALAXY_SERVER: the URL of the Galaxy server to connect to
     API_KEY      : a user's API key to make API calls on the Galaxy instance
     KUBECONFIG:  : the kubeconfig file needed to make changes via Helm
+    POOL_SIZE    : the number of HTTP connections kept open to the server
+
+    Only the settings in EXPORTED are passed to helm and kubectl, see get_env.
     """
 
+    EXPORTED = ['GALAXY_SERVER', 'API_KEY', 'KUBECONFIG', 'MASTER_KEY']
+
     def __init__(self, *args):
+        self.POOL_SIZE = None
         if len(args) == 1:
             arg = args[0]
             if type(arg) == str:
@@ -69,6 +77,7 @@ class Context:
                     self.KUBECONFIG,
                     self.MASTER_KEY,
                 ) = parse_profile(arg)
+                self.POOL_SIZE = get_profile_value(arg, 'pool_size')
             elif type(arg) == dict:
                 self.GALAXY_SERVER = arg['GALAXY_SERVER']
                 self.API_KEY = arg['API_KEY']
@@ -77,6 +86,7 @@ class Context:
                     self.MASTER_KEY = arg['MASTER_KEY']
                 else:
                     self.MASTER_KEY = None
+                self.POOL_SIZE = arg.get('POOL_SIZE')
             else:
                 raise Exception(f'Invalid arg for Context: {type(arg)}')
         elif len(args) == 3 or len(args) == 4:
@@ -101,7 +111,8 @@ def print_yaml(obj):
 
 def connect(context: Context, use_master_key=False):
     """
-    Create a connection to the Galaxy instance
+    Returns the shared connection to the Galaxy instance. Connections are
+    created once per server and API key. See *connection.ConnectionRegistry*
 
     :return: a GalaxyInstance object
     """
@@ -120,9 +131,12 @@ def connect(context: Context, use_master_key=False):
             print('       configuration in ~/.abm/profile.yml and try again.')
             sys.exit(1)
         key = context.MASTER_KEY
-    gi = bioblend.galaxy.GalaxyInstance(url=context.GALAXY_SERVER, key=key)
-    gi.max_get_attempts = 3
-    gi.get_retry_delay = 1
+    gi = connection.get_registry().get(
+        context.GALAXY_SERVER, key, getattr(context, 'POOL_SIZE', None)
+    )
+    # Transient failures are retried with backoff by the connection itself,
+    # retrying again in bioblend would multiply the attempts.
+    gi.max_get_attempts = 1
     return gi
 
 
@@ -172,6 +186,25 @@ def load_profiles():
     return profiles
 
 
+def read_profiles():
+    """
+    Returns the profile configuration, which is only parsed again when the
+    file changes.  The result is shared, use load_profiles() to edit it.
+
+    :return: a dictionary containing the YAML content of the configuration.
+    """
+    for profile_path in PROFILE_SEARCH_PATH:
+        profile_path = os.path.expanduser(profile_path)
+        try:
+            key = (profile_path, os.stat(profile_path).st_mtime_ns)
+        except OSError:
+            continue
+        if lib.profiles is None or lib.profiles[0] != key:
+            lib.profiles = (key, load_profiles())
+        return lib.profiles[1]
+    return {}
+
+
 def save_profiles(profiles: dict):
     """
     Write the ABM configuration file.
@@ -210,7 +243,7 @@ def parse_profile(profile_name: str):
     :return: a tuple containing the Galaxy URL, API key, and path to the kubeconfig
     '''
     nones = (None, None, None, None)
-    profiles = load_profiles()
+    profiles = read_profiles()
     if profiles is None:
         print(f'ERROR: Could not locate an abm profile file in {PROFILE_SEARCH_PATH}')
         return nones
@@ -234,6 +267,20 @@ def parse_profile(profile_name: str):
     return (profile['url'], profile['key'], kube, master)
 
 
+def get_profile_value(profile_name: str, key: str, default=None):
+    '''
+    Returns an optional setting from a profile.
+
+    :param profile_name: the name of the profile
+    :param key: the setting to return
+    :param default: the value returned if the profile does not contain the setting
+    '''
+    profiles = read_profiles()
+    if profiles is None or profile_name not in profiles:
+        return default
+    return profiles[profile_name].get(key, default)
+
+
 def run(command, env: dict = None):
     """
     Runs a command on the local machine.  Used to invoke the helm and kubectl
@@ -241,38 +288,31 @@ def run(command, env: dict = None):
 
     :param command: the command to be invoked
     :param env: environment variables for the command.
-    :return:
+    :return: the output of the command
     """
-    if env is None:
-        env = os.environ
-    result = subprocess.run(command.split(), capture_output=True, env=env)
-    if result.returncode != 0:
-        raise RuntimeError(result.stderr.decode('utf-8').strip())
-    return result.stdout.decode('utf-8').strip()
+    return shell.run(command, env)
 
 
 def get_env(context: Context):
     """
-    Creates a copy of the environment variables as returned by os.environ.
-    :param context: Ignored
+    Creates a copy of the environment variables as returned by os.environ
+    with the settings from the *context* added.  The copy is shared by every
+    call for the same settings, so it must not be modified.
+
+    :param context: the settings for the cloud
     :return: a dictionary of the environment variables
     """
-    copy = os.environ.copy()
-    for key, value in context.__dict__.items():
-        if value is not None:
-            copy[key] = value
-    return copy
+    return shell.get_env(context)
 
 
 def find_executable(name):
     """
-    Used the which command on the local machine to find the full path to an
-    executable.
+    Finds the full path to an executable on the $PATH. The result is cached.
 
     :param name: the name of a command line executable or script.
-    :return: the full path to the executable or an empty string if the executable is not found.
+    :return: the full path to the executable or None if the executable is not found.
     """
-    return run(f"which {name}")
+    return shell.find_executable(name)
 
 
 # This is all the job metrics returned by Galaxy
@@ -335,12 +375,55 @@ def print_table_header():
     print(','.join(table_header))
 
 
-history_name_cache = dict()
+class LRUCache:
+    """
+    A dictionary that forgets the least recently used keys once it holds more
+    than *max_size* items.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def __getitem__(self, key):
+        with self._lock:
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+
+# The maximum number of history names remembered by get_history_name.
+HISTORY_NAME_CACHE_SIZE = 4096
+
+history_name_cache = LRUCache(HISTORY_NAME_CACHE_SIZE)
 
 
 def get_history_name(gi, hid: str) -> str:
-    if hid in history_name_cache:
-        return history_name_cache[hid]
+    name = history_name_cache.get(hid)
+    if name is not None:
+        return name
     history = gi.histories.show_history(hid)
     if history is None:
         return 'unknown'
@@ -349,12 +432,105 @@ def get_history_name(gi, hid: str) -> str:
     return name
 
 
+# The number of jobs requested per page. Galaxy returns at most 500 jobs for
+# a single request.
+JOB_PAGE_SIZE = 500
+
+
+async def get_all_jobs_async(
+    agi: AsyncGalaxy, page_size: int = JOB_PAGE_SIZE, **filters
+):
+    """
+    Lists every job that matches the *filters*, e.g. history_id or
+    invocation_id, one page at a time.
+    """
+    jobs = []
+    seen = set()
+    offset = 0
+    while True:
+        # Jobs are ordered by creation time so pages do not shift while jobs
+        # are being updated.
+        page = await agi.jobs.get_jobs(
+            limit=page_size, offset=offset, order_by='create_time', **filters
+        )
+        for job in page:
+            if job['id'] not in seen:
+                seen.add(job['id'])
+                jobs.append(job)
+        if len(page) < page_size:
+            return jobs
+        offset += page_size
+
+
+# The number of invocations requested per page.
+INVOCATION_PAGE_SIZE = 100
+
+
+async def get_all_invocations_async(
+    agi: AsyncGalaxy, page_size: int = INVOCATION_PAGE_SIZE, **filters
+):
+    """
+    Lists every invocation that matches the *filters*, e.g. workflow_id, one
+    page at a time.
+    """
+    invocations = []
+    seen = set()
+    offset = 0
+    while True:
+        page = await agi.invocations.get_invocations(
+            limit=page_size, offset=offset, **filters
+        )
+        for invocation in page:
+            if invocation['id'] not in seen:
+                seen.add(invocation['id'])
+                invocations.append(invocation)
+        if len(page) < page_size:
+            return invocations
+        offset += page_size
+
+
+async def get_job_metrics_async(agi: AsyncGalaxy, job: dict) -> list:
+    """
+    Returns the metrics for *job*.  The metrics of terminal jobs are kept in
+    the job cache so they are only fetched once.  See *job_cache*
+    """
+    return await job_cache.get_metrics_async(agi, job)
+
+
 def summarize_metrics(gi, jobs: list):
+    return asyncio.run(summarize_metrics_async(AsyncGalaxy(gi), jobs))
+
+
+async def summarize_metrics_async(agi: AsyncGalaxy, jobs: list):
+    """
+    Fetches the metrics for all *jobs*, and the names of their histories,
+    concurrently and returns one table row per job.  History names that are
+    already set on the jobs, or have been fetched before, are reused.
+    """
+    all_metrics = await asyncio.gather(
+        *[get_job_metrics_async(agi, job) for job in jobs]
+    )
+    names = {}
+    for job in jobs:
+        if job.get('history_name'):
+            names[job['history_id']] = job['history_name']
+    missing = set()
+    for job in jobs:
+        hid = job.get('history_id', 'unknown')
+        if hid in names or hid == 'unknown':
+            continue
+        name = history_name_cache.get(hid)
+        if name is None:
+            missing.add(hid)
+        else:
+            names[hid] = name
+    missing = list(missing)
+    fetched = await asyncio.gather(*[_fetch_history_name(agi, hid) for hid in missing])
+    names.update(zip(missing, fetched))
     table = []
     # table.append(header)
     # print(','.join(header))
-    for job in jobs:
-        job_metrics = gi.jobs.get_metrics(job['id'])
+    for job, job_metrics in zip(jobs, all_metrics):
         row = []
         toolid = job.get('tool_id', 'unknown')
         if '/' in toolid:
@@ -364,7 +540,7 @@ def summarize_metrics(gi, jobs: list):
         metrics['id'] = job.get('id', 'unknown')
         hid = job.get('history_id', 'unknown')
         metrics['history_id'] = hid
-        metrics['history_name'] = get_history_name(gi, hid)
+        metrics['history_name'] = names.get(hid, 'unknown')
         metrics['state'] = job.get('state', 'unknown')
         metrics['tool_id'] = toolid
         metrics['invocation_id'] = job.get('invocation_id', 'unknown')
@@ -378,24 +554,43 @@ def summarize_metrics(gi, jobs: list):
     return table
 
 
+async def _fetch_history_name(agi: AsyncGalaxy, hid: str) -> str:
+    try:
+        history = await agi.histories.show_history(hid)
+    except Exception:
+        return 'unknown'
+    if history is None:
+        return 'unknown'
+    history_name_cache[hid] = history['name']
+    return history['name']
+
+
 def print_markdown_table(table: list) -> None:
+    print_markdown_header()
+    for row in table:
+        print_markdown_row(row)
+
+
+def print_markdown_header() -> None:
     print('| Tool ID | History | State | Memory (GB) | Runtime (sec)|')
     print('|---|---|---:|---:|---:|')
+
+
+def print_markdown_row(row: list) -> None:
     GB = 1024 * 1024 * 1024
-    for row in table[1:]:
-        # memory = ''
-        # if row[11] != '':
-        #     memory = float(row[11]) / GB
-        #     if memory < 0.1:
-        #         memory = 0.1
-        #     memory = f"{memory:3.1f}"
-        history = row[2]
-        state = row[3]
-        tool_id = row[4]
-        # cpu = '' if row[7] == '' else float(row[7]) / 10**9
-        memory = '' if row[11] == '' else f"{max(0.1, float(row[11]) / GB):3.1f}"
-        runtime = '' if row[15] == '' else f"{max(1, float(row[15])):5.0f}"
-        print(f'| {tool_id} | {history} | {state} | {memory} | {runtime} |')
+    # memory = ''
+    # if row[11] != '':
+    #     memory = float(row[11]) / GB
+    #     if memory < 0.1:
+    #         memory = 0.1
+    #     memory = f"{memory:3.1f}"
+    history = row[2]
+    state = row[3]
+    tool_id = row[4]
+    # cpu = '' if row[7] == '' else float(row[7]) / 10**9
+    memory = '' if row[11] == '' else f"{max(0.1, float(row[11]) / GB):3.1f}"
+    runtime = '' if row[15] == '' else f"{max(1, float(row[15])):5.0f}"
+    print(f'| {tool_id} | {history} | {state} | {memory} | {runtime} |')
 
 
 def metrics_to_dict(metrics: list, accept: list):
@@ -467,6 +662,12 @@ def find_config(name: str) -> str:
 
 
 def _get_dataset_data(gi, name_or_id):
+    return cache.resolve(
+        gi, cache.DATASET_DATA, name_or_id, lambda: _fetch_dataset_data(gi, name_or_id)
+    )
+
+
+def _fetch_dataset_data(gi, name_or_id):
     print(f"Getting dataset data for {name_or_id}")
 
     def make_result(data):
@@ -1,7 +1,11 @@
 import argparse
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from time import perf_counter
 from typing import List, Dict, Any, Optional
 from datetime import timedelta
 
@@ -322,144 +326,174 @@ def _filter_files_by_pattern(files: List[Dict[str, Any]], pattern: str) -> List[
     return [f for f in files if regex.match(f.get("name", ""))]
 
 
-def _process_terra_workspaces(gi, terra_workspaces):
-    """Process Terra workspace configurations and import datasets."""
-    if not TERRA_AVAILABLE:
-        print("ERROR: Terra workspace support not available. Install fs.anvilfs package.")
-        return
-
-    for workspace_config in terra_workspaces:
-        namespace = workspace_config.get('namespace')
-        workspace_name = workspace_config.get('workspace')
-
-        if not namespace or not workspace_name:
-            print(f"ERROR: Terra workspace config missing 'namespace' or 'workspace': {workspace_config}")
-            continue
-
-        print(f"Processing Terra workspace: {namespace}/{workspace_name}")
+def _parse_terra_pattern(pattern_config):
+    """Return the (scan directory, filename pattern, datatype) for a Terra pattern config, or None."""
+    if isinstance(pattern_config, str):
+        # Simple pattern string
+        pattern = pattern_config
+        custom_datatype = None
+    elif isinstance(pattern_config, dict):
+        # Dictionary with pattern and optional datatype
+        pattern = pattern_config.get('pattern')
+        custom_datatype = pattern_config.get('datatype')
+        if not pattern:
+            print(f"    ERROR: pattern config missing 'pattern' field: {pattern_config}")
+            return None
+    else:
+        print(f"    ERROR: invalid pattern config: {pattern_config}")
+        return None
 
-        try:
-            # Connect to Terra workspace via fs.anvilfs
-            anvil_fs = AnVILFS(namespace, workspace_name)
-
-            # Process dataset import configurations
-            datasets_config = workspace_config.get('datasets', {})
-            for history_name, dataset_patterns in datasets_config.items():
-                print(f"  Processing history: {history_name}")
-
-                # Get or create the named history
-                histories = gi.histories.get_histories(name=history_name)
-                if histories:
-                    dataset_history = histories[0]['id']
-                    print(f"    Using existing history: {history_name}")
-                else:
-                    new_history = gi.histories.create_history(name=history_name)
-                    dataset_history = new_history['id']
-                    print(f"    Created new history: {history_name}")
-
-                # Process each dataset pattern
-                for pattern_config in dataset_patterns:
-                    if isinstance(pattern_config, str):
-                        # Simple pattern string
-                        pattern = pattern_config
-                        custom_datatype = None
-                    elif isinstance(pattern_config, dict):
-                        # Dictionary with pattern and optional datatype
-                        pattern = pattern_config.get('pattern')
-                        custom_datatype = pattern_config.get('datatype')
-                        if not pattern:
-                            print(f"    ERROR: pattern config missing 'pattern' field: {pattern_config}")
-                            continue
-                    else:
-                        print(f"    ERROR: invalid pattern config: {pattern_config}")
-                        continue
+    # Parse pattern to extract directory path and filename pattern
+    pattern_path = Path(pattern)
+    if pattern_path.parent != Path("."):
+        # Pattern has directory path (e.g., "Tables/sample/*.fastq")
+        return str(pattern_path.parent), pattern_path.name, custom_datatype
+    # Pattern is just filename (e.g., "*.fastq")
+    return "/", pattern, custom_datatype
+
+
+def _scan_terra_directory(anvil_fs, scan_dir: str) -> List[Dict[str, Any]]:
+    """List the files in one directory of a Terra workspace."""
+    all_files = []
+    for file_info in anvil_fs.scandir(scan_dir):
+        if file_info.is_file:
+            full_path = f"{scan_dir.rstrip('/')}/{file_info.name}".replace("//", "/")
+            all_files.append({
+                "path": full_path,
+                "name": file_info.name,
+                "size": file_info.size if hasattr(file_info, 'size') else 0
+            })
+    return all_files
+
+
+def _process_terra_workspaces(gi, terra_workspaces, workers: int = 4, anvil_fs_factory=None):
+    """
+    Process Terra workspace configurations and import datasets.
+
+    Every directory named by the patterns of a workspace is listed once, at
+    the same time as the other directories, and all the patterns for that
+    directory are matched against the one listing.  The matching files are
+    then imported on the same pool of *workers* threads.  The bootstrap runs
+    this after its other tasks so no more than *workers* requests are made
+    at once.
+
+    :param anvil_fs_factory: creates the filesystem for a (namespace,
+      workspace), AnVILFS by default.
+    :return: False if any workspace, pattern, directory or import failed.
+    """
+    if anvil_fs_factory is None:
+        if not TERRA_AVAILABLE:
+            print("ERROR: Terra workspace support not available. Install fs.anvilfs package.")
+            return False
+        anvil_fs_factory = AnVILFS
+
+    ok = True
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # (namespace, workspace, directory) -> the future listing of the directory
+        listings = {}
+        # (history ID, directory key, filename pattern, datatype)
+        matches = []
+        for workspace_config in terra_workspaces:
+            namespace = workspace_config.get('namespace')
+            workspace_name = workspace_config.get('workspace')
+
+            if not namespace or not workspace_name:
+                print(f"ERROR: Terra workspace config missing 'namespace' or 'workspace': {workspace_config}")
+                ok = False
+                continue
+
+            print(f"Processing Terra workspace: {namespace}/{workspace_name}")
 
-                    print(f"    Looking for files matching: {pattern}")
-
-                    try:
-                        # Parse pattern to extract directory path and filename pattern
-                        pattern_path = Path(pattern)
-                        if pattern_path.parent != Path("."):
-                            # Pattern has directory path (e.g., "Tables/sample/*.fastq")
-                            scan_dir = str(pattern_path.parent)
-                            filename_pattern = pattern_path.name
-                        else:
-                            # Pattern is just filename (e.g., "*.fastq")
-                            scan_dir = "/"
-                            filename_pattern = pattern
-
-                        print(f"      Scanning directory: {scan_dir}")
-                        print(f"      Filename pattern: {filename_pattern}")
-
-                        # List files in the specific directory
-                        all_files = []
-                        try:
-                            for file_info in anvil_fs.scandir(scan_dir):
-                                if file_info.is_file:
-                                    full_path = f"{scan_dir.rstrip('/')}/{file_info.name}".replace("//", "/")
-                                    all_files.append({
-                                        "path": full_path,
-                                        "name": file_info.name,
-                                        "size": file_info.size if hasattr(file_info, 'size') else 0
-                                    })
-                        except Exception as e:
-                            print(f"      ERROR scanning directory {scan_dir}: {e}")
+            try:
+                # Connect to Terra workspace via fs.anvilfs
+                anvil_fs = anvil_fs_factory(namespace, workspace_name)
+
+                # Process dataset import configurations
+                datasets_config = workspace_config.get('datasets', {})
+                for history_name, dataset_patterns in datasets_config.items():
+                    print(f"  Processing history: {history_name}")
+                    dataset_history = _get_or_create_history(gi, history_name)
+
+                    for pattern_config in dataset_patterns:
+                        parsed = _parse_terra_pattern(pattern_config)
+                        if parsed is None:
+                            ok = False
                             continue
+                        scan_dir, filename_pattern, datatype = parsed
+                        key = (namespace, workspace_name, scan_dir)
+                        if key not in listings:
+                            print(f"      Scanning directory: {scan_dir}")
+                            listings[key] = executor.submit(_scan_terra_directory, anvil_fs, scan_dir)
+                        matches.append((dataset_history, key, filename_pattern, datatype))
 
-                        # Filter files by filename pattern
-                        matching_files = _filter_files_by_pattern(all_files, filename_pattern)
-                        print(f"    Found {len(matching_files)} matching files")
-
-                        # Import each matching file
-                        for file_info in matching_files:
-                            file_path = file_info["path"]
-                            file_name = file_info["name"]
-
-                            # Detect datatype
-                            datatype = custom_datatype or _detect_datatype_from_extension(file_name)
-
-                            try:
-                                # Generate signed URL for the file
-                                # Note: This may need adjustment based on fs.anvilfs API
-                                with anvil_fs.open(file_path, 'rb') as f:
-                                    # For now, we'll use the file path directly
-                                    # In a real implementation, we'd need to generate signed URLs
-                                    file_url = f"anvil://{namespace}/{workspace_name}/{file_path}"
-
-                                # Import dataset using Galaxy's URL import mechanism
-                                # This will need to be adapted to work with AnVIL URLs
-                                print(f"      Importing: {file_name} (type: {datatype})")
-                                dataset._import_from_url(gi, dataset_history, file_url, file_name=file_name, file_type=datatype)
-
-                            except Exception as e:
-                                print(f"      ERROR importing {file_name}: {e}")
-
-                    except Exception as e:
-                        print(f"    ERROR processing pattern {pattern}: {e}")
-
-        except Exception as e:
-            print(f"ERROR connecting to Terra workspace {namespace}/{workspace_name}: {e}")
-            # Provide helpful guidance on authentication
-            if 'credentials' in str(e).lower() or 'authentication' in str(e).lower():
-                print(f"  Set up Terra authentication with:")
-                print(f"    export GOOGLE_APPLICATION_CREDENTIALS='path/to/credentials.json'")
-                print(f"    export TERRA_NOTEBOOK_GOOGLE_ACCESS_TOKEN=\"$(gcloud auth print-access-token)\"")
-            continue
+            except Exception as e:
+                print(f"ERROR connecting to Terra workspace {namespace}/{workspace_name}: {e}")
+                # Provide helpful guidance on authentication
+                if 'credentials' in str(e).lower() or 'authentication' in str(e).lower():
+                    print(f"  Set up Terra authentication with:")
+                    print(f"    export GOOGLE_APPLICATION_CREDENTIALS='path/to/credentials.json'")
+                    print(f"    export TERRA_NOTEBOOK_GOOGLE_ACCESS_TOKEN=\"$(gcloud auth print-access-token)\"")
+                ok = False
+                continue
+
+        imports = []
+        imported = set()
+        for dataset_history, key, filename_pattern, custom_datatype in matches:
+            namespace, workspace_name, scan_dir = key
+            try:
+                all_files = listings[key].result()
+            except Exception as e:
+                print(f"      ERROR scanning directory {scan_dir}: {e}")
+                ok = False
+                continue
+
+            # Filter files by filename pattern
+            matching_files = _filter_files_by_pattern(all_files, filename_pattern)
+            print(f"    Found {len(matching_files)} files in {scan_dir} matching {filename_pattern}")
+
+            for file_info in matching_files:
+                file_path = file_info["path"]
+                file_name = file_info["name"]
+                if (dataset_history, key, file_path) in imported:
+                    # Matched by more than one pattern.
+                    continue
+                imported.add((dataset_history, key, file_path))
+
+                # Detect datatype
+                datatype = custom_datatype or _detect_datatype_from_extension(file_name)
+                # Import dataset using Galaxy's URL import mechanism
+                # This will need to be adapted to work with AnVIL URLs
+                file_url = f"anvil://{namespace}/{workspace_name}/{file_path}"
+                print(f"      Importing: {file_name} (type: {datatype})")
+                imports.append((file_name, executor.submit(
+                    dataset._import_from_url, gi, dataset_history, file_url,
+                    file_name=file_name, file_type=datatype)))
+
+        for file_name, future in imports:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"      ERROR importing {file_name}: {e}")
+                ok = False
+    return ok
 
 
-def _import_dataset_with_metadata(gi, history_id, dataset_config):
-    """Import a dataset with optional name and datatype metadata."""
+def _dataset_import_args(dataset_config, config_version: int = 1):
+    """Return the URL and import options for a dataset entry, or None if the entry is invalid."""
+    if config_version == 0:
+        # Legacy format, the entry is the URL.
+        return dataset_config, {}
     if isinstance(dataset_config, str):
         # Simple URL format
         url = dataset_config
-        file_name = _extract_filename_from_url(url)
-        dataset._import_from_url(gi, history_id, url, file_name=file_name)
-    elif isinstance(dataset_config, dict):
+        return url, {'file_name': _extract_filename_from_url(url)}
+    if isinstance(dataset_config, dict):
         # Dictionary format with optional name and datatype
         url = dataset_config.get('url')
         if not url:
             print(f"ERROR: dataset config missing required 'url' field: {dataset_config}")
-            return
+            return None
 
         # Extract optional parameters
         file_name = dataset_config.get('name')
@@ -472,105 +506,284 @@ def _import_dataset_with_metadata(gi, history_id, dataset_config):
         kwargs = {'file_name': file_name}
         if file_type:
             kwargs['file_type'] = file_type
+        return url, kwargs
+    print(f"ERROR: dataset config must be URL string or dict: {dataset_config}")
+    return None
 
-        dataset._import_from_url(gi, history_id, url, **kwargs)
-    else:
-        print(f"ERROR: dataset config must be URL string or dict: {dataset_config}")
+
+def _import_dataset_with_metadata(gi, history_id, dataset_config):
+    """Import a dataset with optional name and datatype metadata, returning False if the config is invalid."""
+    args = _dataset_import_args(dataset_config)
+    if args is None:
+        return False
+    url, kwargs = args
+    dataset._import_from_url(gi, history_id, url, **kwargs)
+    return True
 
 
-def _process_datasets_v1(gi, datasets):
-    """Process datasets in version 1 format with enhanced metadata support."""
+def _dataset_groups(datasets) -> Optional[List[tuple]]:
+    """Split the datasets section into (history name, always create, entries) groups."""
     # Check if datasets is a simple list or dictionary
     if isinstance(datasets, list):
         # Simple list format - create default history
-        print(f"Importing {len(datasets)} datasets into default history...")
-        new_history = gi.histories.create_history(name="Configured Datasets")
-        dataset_history = new_history['id']
+        return [("Configured Datasets", True, datasets)]
+    if isinstance(datasets, dict):
+        # Dictionary format - group by history name
+        return [(name, False, entries) for name, entries in datasets.items()]
+    print("ERROR: datasets section must be either a list or dictionary")
+    return None
+
 
-        for dataset_config in datasets:
+def _get_or_create_history(gi, history_name: str, create: bool = False) -> str:
+    """Return the ID of the named history, creating it if needed or if create is True."""
+    if not create:
+        histories = gi.histories.get_histories(name=history_name)
+        if histories:
+            return histories[0]['id']
+    new_history = gi.histories.create_history(name=history_name)
+    return new_history['id']
+
+
+def _import_dataset_group(gi, history_name, create, entries, config_version, batch_size, progress):
+    """Import the datasets for one history, batch_size URLs per upload request."""
+    print(f"Importing {len(entries)} datasets into history '{history_name}'...")
+    dataset_history = _get_or_create_history(gi, history_name, create)
+    progress.add_history(dataset_history)
+    ok = True
+    if batch_size > 1:
+        elements = []
+        for entry in entries:
+            args = _dataset_import_args(entry, config_version)
+            if args is None:
+                ok = False
+                continue
+            url, kwargs = args
+            elements.append({
+                'url': url,
+                'name': kwargs.get('file_name') or _extract_filename_from_url(url),
+                'ext': kwargs.get('file_type', 'auto'),
+            })
+        for i in range(0, len(elements), batch_size):
+            batch = elements[i:i + batch_size]
             try:
-                _import_dataset_with_metadata(gi, dataset_history, dataset_config)
+                dataset._import_from_urls(gi, dataset_history, batch)
             except Exception as e:
-                print(f"ERROR: failed to import dataset {dataset_config}: {e}")
+                print(f"ERROR: failed to import {len(batch)} datasets into '{history_name}': {e}")
+                ok = False
+        return ok
 
-    elif isinstance(datasets, dict):
-        # Dictionary format - group by history name
-        for history_name, dataset_list in datasets.items():
-            print(
-                f"Importing {len(dataset_list)} datasets into history '{history_name}'..."
-            )
-
-            # Get or create the named history
-            histories = gi.histories.get_histories(name=history_name)
-            if histories:
-                dataset_history = histories[0]['id']
-            else:
-                new_history = gi.histories.create_history(name=history_name)
-                dataset_history = new_history['id']
-
-            for dataset_config in dataset_list:
-                try:
-                    _import_dataset_with_metadata(gi, dataset_history, dataset_config)
-                except Exception as e:
-                    print(f"ERROR: failed to import dataset {dataset_config}: {e}")
-    else:
-        print("ERROR: datasets section must be either a list or dictionary")
+    for entry in entries:
+        try:
+            if config_version == 0:
+                dataset._import_from_url(gi, dataset_history, entry)
+            elif not _import_dataset_with_metadata(gi, dataset_history, entry):
+                ok = False
+        except Exception as e:
+            print(f"ERROR: failed to import dataset {entry}: {e}")
+            ok = False
+    return ok
+
+
+class BootstrapProgress:
+    """Counts the bootstrap tasks as they finish and the histories datasets were uploaded to."""
+
+    def __init__(self):
+        self.total = 0
+        self.done = 0
+        self.failed = []
+        self.histories = []
+        self.start = perf_counter()
+        self._lock = threading.Lock()
+
+    def add_history(self, history_id: str):
+        with self._lock:
+            if history_id not in self.histories:
+                self.histories.append(history_id)
+
+    def finished(self, name: str, ok: bool):
+        with self._lock:
+            self.done += 1
+            if not ok:
+                self.failed.append(name)
+            elapsed = timedelta(seconds=int(perf_counter() - self.start))
+            status = 'done' if ok else 'FAILED'
+            print(f"[{self.done}/{self.total}] {status}: {name} (elapsed {elapsed})")
+
+
+def _run_bootstrap_task(progress: BootstrapProgress, name: str, task, *args):
+    """Run one bootstrap task, recording whether it succeeded."""
+    try:
+        ok = task(*args) is not False
+    except Exception as e:
+        print(f"ERROR: failed to {name}: {e}")
+        ok = False
+    progress.finished(name, ok)
+
+
+def _wait_for_uploads(gi, history_ids: List[str], timeout: int = 86400, interval: int = 10) -> bool:
+    """Wait until no dataset in the histories is still being uploaded or processed."""
+    busy_states = ['new', 'upload', 'queued', 'running', 'setting_metadata']
+    start = perf_counter()
+    while True:
+        pending = 0
+        errors = 0
+        for history_id in history_ids:
+            details = gi.histories.show_history(history_id).get('state_details', {})
+            pending += sum(details.get(state, 0) for state in busy_states)
+            errors += details.get('error', 0)
+        if pending == 0:
+            if errors > 0:
+                print(f"WARNING: {errors} datasets failed to upload")
+            return errors == 0
+        if perf_counter() - start > timeout:
+            print(f"ERROR: timed out waiting for {pending} datasets to upload")
+            return False
+        print(f"Waiting for {pending} datasets in {len(history_ids)} histories")
+        time.sleep(interval)
+
+
+class BootstrapIndex:
+    """An index of the histories, datasets and workflows already on the target instance."""
+
+    # Datasets in these states will never become usable so they are imported again.
+    FAILED_STATES = ['error', 'discarded', 'failed_metadata']
+
+    def __init__(self, gi):
+        self.gi = gi
+        self.histories = {}
+        for h in gi.histories.get_histories():
+            # Use the same history as get_histories(name=...)[0]
+            self.histories.setdefault(h.get('name'), h.get('id'))
+        self.workflows = set(w.get('name') for w in gi.workflows.get_workflows())
+        self._contents = {}
+
+    def history_id(self, history_name: str) -> Optional[str]:
+        return self.histories.get(history_name)
+
+    def datasets(self, history_name: str) -> List[Dict[str, Any]]:
+        """The usable datasets in the named history, with their size, hashes and sources."""
+        if history_name not in self._contents:
+            contents = []
+            history_id = self.history_id(history_name)
+            if history_id is not None:
+                for item in self.gi.histories.show_history(history_id, contents=True, deleted=False, details='all'):
+                    if item.get('history_content_type', 'dataset') != 'dataset':
+                        continue
+                    if item.get('purged') or item.get('state') in BootstrapIndex.FAILED_STATES:
+                        continue
+                    contents.append(item)
+            self._contents[history_name] = contents
+        return self._contents[history_name]
+
+    def find_dataset(self, history_name: str, url: str, kwargs: dict, expected_hash: Optional[str] = None):
+        """Return the existing dataset that matches a bootstrap entry, or None."""
+        name = kwargs.get('file_name') or _extract_filename_from_url(url)
+        for item in self.datasets(history_name):
+            sources = [source.get('source_uri') for source in item.get('sources') or []]
+            if url in sources:
+                return item
+            if item.get('name') != name:
+                continue
+            if 'file_type' in kwargs and item.get('extension') not in [None, kwargs['file_type']]:
+                continue
+            if expected_hash is not None and not _hash_matches(item, expected_hash):
+                continue
+            return item
+        return None
 
+    def has_workflow(self, name) -> bool:
+        return name in self.workflows
 
-def _process_datasets_v0(gi, datasets):
-    """Process datasets in legacy version 0 format (backward compatibility)."""
-    # Check if datasets is a simple list or dictionary
-    if isinstance(datasets, list):
-        # Simple list format - create default history
-        print(f"Importing {len(datasets)} datasets into default history...")
-        new_history = gi.histories.create_history(name="Configured Datasets")
-        dataset_history = new_history['id']
 
-        for url in datasets:
-            try:
-                dataset._import_from_url(gi, dataset_history, url)
-            except Exception as e:
-                print(f"ERROR: failed to import dataset from {url}: {e}")
+def _hash_matches(item: Dict[str, Any], expected_hash: str) -> bool:
+    """Compare a hash given as FUNCTION:VALUE, e.g. SHA-256:abc..., with the hashes Galaxy recorded."""
+    function, _, value = expected_hash.partition(':')
+    for h in item.get('hashes') or []:
+        if h.get('hash_function', '').upper() == function.upper():
+            return h.get('hash_value', '').lower() == value.lower()
+    # Galaxy has no hash of this kind so fall back to the name match.
+    return True
 
-    elif isinstance(datasets, dict):
-        # Dictionary format - group by history name
-        for history_name, urls in datasets.items():
-            print(
-                f"Importing {len(urls)} datasets into history '{history_name}'..."
-            )
-
-            # Get or create the named history
-            histories = gi.histories.get_histories(name=history_name)
-            if histories:
-                dataset_history = histories[0]['id']
+
+def _reconcile(gi, config: dict, config_version: int):
+    """Remove the datasets and workflows that are already on the instance from the configuration."""
+    index = BootstrapIndex(gi)
+    print("Checking what is already on the instance...")
+
+    if 'datasets' in config:
+        groups = _dataset_groups(config['datasets'])
+        if groups is not None:
+            missing_groups = {}
+            for history_name, create, entries in groups:
+                missing = []
+                for entry in entries:
+                    args = _dataset_import_args(entry, config_version)
+                    if args is None:
+                        # Keep the entry so its import task fails and is reported.
+                        missing.append(entry)
+                        continue
+                    url, kwargs = args
+                    expected_hash = entry.get('hash') if isinstance(entry, dict) else None
+                    found = index.find_dataset(history_name, url, kwargs, expected_hash)
+                    if found is None:
+                        print(f"  import   dataset {url} -> '{history_name}'")
+                        missing.append(entry)
+                    else:
+                        size = found.get('file_size')
+                        print(f"  present  dataset {found.get('name')} in '{history_name}' ({size} bytes)")
+                if len(missing) > 0:
+                    missing_groups[history_name] = missing
+            config['datasets'] = missing_groups
+
+    for section in ['workflows', 'workflows-no-tools']:
+        if section not in config:
+            continue
+        missing = []
+        for url in config[section]:
+            loaded = workflow._load_workflow(url)
+            name = loaded[0].get('name') if loaded is not None else None
+            if name is not None and index.has_workflow(name):
+                print(f"  present  workflow {name}")
             else:
-                new_history = gi.histories.create_history(name=history_name)
-                dataset_history = new_history['id']
-
-            for url in urls:
-                try:
-                    dataset._import_from_url(gi, dataset_history, url)
-                except Exception as e:
-                    print(f"ERROR: failed to import dataset from {url}: {e}")
-    else:
-        print("ERROR: datasets section must be either a list or dictionary")
+                print(f"  import   workflow {url}")
+                missing.append(url)
+        config[section] = missing
+
+    for url in config.get('histories') or []:
+        # The name of an imported history is only known once the archive has
+        # been unpacked by Galaxy, so histories can not be checked.
+        print(f"  import   history {url} (can not be checked before import)")
 
 
 def bootstrap(context: Context, args: list):
     """Configure a Galaxy instance by uploading datasets, histories, and workflows from a YAML configuration file."""
     if len(args) < 2:
-        print("USAGE: abm config bootstrap <server> <config_file>")
+        print("USAGE: abm config bootstrap <server> <config_file> [-w WORKERS] [--batch-size N] [--wait] [--dry-run] [--force]")
         return
 
-    server = args[0]
-    config_file = args[1]
+    parser = argparse.ArgumentParser(prog='abm config bootstrap')
+    parser.add_argument('server', help='the profile of the Galaxy instance to configure')
+    parser.add_argument('config_file', help='the bootstrap configuration file')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='the number of histories, dataset groups and workflows imported at the same time (default 4)')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='send up to N dataset URLs for a history in a single upload request (default 1)')
+    parser.add_argument('--wait', action='store_true',
+                        help='wait until the uploaded datasets are ready')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report what would be imported without importing anything')
+    parser.add_argument('--force', action='store_true',
+                        help='import everything, even items that are already on the instance')
+    params = parser.parse_args(args)
+    server = params.server
+    config_file = params.config_file
 
     # Create context for the specified server
     context = Context(server)
 
     if not os.path.exists(config_file):
         print(f"ERROR: configuration file not found: {config_file}")
-        return
+        return False
 
     # Load configuration file
     try:
@@ -578,68 +791,83 @@ def bootstrap(context: Context, args: list):
             config = yaml.safe_load(f)
     except Exception as e:
         print(f"ERROR: failed to parse configuration file: {e}")
-        return
+        return False
 
     if config is None:
         print("ERROR: configuration file is empty")
+        return False
+
+    # Determine configuration version (default to 0 for backward compatibility)
+    config_version = config.get('version', 0)
+    print(f"Processing bootstrap configuration version {config_version}")
+    if config_version not in [0, 1]:
+        print(f"ERROR: unsupported configuration version: {config_version}")
+        config.pop('datasets', None)
+
+    if params.dry_run and params.force:
+        print("ERROR: --dry-run and --force can not be used together")
+        return False
+
+    gi = connect(context)
+    if not params.force:
+        # Only import the items that are not on the instance already.
+        _reconcile(gi, config, config_version)
+    if params.dry_run:
+        print("Dry run, nothing was imported.")
         return
 
-    # Process histories
+    # The sections do not depend on each other so every history, dataset
+    # group and workflow is a separate task.
+    tasks = []
     if 'histories' in config:
         histories = config['histories']
         print(f"Importing {len(histories)} histories...")
         for url in histories:
-            try:
-                # Call existing history import function
-                history._import(context, [url])
-            except Exception as e:
-                print(f"ERROR: failed to import history from {url}: {e}")
+            tasks.append((f"import history from {url}", history._import, context, [url]))
 
-    # Determine configuration version (default to 0 for backward compatibility)
-    config_version = config.get('version', 0)
-    print(f"Processing bootstrap configuration version {config_version}")
-
-    # Process datasets using version-appropriate handler
     if 'datasets' in config:
-        datasets = config['datasets']
-        gi = connect(context)
-
-        if config_version == 0:
-            # Legacy format for backward compatibility
-            _process_datasets_v0(gi, datasets)
-        elif config_version == 1:
-            # Enhanced format with name and datatype support
-            _process_datasets_v1(gi, datasets)
-        else:
-            print(f"ERROR: unsupported configuration version: {config_version}")
+        for history_name, create, entries in _dataset_groups(config['datasets']) or []:
+            tasks.append((f"import datasets into '{history_name}'", _import_dataset_group, gi,
+                          history_name, create, entries, config_version, params.batch_size))
 
     # Process workflows (with tool installation)
     if 'workflows' in config:
         workflows = config['workflows']
         print(f"Importing {len(workflows)} workflows (with tools)...")
         for url in workflows:
-            try:
-                # Call existing workflow import function with tools
-                workflow.import_from_url(context, [url])
-            except Exception as e:
-                print(f"ERROR: failed to import workflow from {url}: {e}")
+            tasks.append((f"import workflow from {url}", workflow.import_from_url, context, [url]))
 
     # Process workflows (without tool installation)
     if 'workflows-no-tools' in config:
         workflows_no_tools = config['workflows-no-tools']
         print(f"Importing {len(workflows_no_tools)} workflows (without tools)...")
         for url in workflows_no_tools:
-            try:
-                # Call existing workflow import function without tools
-                workflow.import_from_url(context, [url, '--no-tools'])
-            except Exception as e:
-                print(f"ERROR: failed to import workflow from {url}: {e}")
-
-    # Process Terra workspaces
+            tasks.append((f"import workflow from {url}", workflow.import_from_url, context, [url, '--no-tools']))
+
+    progress = BootstrapProgress()
+    progress.total = len(tasks) + (1 if 'terra' in config else 0)
+    with ThreadPoolExecutor(max_workers=max(1, params.workers)) as executor:
+        for name, task, *task_args in tasks:
+            if task is _import_dataset_group:
+                task_args.append(progress)
+            executor.submit(_run_bootstrap_task, progress, name, task, *task_args)
+
+    # Process Terra workspaces.  This task has its own pool of workers, so it
+    # runs once the other tasks are done to stay within --workers requests.
     if 'terra' in config:
         terra_workspaces = config['terra']
         print(f"Processing {len(terra_workspaces)} Terra workspaces...")
-        gi = connect(context)
-        _process_terra_workspaces(gi, terra_workspaces)
-
+        _run_bootstrap_task(progress, "import Terra workspaces", _process_terra_workspaces,
+                            gi, terra_workspaces, params.workers)
+
+    if params.wait and len(progress.histories) > 0:
+        _wait_for_uploads(gi, progress.histories)
+
+    elapsed = timedelta(seconds=int(perf_counter() - progress.start))
+    if len(progress.failed) > 0:
+        print(f"WARNING: {len(progress.failed)} of {progress.total} tasks failed")
+        for name in progress.failed:
+            print(f"    {name}")
+    print(f"Elapsed time {elapsed}")
     print("Instance configuration complete!")
+    return len(progress.failed) == 0
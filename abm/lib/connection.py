@@ -0,0 +1,254 @@
+"""
+Shares HTTP connections to Galaxy servers across the whole process.
+
+bioblend sends every request with the module level ``requests`` functions, so
+each API call opens a new TCP connection and repeats the TLS handshake.  The
+PooledGalaxyInstance sends its requests through a ``requests.Session`` instead,
+which keeps up to *pool_size* connections to the server alive and reuses them.
+
+``common.connect`` gets its GalaxyInstance objects from the
+ConnectionRegistry, so every command that connects to the same server with
+the same API key shares one instance and one connection pool.  The pool size
+can be set per profile with the ``pool_size`` key in ``~/.abm/profile.yml``
+and also limits the number of concurrent AsyncGalaxy requests to the server.
+"""
+
+import json
+import threading
+from time import perf_counter
+
+import lib
+import requests
+from bioblend import ConnectionError
+from bioblend.galaxy import GalaxyInstance
+from lib import async_galaxy, cache, retry
+from requests.adapters import HTTPAdapter
+
+# The default number of connections kept alive to each server.
+DEFAULT_POOL_SIZE = 8
+
+
+class ConnectionStats:
+    """
+    Counters for the connections handed out by the registry and the requests
+    sent over them.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, error: bool = False):
+        with self._lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if error:
+                self.errors += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            mean = self.total_latency / self.requests if self.requests else 0.0
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'requests': self.requests,
+                'errors': self.errors,
+                'mean_latency': mean,
+                'max_latency': self.max_latency,
+            }
+
+
+class PooledGalaxyInstance(GalaxyInstance):
+    """
+    A GalaxyInstance that sends its requests through a shared, pooled session.
+
+    Requests that fail for transient reasons are retried according to
+    *retry_policy*.  GET requests are retried on any transient error or status.
+    Other requests are only retried if the connection could not be made, since
+    otherwise the server may already have acted on them.
+
+    Multipart uploads are left to bioblend.
+    """
+
+    # Callers must not retry requests again, see retry.retries_requests
+    RETRIES_REQUESTS = True
+
+    def __init__(self, url: str, key: str, session: requests.Session, stats=None):
+        super().__init__(url=url, key=key)
+        self.session = session
+        self.stats = stats if stats is not None else ConnectionStats()
+        # None for retry.DEFAULT_POLICY
+        self.retry_policy = None
+
+    def make_get_request(self, url: str, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('verify', self.verify)
+        return self._request('GET', url, headers=self.json_headers, **kwargs)
+
+    def make_post_request(
+        self, url: str, payload=None, params=None, files_attached=False
+    ):
+        if files_attached:
+            return super().make_post_request(url, payload, params, files_attached)
+        return _decode(self._send('POST', url, payload, params))
+
+    def make_delete_request(self, url: str, payload=None, params=None):
+        return self._send('DELETE', url, payload, params)
+
+    def make_put_request(self, url: str, payload=None, params=None):
+        return _decode(self._send('PUT', url, payload, params))
+
+    def make_patch_request(self, url: str, payload=None, params=None):
+        return _decode(self._send('PATCH', url, payload, params))
+
+    def _send(self, method: str, url: str, payload, params):
+        data = json.dumps(payload) if payload is not None else None
+        return self._request(
+            method,
+            url,
+            params=params,
+            data=data,
+            headers=self.json_headers,
+            timeout=self.timeout,
+            allow_redirects=False,
+            verify=self.verify,
+        )
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        def send():
+            response = self._send_once(method, url, **kwargs)
+            if method == 'GET' and response.status_code in retry.RETRYABLE_STATUS:
+                raise _RetryableResponse(response)
+            return response
+
+        if method == 'GET':
+            retryable = _retryable_get
+        else:
+            retryable = _retryable_update
+        try:
+            return retry.call(
+                send,
+                server=cache.server_key(self),
+                policy=self.retry_policy,
+                retryable=retryable,
+            )
+        except _RetryableResponse as e:
+            # Let bioblend report the error status.
+            return e.response
+
+    def _send_once(self, method: str, url: str, **kwargs) -> requests.Response:
+        start = perf_counter()
+        error = True
+        try:
+            response = self.session.request(method, url, **kwargs)
+            error = response.status_code >= 400
+            return response
+        finally:
+            self.stats.record(perf_counter() - start, error)
+
+
+class _RetryableResponse(Exception):
+    def __init__(self, response: requests.Response):
+        super().__init__(f"HTTP status {response.status_code}")
+        self.response = response
+
+
+def _retryable_get(e: BaseException) -> bool:
+    return isinstance(e, _RetryableResponse) or retry.is_retryable(e)
+
+
+def _retryable_update(e: BaseException) -> bool:
+    # The request was never sent so it is safe to send it again.
+    return isinstance(e, requests.exceptions.ConnectTimeout)
+
+
+def _decode(response: requests.Response):
+    """
+    Decodes the JSON body of a response the same way bioblend does.
+    """
+    if response.status_code == 200:
+        try:
+            return response.json()
+        except Exception as e:
+            raise ConnectionError(
+                f"Request was successful, but cannot decode the response content: {e}",
+                body=response.content,
+                status_code=response.status_code,
+            )
+    raise ConnectionError(
+        f"Unexpected HTTP status code: {response.status_code}",
+        body=response.text,
+        status_code=response.status_code,
+    )
+
+
+def make_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """
+    Creates a session that keeps up to *pool_size* connections alive.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class ConnectionRegistry:
+    """
+    Hands out one PooledGalaxyInstance per (server, key) pair.
+    """
+
+    def __init__(self):
+        self.connections = {}
+        self.stats = ConnectionStats()
+        self._lock = threading.Lock()
+
+    def get(self, server: str, key: str, pool_size: int = None):
+        """
+        Returns the shared connection for *server* and *key*, creating it with
+        a pool of *pool_size* connections the first time.  The number of
+        concurrent AsyncGalaxy requests to the server is limited to the same
+        size.
+        """
+        if pool_size is None:
+            pool_size = DEFAULT_POOL_SIZE
+        with self._lock:
+            gi = self.connections.get((server, key))
+            if gi is not None:
+                self.stats.hits += 1
+                return gi
+            self.stats.misses += 1
+            gi = PooledGalaxyInstance(server, key, make_session(pool_size), self.stats)
+            self.connections[(server, key)] = gi
+        async_galaxy.set_limit(cache.server_key(gi), pool_size)
+        return gi
+
+    def close(self):
+        with self._lock:
+            for gi in self.connections.values():
+                gi.session.close()
+            self.connections.clear()
+
+    def summary(self) -> str:
+        stats = self.stats.as_dict()
+        return (
+            f"{stats['requests']} requests, {stats['errors']} errors, "
+            f"mean latency {stats['mean_latency']:.3f}s, "
+            f"max latency {stats['max_latency']:.3f}s, "
+            f"{stats['misses']} connections opened, {stats['hits']} reused"
+        )
+
+
+def get_registry() -> ConnectionRegistry:
+    """
+    Returns the ConnectionRegistry shared by everything in this process.
+    """
+    if lib.connections is None:
+        lib.connections = ConnectionRegistry()
+    return lib.connections
@@ -385,6 +385,34 @@ def _import_from_url(gi, history, url, **kwargs):
     response = gi.tools.put_url(url, history, **kwargs)
     gi.histories.update_history(history, annotation=f"Imported {url}")
     print(json.dumps(response, indent=4))
+    return response
+
+
+def _import_from_urls(gi, history, elements: list):
+    """
+    Imports several URLs into a history with a single request to the Galaxy
+    fetch API.
+
+    :param elements: dictionaries with the *url* and optionally the *name* and
+      *ext* (datatype) of each dataset.
+    """
+    payload = {
+        'history_id': history,
+        'targets': [
+            {
+                'destination': {'type': 'hdas'},
+                'elements': [
+                    {'src': 'url', 'ext': 'auto', 'dbkey': '?', **element}
+                    for element in elements
+                ],
+            }
+        ],
+    }
+    response = gi.make_post_request(f"{gi.url}/tools/fetch", payload=payload)
+    urls = ', '.join(element['url'] for element in elements)
+    gi.histories.update_history(history, annotation=f"Imported {urls}")
+    print(json.dumps(response, indent=4))
+    return response
 
 
 def download(context: Context, args: list):
@@ -1,15 +1,26 @@
 import argparse
+import heapq
 import json
 import logging
+import math
+import multiprocessing
 import os
-import threading
+import re
+import tempfile
 import traceback
 from datetime import timedelta
 from pprint import pprint
 from time import perf_counter
 
+import analytics
 import benchmark
+import cache
+import connection
 import helm
+import ledger
+import metrics
+import scheduler
+import shell
 import yaml
 from common import (
     Context,
@@ -22,6 +33,14 @@ from common import (
 INVOCATIONS_DIR = "invocations"
 METRICS_DIR = "metrics"
 
+# The number of rows sorted in memory before they are spilled to disk.
+SORT_BUFFER_ROWS = 100000
+
+# The resources used for tools without a rule of their own.
+DEFAULT_RESOURCE_SET = 'default'
+DEFAULT_CPU = 1
+DEFAULT_MEMORY_GB = 2
+
 log = logging.getLogger('abm')
 
 
@@ -37,6 +56,11 @@ def run(context: Context, args: list):
     parser = argparse.ArgumentParser()
     parser.add_argument('benchmark_path')
     parser.add_argument('-r', '--run-number', default=-1)
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='skip runs the ledger shows are complete and reattach to unfinished invocations',
+    )
     argv = parser.parse_args(args)
 
     benchmark_path = argv.benchmark_path
@@ -49,62 +73,96 @@ def run(context: Context, args: list):
         config = yaml.safe_load(f)
     config['start_at'] = argv.run_number
     print(f"Starting with run number {argv.run_number}")
+    cache.configure(float(config.get('resolve_cache_ttl', 0)))
 
     profiles = load_profiles()
-    threads = []
-    start = perf_counter()
+    clouds = []
     for cloud in config['cloud']:
         if cloud not in profiles:
             print(f"WARNING: No profile found for {cloud}")
             continue
-        t = threading.Thread(target=run_on_cloud, args=(cloud, config))
-        threads.append(t)
-        print(f"Starting thread for {cloud}")
-        t.start()
-    print('Waiting for threads')
-    for t in threads:
-        t.join()
-
-    end = perf_counter()
-    print('All threads have terminated.')
-    print(f"Execution time {timedelta(seconds=end - start)}")
-
-
-def run_on_cloud(cloud: str, config: dict):
-    print("------------------------")
-    print(f"Benchmarking: {cloud}")
-    context = Context(cloud)
+        clouds.append(cloud)
+
+    first = int(config['start_at'])
+    if first < 0:
+        first = 1
+    print(f"Staring run number {first}")
+    items = scheduler.make_work_items(config, clouds, first, first + config['runs'])
+    runs = ledger.RunLedger(ledger.ledger_path(config['name']), argv.resume)
+    if argv.resume:
+        pending = [
+            item
+            for item in items
+            if _item_ledger(runs, item).state() != ledger.COMPLETE
+        ]
+        print(
+            f"Resuming: {len(items) - len(pending)} of {len(items)} runs are complete"
+        )
+        items = pending
+    contexts = {cloud: Context(cloud) for cloud in clouds}
     namespace = 'galaxy'
     chart = 'anvil/galaxykubeman'
-    start = int(config['start_at'])
-    print(f"Staring run number {start}")
-    if start < 0:
-        start = 1
-    print(f"Staring run number {start}")
-    end = start + config['runs']
     if 'galaxy' in config:
         namespace = config['galaxy']['namespace']
         chart = config['galaxy']['chart']
-    if 'job_configs' in config and len(config['job_configs']) > 0:
-        for conf in config['job_configs']:
-            rules_file = f"rules/{conf}.yml"
-            print(f"Applying {rules_file} namespace:{namespace} chart:{chart}")
-            if not helm.update(context, [f"rules/{conf}.yml", namespace, chart]):
-                log.warning(f"job configuration not found: rules/{conf}.yml")
-                continue
-            for workflow_conf in config['benchmark_confs']:
-                for n in range(start, end):
-                    history_name_prefix = f"{n} {cloud} {conf}"
-                    benchmark.run(
-                        context, workflow_conf, history_name_prefix, config['name']
-                    )
-    else:
-        for workflow_conf in config['benchmark_confs']:
-            for n in range(start, end):
-                history_name_prefix = f"{n} {cloud}"
-                benchmark.run(
-                    context, workflow_conf, history_name_prefix, config['name']
-                )
+    parallel = int(config.get('parallel', 1))
+    threads = int(config.get('metrics_threads', metrics.DEFAULT_THREADS))
+    metrics_db = config.get('metrics_db')
+
+    def apply_conf(cloud: str, conf: str) -> bool:
+        rules_file = f"rules/{conf}.yml"
+        print("------------------------")
+        print(f"Applying {rules_file} to {cloud} namespace:{namespace} chart:{chart}")
+        return helm.update(contexts[cloud], [rules_file, namespace, chart])
+
+    def run_item(item: scheduler.WorkItem) -> bool:
+        print(f"Benchmarking: {item}")
+        item_ledger = _item_ledger(runs, item)
+        item_ledger.started()
+        ok = False
+        try:
+            ok = benchmark.run(
+                contexts[item.cloud],
+                item.benchmark,
+                item.history_prefix(),
+                config['name'],
+                parallel,
+                threads,
+                metrics_db,
+                item_ledger,
+            )
+        finally:
+            # Only an explicit True is a completed run, a run that stopped
+            # early must not be skipped by --resume.
+            item_ledger.finished(ok is True)
+        return ok is True
+
+    schedule = scheduler.Scheduler(
+        items, run_item, apply_conf, config.get('concurrency', 1)
+    )
+    print(f"Scheduled {schedule.total} benchmark runs on {len(clouds)} clouds")
+    start = perf_counter()
+    try:
+        schedule.run()
+    finally:
+        runs.close()
+
+    end = perf_counter()
+    print('All benchmark runs have finished.')
+    if len(schedule.failed) > 0:
+        print(f"WARNING: {len(schedule.failed)} runs failed")
+        for item in schedule.failed:
+            print(f"    {item}")
+    print(f"Execution time {timedelta(seconds=end - start)}")
+    print(f"Galaxy API: {connection.get_registry().summary()}")
+    commands = shell.summary()
+    if commands:
+        print(commands)
+    return len(schedule.failed) == 0
+
+
+def _item_ledger(runs, item: scheduler.WorkItem):
+    return runs.item(item.cloud, item.job_conf, item.benchmark, item.run_number)
 
 
 def test(context: Context, args: list):
@@ -127,7 +185,8 @@ def summarize(context: Context, args: list):
     Parses all the files in the specified directory and prints metrics
     as CSV to stdout
 
-    :param args[0]: The path to the directory containing metrics filees
+    :param args[0]: The path to the directory containing metrics filees. When
+      *--db* is given these are the names of the experiments to include.
     :return: None
     """
     markdown = False
@@ -143,6 +202,35 @@ def summarize(context: Context, args: list):
     parser.add_argument('--markdown', action='store_true')
     parser.add_argument('--v1', action='store_true', help='Use cgroup metrics v1')
     parser.add_argument('--v2', action='store_true', help='Use cgroup metrics v2')
+    parser.add_argument('--db', help='Read the metrics from this SQLite database')
+    parser.add_argument(
+        '--stats',
+        action='store_true',
+        help='Print the mean, median and 95th percentile runtime and memory of the successful jobs for each cloud, job conf and tool',
+    )
+    parser.add_argument(
+        '-j',
+        '--processes',
+        type=int,
+        default=1,
+        help='Number of processes used to parse the metrics files',
+    )
+    parser.add_argument(
+        '--sort-buffer',
+        type=int,
+        default=SORT_BUFFER_ROWS,
+        help='Number of rows sorted in memory before spilling to disk',
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Parse every metrics file without reading or updating the summary cache',
+    )
+    parser.add_argument(
+        '--rebuild-cache',
+        action='store_true',
+        help='Discard the summary cache and parse every metrics file again',
+    )
 
     parser.add_argument('-s', '--sort-by', choices=['runtime', 'memory', 'tool'])
     argv = parser.parse_args(args)
@@ -164,52 +252,67 @@ def summarize(context: Context, args: list):
 
     if count == 0:
         print("ERROR: no output format selected")
-        return
+        return False
     if count > 1:
         print("ERROR: multiple output formats selected")
-        return
+        return False
+    if argv.stats and argv.model:
+        print("ERROR: --stats can not be used with --model")
+        return False
+    if argv.stats and not analytics.NUMPY_AVAILABLE:
+        print("ERROR: --stats requires the numpy package")
+        return False
+
+    if argv.db is not None and not os.path.isfile(argv.db):
+        print(f"ERROR: metrics database not found {argv.db}")
+        return False
 
     input_dirs = argv.dirs
 
-    if len(input_dirs) == 0:
+    if argv.db is None and len(input_dirs) == 0:
         input_dirs.append('metrics')
 
     if separator is None:
         separator = ','
 
-    if markdown:
+    # The statistics have their own header.
+    if argv.stats:
+        header_row = None
+    if markdown and header_row is not None:
         print("|Run|Inputs|Job Conf|Tool|State|Runtime (Sec)|Max Memory (GB)|")
         print("|---|---|---|---|---|---:|---:|")
-    else:
+    elif header_row is not None:
         print(header_row)
 
-    global accept_metrics
     if argv.v1:
-        accept_metrics = accept_metrics_v1
+        _set_accept_metrics(accept_metrics_v1)
     else:
-        accept_metrics = accept_metrics_v2
-
-    table = list()
-    GB = float(1073741824)
-    for input_dir in input_dirs:
-        for file in os.listdir(input_dir):
-            input_path = os.path.join(input_dir, file)
-            if not os.path.isfile(input_path) or not input_path.endswith('.json'):
-                continue
-            try:
-                with open(input_path, 'r') as f:
-                    data = json.load(f)
-                if data['metrics']['tool_id'] == 'upload1':
-                    # print('Ignoring upload tool')
-                    continue
-                row = make_row(data)
-                table.append(row)
-            except Exception as e:
-                print(f"Unable to process {input_path}")
-                print(e)
-                traceback.print_exc()
-                # Silently fail to allow the remainder of the table to be generated.
-                # pass
+        _set_accept_metrics(accept_metrics_v2)
+
+    if argv.db is None:
+        rows = _summarize_dirs(
+            input_dirs,
+            make_row,
+            accept_metrics,
+            argv.processes,
+            not argv.no_cache,
+            argv.rebuild_cache,
+        )
+    else:
+        rows = _summarize_db(argv.db, input_dirs, make_row)
+
+    if argv.stats:
+        table = analytics.aggregate(rows, ['ok'])
+        if markdown:
+            print(f"|{'|'.join(analytics.HEADER)}|")
+            print("|---|---|---|" + "---:|" * (len(analytics.HEADER) - 3))
+            for row in table:
+                print(f"| {' | '.join(row)} |")
+        else:
+            print(separator.join(analytics.HEADER))
+            for row in table:
+                print(separator.join(row))
+        return
 
     reverse = True
     if argv.sort_by:
@@ -227,11 +330,11 @@ def summarize(context: Context, args: list):
             # print('Getting string key accessor.')
             comp = get_str_key(6)
             reverse = False
-        # table.sort(key=lambda row: -1 if row[key] == '' else float(row[key]), reverse=True)
-        table.sort(key=comp, reverse=reverse)
+        rows = external_sort(rows, comp, reverse, argv.sort_buffer)
 
+    GB = float(1073741824)
     if markdown:
-        for row in table:
+        for row in rows:
             # i = 0
             # for e in row:
             #     print(f" {i:02}: {e}")
@@ -251,10 +354,480 @@ def summarize(context: Context, args: list):
                 f"| {row[0]} | {row[5].split(' ')[0]} |{row[2]} | {row[6]} | {row[7]} | {runtime}  | {memory} |"
             )
     else:
-        for row in table:
+        for row in rows:
             print(separator.join([str(x) for x in row]))
 
 
+def _metrics_files(input_dir: str):
+    """
+    Yields an *os.DirEntry* for every JSON file in *input_dir*.
+    """
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith('.json'):
+                yield entry
+
+
+def _summarize_dirs(
+    input_dirs: list,
+    make_row,
+    accept: list,
+    processes: int = 1,
+    use_cache: bool = True,
+    rebuild: bool = False,
+):
+    """
+    Yields a table row for every metrics file in *input_dirs*.
+
+    Rows for files that have not changed since the last summary are taken
+    from the SummaryCache in each directory and yielded first. The remaining
+    files are parsed, in a process pool when *processes* is more than one,
+    and only the rows are sent back so the full JSON documents are never held
+    by the parent process. Rows are yielded as soon as they are available.
+    """
+    key = SummaryCache.make_key(make_row, accept)
+    caches = {}
+    stale = []
+    for input_dir in input_dirs:
+        cache = None
+        if use_cache:
+            cache = SummaryCache(input_dir, key, rebuild)
+            caches[input_dir] = cache
+        for entry in _metrics_files(input_dir):
+            if cache is not None:
+                hit, row = cache.lookup(entry)
+                if hit:
+                    if row is not None:
+                        yield row
+                    continue
+            stale.append((cache, entry))
+
+    tasks = ((entry.path, make_row) for _, entry in stale)
+    if processes > 1:
+        pool = multiprocessing.Pool(
+            processes, initializer=_init_summarize_worker, initargs=(accept,)
+        )
+        results = pool.imap(_summarize_file, tasks, chunksize=64)
+    else:
+        pool = None
+        results = map(_summarize_file, tasks)
+    try:
+        for (cache, entry), (input_path, row, error) in zip(stale, results):
+            if error is not None:
+                print(f"Unable to process {input_path}")
+                print(error)
+                continue
+            if cache is not None:
+                cache.store(entry, row)
+            if row is not None:
+                yield row
+    finally:
+        if pool is not None:
+            pool.terminate()
+    for cache in caches.values():
+        cache.save()
+
+
+class SummaryCache:
+    """
+    The rows extracted from the metrics files in a directory, saved to
+    *.abm-summary-cache* in that directory.
+
+    Entries are keyed on the file name and are only used while the
+    modification time and size of the file are unchanged. The whole cache is
+    discarded when its *key*, the row format and the accepted metrics, does
+    not match the current summary.
+    """
+
+    FILENAME = '.abm-summary-cache'
+    VERSION = 3
+
+    def __init__(self, input_dir: str, key: str, rebuild: bool = False):
+        self.path = os.path.join(input_dir, SummaryCache.FILENAME)
+        self.key = key
+        self.entries = {}
+        self.seen = set()
+        self.dirty = rebuild
+        if rebuild or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"WARNING: ignoring unreadable summary cache {self.path}: {e}")
+            return
+        if data.get('version') == SummaryCache.VERSION and data.get('key') == key:
+            self.entries = data.get('files', {})
+
+    @staticmethod
+    def make_key(make_row, accept: list) -> str:
+        return json.dumps([make_row.__name__, accept])
+
+    @staticmethod
+    def signature(entry: os.DirEntry) -> list:
+        stat = entry.stat()
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def lookup(self, entry: os.DirEntry):
+        """
+        :return: a (hit, row) tuple. The row is None for files that do not
+          produce a row, e.g. upload jobs.
+        """
+        self.seen.add(entry.name)
+        cached = self.entries.get(entry.name)
+        if cached is None or cached[0] != self.signature(entry):
+            return False, None
+        return True, cached[1]
+
+    def store(self, entry: os.DirEntry, row: list):
+        self.entries[entry.name] = [self.signature(entry), row]
+        self.dirty = True
+
+    def save(self):
+        """
+        Writes the cache if it changed, dropping entries for deleted files.
+        """
+        stale = set(self.entries) - self.seen
+        if not self.dirty and len(stale) == 0:
+            return
+        for name in stale:
+            del self.entries[name]
+        data = {'version': SummaryCache.VERSION, 'key': self.key, 'files': self.entries}
+        try:
+            metrics.write_json(self.path, data)
+        except OSError as e:
+            print(f"WARNING: unable to save the summary cache {self.path}: {e}")
+            return
+        self.dirty = False
+
+
+def _summarize_db(database: str, experiments: list, make_row):
+    """
+    Yields a table row for every record in *database*.
+    """
+    for input_path, data in _load_metrics_db(database, experiments):
+        try:
+            if data['metrics']['tool_id'] == 'upload1':
+                continue
+            yield make_row(data)
+        except Exception as e:
+            print(f"Unable to process {input_path}")
+            print(e)
+            traceback.print_exc()
+
+
+def _init_summarize_worker(accept: list):
+    _set_accept_metrics(accept)
+
+
+def _summarize_file(task: tuple):
+    """
+    Converts a single metrics file to a table row.
+
+    :param task: the path to the metrics file and the function that makes the row
+    :return: a (path, row, error) tuple. The row is None for upload jobs and
+      the error is None unless the file could not be processed.
+    """
+    input_path, make_row = task
+    try:
+        with open(input_path, 'r') as f:
+            data = json.load(f)
+        if data['metrics']['tool_id'] == 'upload1':
+            return input_path, None, None
+        return input_path, make_row(data), None
+    except Exception:
+        # Silently fail to allow the remainder of the table to be generated.
+        return input_path, None, traceback.format_exc()
+
+
+def external_sort(
+    rows, key, reverse: bool = False, buffer_size: int = SORT_BUFFER_ROWS
+):
+    """
+    Sorts *rows* using at most *buffer_size* rows of memory.
+
+    Rows are sorted in memory until the buffer fills, after which each sorted
+    run is written to a temporary file and the runs are merged. The sort is
+    stable, like *list.sort*.
+
+    :param rows: an iterable of JSON serializable lists
+    :param key: the function that returns the sort key for a row
+    :param reverse: sort in descending order
+    :param buffer_size: the number of rows held in memory
+    :return: a generator over the sorted rows
+    """
+    buffer_size = max(1, buffer_size)
+    with tempfile.TemporaryDirectory(prefix='abm-sort-') as tmpdir:
+        runs = []
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= buffer_size:
+                runs.append(_write_sort_run(tmpdir, len(runs), buffer, key, reverse))
+                buffer = []
+        buffer.sort(key=key, reverse=reverse)
+        if len(runs) == 0:
+            yield from buffer
+            return
+        files = [open(path, 'r') for path in runs]
+        try:
+            streams = [(json.loads(line) for line in f) for f in files]
+            streams.append(iter(buffer))
+            yield from heapq.merge(*streams, key=key, reverse=reverse)
+        finally:
+            for f in files:
+                f.close()
+
+
+def _write_sort_run(tmpdir: str, index: int, rows: list, key, reverse: bool) -> str:
+    rows.sort(key=key, reverse=reverse)
+    path = os.path.join(tmpdir, f"run-{index}.jsonl")
+    with open(path, 'w') as f:
+        for row in rows:
+            f.write(json.dumps(row))
+            f.write('\n')
+    return path
+
+
+def ingest(context: Context, args: list):
+    """
+    Copies the JSON metrics files in one or more directories into a SQLite
+    database that can be read with *experiment summarize --db*.
+
+    :param args: --db PATH followed by the metrics directories to ingest
+    :return: None
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', required=True)
+    parser.add_argument('dirs', nargs='+')
+    argv = parser.parse_args(args)
+
+    sink = metrics.SqliteSink(argv.db)
+    try:
+        for input_dir in argv.dirs:
+            if not os.path.isdir(input_dir):
+                print(f"ERROR: {input_dir} is not a directory")
+                continue
+            experiment = metrics.experiment_name(input_dir)
+            records = (
+                (os.path.splitext(os.path.basename(path))[0], data)
+                for path, data in _load_metrics_dirs([input_dir])
+            )
+            count = sink.write_many(experiment, records)
+            print(f"Ingested {count} records from {input_dir} as {experiment}")
+    finally:
+        sink.close()
+
+
+def model(context: Context, args: list):
+    """
+    Fits a model of the runtime and peak memory of each tool against the
+    size of its inputs, using the same rows as *summarize --model*, and
+    prints the recommended CPU and memory for each tool as a rules file that
+    can be applied with *helm update*.
+
+    :param args: the metrics directories, or experiment names with *--db*
+    :return: None
+    """
+    parser = argparse.ArgumentParser(prog='abm experiment model')
+    parser.add_argument('dirs', nargs='*')
+    parser.add_argument('--db', help='Read the metrics from this SQLite database')
+    parser.add_argument('-o', '--output', help='Write the rules to this file')
+    parser.add_argument(
+        '--csv',
+        action='store_true',
+        help='Print the fitted models as CSV instead of the rules',
+    )
+    parser.add_argument(
+        '--headroom',
+        type=float,
+        default=1.2,
+        help='Multiply the recommended memory by this factor (default 1.2)',
+    )
+    parser.add_argument(
+        '--input-size',
+        type=float,
+        help='Recommend memory for inputs of this many GB. Defaults to the largest input seen for each tool',
+    )
+    argv = parser.parse_args(args)
+
+    if not analytics.NUMPY_AVAILABLE:
+        print("ERROR: experiment model requires the numpy package")
+        return False
+    if argv.db is not None and not os.path.isfile(argv.db):
+        print(f"ERROR: metrics database not found {argv.db}")
+        return False
+
+    input_dirs = argv.dirs
+    if argv.db is None:
+        if len(input_dirs) == 0:
+            input_dirs.append('metrics')
+        records = _load_metrics_dirs(input_dirs)
+    else:
+        records = _load_metrics_db(argv.db, input_dirs)
+
+    models = analytics.ToolModels(_model_rows(records))
+    if len(models) == 0:
+        print("ERROR: no successful jobs found")
+        return False
+    if models.missing_cpu > 0:
+        print(
+            f"WARNING: {models.missing_cpu} jobs did not report their CPU usage, "
+            "their galaxy_slots were used instead"
+        )
+    if argv.csv:
+        print(','.join(analytics.MODEL_HEADER))
+        for row in models.table():
+            print(','.join(row))
+        return
+
+    values = make_rules(models, argv.headroom, argv.input_size)
+    text = yaml.dump(values, Dumper=_RulesDumper, sort_keys=False)
+    if argv.output is None:
+        print(text, end='')
+        return
+    with open(argv.output, 'w') as f:
+        f.write(text)
+    print(f"Wrote rules for {len(models)} tools to {argv.output}")
+
+
+def _model_rows(records):
+    """
+    Yields the model row for every job in *records*, with the version
+    removed from the tool ID so all versions of a tool share a model.
+    """
+    for input_path, data in records:
+        try:
+            if data['metrics']['tool_id'] == 'upload1':
+                continue
+            row = make_model_row(data)
+        except Exception as e:
+            print(f"Unable to process {input_path}")
+            print(e)
+            continue
+        row[1] = tool_pattern(row[1])
+        yield row
+
+
+def tool_pattern(tool_id: str) -> str:
+    """
+    The pattern that matches every version of a tool in the container mapper
+    rules.  Tool IDs that are not from a Tool Shed are used as is.
+    """
+    parts = tool_id.split('/')
+    if len(parts) >= 6 and parts[1] == 'repos':
+        return '/'.join(parts[:-1]) + '/.*'
+    return tool_id
+
+
+def make_rules(models, headroom: float = 1.2, input_size: float = None) -> dict:
+    """
+    Creates the Helm values that set the container mapper rules to the
+    resources recommended by the *models*.
+
+    The memory for each tool is the larger of the predicted memory for the
+    input size and the largest peak memory seen, times the *headroom*, in
+    whole GB.  The CPU is the largest number of cores the tool was seen to
+    use, rounded up.
+
+    :param models: the analytics.ToolModels fitted to the metrics
+    :param input_size: the input size in GB to predict the memory for
+    """
+    memory = models.predict_memory(input_size)
+    resource_sets = {
+        DEFAULT_RESOURCE_SET: _resources(DEFAULT_CPU, DEFAULT_MEMORY_GB),
+    }
+    mappings = []
+    for i, pattern in enumerate(models.tools):
+        peak = max(_finite(memory[i]), _finite(models.max_memory[i]))
+        if peak == 0:
+            # Nothing is known about the memory used by this tool.
+            continue
+        cpu = max(1, math.ceil(_finite(models.max_cpu[i])))
+        name = _resource_set_name(str(pattern), resource_sets)
+        resource_sets[name] = _resources(cpu, max(1, math.ceil(peak * headroom)))
+        mappings.append({'tool_ids': [str(pattern)], 'resource_set': name})
+    rules = {
+        'mappings': mappings,
+        'resources': {
+            'resource_sets': resource_sets,
+            'default_resource_set': DEFAULT_RESOURCE_SET,
+        },
+    }
+    content = yaml.safe_dump(rules, sort_keys=False)
+    return {'jobs': {'rules': {'container_mapper_rules.yml': {'content': content}}}}
+
+
+def _resources(cpu: int, memory_gb: int) -> dict:
+    resources = {'cpu': cpu, 'memory': f"{memory_gb}G"}
+    return {'requests': dict(resources), 'limits': dict(resources)}
+
+
+def _resource_set_name(pattern: str, resource_sets: dict) -> str:
+    """
+    A unique resource set name for a tool, e.g. *bwa_mem* for the Tool Shed
+    pattern of the BWA-MEM tool.
+    """
+    parts = pattern.split('/')
+    base = parts[-2] if pattern.endswith('/.*') else pattern
+    base = re.sub(r'[^A-Za-z0-9_]', '_', base)
+    name = base
+    suffix = 2
+    while name in resource_sets:
+        name = f"{base}_{suffix}"
+        suffix += 1
+    return name
+
+
+def _finite(value) -> float:
+    return value if math.isfinite(value) else 0
+
+
+class _RulesDumper(yaml.SafeDumper):
+    """
+    Writes multi-line strings, the rules file content, as literal blocks.
+    """
+
+    def represent_str(self, data):
+        style = '|' if '\n' in data else None
+        return self.represent_scalar('tag:yaml.org,2002:str', data, style=style)
+
+
+_RulesDumper.add_representer(str, _RulesDumper.represent_str)
+
+
+def _load_metrics_dirs(input_dirs: list):
+    """
+    Yields (path, data) for every JSON metrics file in *input_dirs*.
+    """
+    for input_dir in input_dirs:
+        for file in os.listdir(input_dir):
+            input_path = os.path.join(input_dir, file)
+            if not os.path.isfile(input_path) or not input_path.endswith('.json'):
+                continue
+            try:
+                with open(input_path, 'r') as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"Unable to process {input_path}")
+                print(e)
+                continue
+            yield input_path, data
+
+
+def _load_metrics_db(database: str, experiments: list):
+    """
+    Yields (location, data) for the records in *database*, optionally only
+    those from the named *experiments*.
+    """
+    store = metrics.SqliteSink(database)
+    try:
+        for experiment, job_id, data in store.records(experiments):
+            yield f"{database}:{experiment}/{job_id}", data
+    finally:
+        store.close()
+
+
 accept_metrics_v1 = [
     'galaxy_slots',
     'galaxy_memory_mb',
@@ -275,6 +848,15 @@ accept_metrics_v2 = [
 
 accept_metrics = accept_metrics_v2
 
+# The column of each accepted metric in the table rows.
+metric_columns = {name: i for i, name in enumerate(accept_metrics)}
+
+
+def _set_accept_metrics(accept: list):
+    global accept_metrics, metric_columns
+    accept_metrics = accept
+    metric_columns = {name: i for i, name in enumerate(accept)}
+
 
 def make_table_row(data: dict):
     row = [
@@ -297,8 +879,11 @@ def make_model_row(data: dict):
     row.append(tool_id.split('/')[-1])
     row.append(metrics['state'])
     job_metrics = parse_job_metrics(metrics['job_metrics'])
-    row.append(job_metrics.get('memory.max_usage_in_bytes', 0))
-    row.append(job_metrics.get('cpuacct.usage', 0))
+    # cgroup v2 reports the peak memory as memory.peak
+    row.append(
+        job_metrics.get('memory.max_usage_in_bytes', job_metrics.get('memory.peak', 0))
+    )
+    row.append(_cpu_usage(job_metrics))
     row.append(job_metrics.get('processor_count', 0))
     row.append(job_metrics.get('galaxy_slots', 0))
     row.append(job_metrics.get('runtime_seconds', 0))
@@ -316,11 +901,25 @@ def make_model_row(data: dict):
     return row
 
 
+def _cpu_usage(job_metrics: dict):
+    """
+    The CPU time of a job in nanoseconds, or 0 if it was not reported.
+    cgroup v1 reports cpuacct.usage in nanoseconds and cgroup v2 reports
+    cpu.stat.usage_usec in microseconds.
+    """
+    if 'cpuacct.usage' in job_metrics:
+        return job_metrics['cpuacct.usage']
+    try:
+        return int(float(job_metrics['cpu.stat.usage_usec']) * 1000)
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
 def _get_metrics(metrics: list):
     row = [''] * len(accept_metrics)
     for job_metrics in metrics:
-        if job_metrics['name'] in accept_metrics:
-            index = accept_metrics.index(job_metrics['name'])
+        index = metric_columns.get(job_metrics['name'])
+        if index is not None:
             try:
                 row[index] = job_metrics['raw_value']
             except:
@@ -330,8 +929,8 @@ def _get_metrics(metrics: list):
 
 def add_metrics_to_row(metrics_list: list, row: list):
     for job_metrics in metrics_list:
-        if job_metrics['name'] in accept_metrics:
-            index = accept_metrics.index(job_metrics['name'])
+        index = metric_columns.get(job_metrics['name'])
+        if index is not None:
             try:
                 row[index + 8] = job_metrics['raw_value']
             except:
@@ -2,9 +2,15 @@ import argparse
 import json
 import os
 import time
+from time import perf_counter
 
 from common import Context, find_executable, get_env, run
 
+# The number of seconds to wait for the deployments to roll out.
+ROLLOUT_TIMEOUT = 1800
+# The number of seconds between readiness checks.
+POLL_INTERVAL = 5
+
 
 def rollback(context: Context, args: list):
     helm = find_executable('helm')
@@ -57,10 +63,7 @@ def update(context: Context, args: list):
         return False
 
     print('Waiting for the new deployments to come online')
-    # Give kubernetes a moment to start processing the update.
-    time.sleep(5)
-    wait_until_ready(namespace, env)
-    return True
+    return wait_until_ready(namespace, env)
 
 
 def update_cli(context: Context, args: list):
@@ -91,7 +94,7 @@ def update_cli(context: Context, args: list):
 
 def wait(context: Context, args: list):
     namespace = args[0] if len(args) > 0 else 'galaxy'
-    wait_until_ready(namespace)  # , get_env(context))
+    wait_until_ready(namespace, get_env(context))
 
 
 def filter(lines: list, item: str):
@@ -133,23 +136,112 @@ def wait_for(kubectl: str, namespace: str, name: str, env: dict):
 #     wait_for(kubectl, namespace, 'galaxy-job', env)
 #     wait_for(kubectl, namespace, 'galaxy-web', env)
 #     wait_for(kubectl, namespace, 'galaxy-workflow', env)
-def wait_until_ready(namespace: str, env: dict):
+def wait_until_ready(
+    namespace: str,
+    env: dict,
+    timeout: float = ROLLOUT_TIMEOUT,
+    interval: float = POLL_INTERVAL,
+) -> bool:
+    """
+    Waits until the rollouts of the Galaxy job, web and workflow deployments
+    have completed.
+
+    Every deployment is checked on each tick with a single ``kubectl get``
+    call, so the wait takes as long as the slowest rollout rather than the
+    sum of all of them.
+
+    :param namespace: the namespace Galaxy is deployed to
+    :param env: the environment for the kubectl command
+    :param timeout: the number of seconds to wait before giving up
+    :param interval: the number of seconds between checks
+    :return: True if every deployment is ready
+    """
     kubectl = find_executable('kubectl')
-    data = run(f"{kubectl} get deployment -n {namespace} -o json", env)
-    deployment_data = json.loads(data)
-    deployments = list()
-    for deployment in deployment_data['items']:
-        metadata = deployment['metadata']
-        name = metadata['name']
-        if 'job' in name or 'web' in name or 'workflow' in name:
-            deployments.append(name)
-    for deployment in deployments:
-        print(
-            run(
-                f"{kubectl} rollout status deployment -n {namespace} {deployment} --watch",
-                env,
+    if kubectl is None:
+        print('ERROR: kubectl is not available on the $PATH')
+        return False
+    command = f"{kubectl} get deployment -n {namespace} -o json"
+    start = perf_counter()
+    ready = {}
+    while True:
+        try:
+            data = json.loads(run(command, env))
+        except (RuntimeError, ValueError) as e:
+            print(f"ERROR: unable to get the deployments in {namespace}: {e}")
+            return False
+        deployments = galaxy_deployments(data)
+        if len(deployments) == 0:
+            print(f"ERROR: there are no Galaxy deployments in namespace {namespace}")
+            return False
+        elapsed = perf_counter() - start
+        for deployment in deployments:
+            name = deployment['metadata']['name']
+            if name in ready:
+                continue
+            done, message = rollout_status(deployment)
+            if done:
+                ready[name] = elapsed
+                print(f"{name} is ready after {elapsed:.0f}s")
+            elif message is not None:
+                print(f"ERROR: {name} {message}")
+                return False
+        pending = [
+            d['metadata']['name']
+            for d in deployments
+            if d['metadata']['name'] not in ready
+        ]
+        if len(pending) == 0:
+            print(f"All deployments are ready after {elapsed:.0f}s")
+            return True
+        if elapsed >= timeout:
+            print(
+                f"ERROR: timed out after {elapsed:.0f}s waiting for "
+                + ', '.join(pending)
             )
-        )
+            return False
+        time.sleep(interval)
+
+
+def galaxy_deployments(data: dict) -> list:
+    """
+    Selects the job, web and workflow deployments from the output of
+    ``kubectl get deployment -o json``.
+    """
+    result = []
+    for deployment in data.get('items', []):
+        name = deployment['metadata']['name']
+        if 'job' in name or 'web' in name or 'workflow' in name:
+            result.append(deployment)
+    return result
+
+
+def rollout_status(deployment: dict) -> tuple:
+    """
+    Checks if the rollout of a deployment has completed, using the same
+    conditions as ``kubectl rollout status``.
+
+    :return: a tuple (done, message) where *message* is set if the rollout
+      has failed.
+    """
+    metadata = deployment.get('metadata', {})
+    spec = deployment.get('spec', {})
+    status = deployment.get('status', {})
+    if status.get('observedGeneration', 0) < metadata.get('generation', 0):
+        # The deployment controller has not seen the update yet.
+        return False, None
+    for condition in status.get('conditions', []):
+        if condition.get('reason') == 'ProgressDeadlineExceeded':
+            return False, 'exceeded its progress deadline'
+    replicas = spec.get('replicas', 1)
+    updated = status.get('updatedReplicas', 0)
+    if updated < replicas:
+        return False, None
+    if status.get('replicas', 0) > updated:
+        # Old replicas are still terminating.
+        return False, None
+    if status.get('availableReplicas', 0) < updated:
+        return False, None
+    return True, None
 
 
 def _list(context: Context, args: list):
@@ -1,4 +1,5 @@
 import argparse
+import asyncio
 import json
 import os
 import sys
@@ -8,18 +9,23 @@ from pprint import pprint
 
 import yaml
 from bioblend.galaxy.objects import GalaxyInstance
+from lib import job_cache
+from lib.async_galaxy import AsyncGalaxy
 from lib.common import (
     Context,
     connect,
     find_config,
     find_history,
+    get_all_jobs_async,
     get_float_key,
     get_str_key,
     parse_profile,
     print_json,
+    print_markdown_header,
+    print_markdown_row,
     print_markdown_table,
     print_table_header,
-    summarize_metrics,
+    summarize_metrics_async,
     try_for,
 )
 
@@ -30,6 +36,12 @@ from lib.common import (
 # The number of times a failed job will be restarted.
 RESTART_MAX = 3
 
+# Bounds (in seconds) and growth factor for the adaptive polling interval used
+# when waiting for jobs in a history.
+POLL_MIN_INTERVAL = 2
+POLL_MAX_INTERVAL = 30
+POLL_BACKOFF = 2.0
+
 
 def longest_name(histories: list):
     longest = 0
@@ -391,36 +403,40 @@ def summarize(context: Context, args: list):
     parser.add_argument('id_list', nargs='+')
     parser.add_argument('--markdown', action='store_true')
     parser.add_argument('-s', '--sort-by', choices=['runtime', 'memory', 'tool'])
+    parser.add_argument(
+        '--no-cache', action='store_true', help='do not use the cache of job metrics'
+    )
     argv = parser.parse_args(args)
 
     if len(argv.id_list) == 0:
         print("ERROR: Provide one or more history ID values.")
-        return
+        return False
     gi = connect(context)
-    all_jobs = []
-    id_list = argv.id_list
-    while len(id_list) > 0:
-        hid = find_history(gi, id_list.pop(0))
-        history = gi.histories.show_history(history_id=hid)
-        jobs = gi.jobs.get_jobs(history_id=hid)
-        for job in jobs:
-            job['invocation_id'] = ''
-            job['history_id'] = hid
-            job['history_name'] = history['name']
-            job['workflow_id'] = ''
-            all_jobs.append(job)
-    table = summarize_metrics(gi, all_jobs)
-    if argv.sort_by:
-        reverse = True
-        get_key = None
-        if argv.sort_by == 'runtime':
-            get_key = get_float_key(15)
-        elif argv.sort_by == 'memory':
-            get_key = get_float_key(11)
-        elif argv.sort_by == 'tool':
-            get_key = get_str_key(4)
-            reverse = False
-        table.sort(key=get_key, reverse=reverse)
+
+    # Without sorting, rows are printed as soon as each history is done.
+    emit = None
+    if not argv.sort_by:
+        if argv.markdown:
+            print_markdown_header()
+            emit = print_markdown_row
+        else:
+            print_table_header()
+            emit = lambda row: print(','.join(row))
+    with job_cache.bypass(argv.no_cache):
+        table = asyncio.run(summarize_histories(AsyncGalaxy(gi), argv.id_list, emit))
+    if not argv.sort_by:
+        return
+
+    reverse = True
+    get_key = None
+    if argv.sort_by == 'runtime':
+        get_key = get_float_key(15)
+    elif argv.sort_by == 'memory':
+        get_key = get_float_key(11)
+    elif argv.sort_by == 'tool':
+        get_key = get_str_key(4)
+        reverse = False
+    table.sort(key=get_key, reverse=reverse)
     if argv.markdown:
         print_markdown_table(table)
     else:
@@ -429,18 +445,87 @@ def summarize(context: Context, args: list):
             print(','.join(row))
 
 
+async def summarize_histories(agi: AsyncGalaxy, id_list: list, emit=None) -> list:
+    """
+    Collects the job metrics for every history in *id_list*.  The histories
+    are resolved, and their jobs and metrics fetched, concurrently.  A
+    history that can not be summarized is reported and has no rows.
+
+    :param emit: called with each row as soon as the metrics for its history
+      are available.
+    :return: the rows for every history, in the order of *id_list*.
+    """
+
+    async def summarize_one(name_or_id: str) -> list:
+        try:
+            return await summarize_history(name_or_id)
+        except Exception as e:
+            print(f"ERROR: Unable to summarize history {name_or_id}: {e}")
+            return []
+
+    async def summarize_history(name_or_id: str) -> list:
+        history = await find_history_async(agi, name_or_id)
+        if history is None:
+            print(f"ERROR: No such history {name_or_id}")
+            return []
+        jobs = await get_all_jobs_async(agi, history_id=history['id'])
+        for job in jobs:
+            job['invocation_id'] = ''
+            job['history_id'] = history['id']
+            job['history_name'] = history['name']
+            job['workflow_id'] = ''
+        rows = await summarize_metrics_async(agi, jobs)
+        if emit is not None:
+            for row in rows:
+                emit(row)
+        return rows
+
+    tables = await asyncio.gather(*[summarize_one(x) for x in id_list])
+    return [row for table in tables for row in table]
+
+
+async def find_history_async(agi: AsyncGalaxy, name_or_id: str):
+    """
+    Like *find_history* but returns the history itself, or None.
+    """
+    try:
+        history = await agi.histories.show_history(name_or_id)
+        if history is not None:
+            return history
+    except Exception:
+        pass
+    histories = await agi.histories.get_histories(name=name_or_id)
+    if not histories:
+        return None
+    return histories[0]
+
+
 def wait(context: Context, args: list):
-    state = ''
-    if len(args) == 0:
-        print("ERROR: No history ID provided")
-        return
+    parser = argparse.ArgumentParser()
+    parser.add_argument('id_list', nargs='+')
+    parser.add_argument(
+        '--min-interval',
+        type=float,
+        default=POLL_MIN_INTERVAL,
+        help='shortest time to wait between polls (seconds)',
+    )
+    parser.add_argument(
+        '--max-interval',
+        type=float,
+        default=POLL_MAX_INTERVAL,
+        help='longest time to wait between polls (seconds)',
+    )
+    argv = parser.parse_args(args)
 
     gi = connect(context)
-    history_id = find_history(gi, args[0])
-    if history_id is None:
-        print("ERROR: No such history")
-        return
-    wait_for(gi, history_id)
+    waiter = HistoryWaiter(gi, argv.min_interval, argv.max_interval)
+    for name_or_id in argv.id_list:
+        history_id = find_history(gi, name_or_id)
+        if history_id is None:
+            print(f"ERROR: No such history {name_or_id}")
+            return False
+        waiter.add(history_id)
+    waiter.wait()
 
 
 def kill_all_jobs(gi: GalaxyInstance, job_list: list):
@@ -456,42 +541,174 @@ def kill_all_jobs(gi: GalaxyInstance, job_list: list):
 
 
 def wait_for(gi: GalaxyInstance, history_id: str):
-    errored = []
-    waiting = True
-    job_states = JobStates()
-    restart_counts = dict()
-    while waiting:
+    """
+    Blocks until all jobs in the history are in a terminal state. Failed jobs
+    are restarted up to RESTART_MAX times.
+
+    :param gi: the connection object to the Galaxy instance
+    :param history_id: the ID of the history to wait for
+    :return: True if the history finished without giving up on a failed job.
+    """
+    waiter = HistoryWaiter(gi)
+    waiter.add(history_id)
+    return waiter.wait()[history_id]
+
+
+class WatchedHistory:
+    """
+    The polling state for a single history that is being waited on.
+    """
+
+    def __init__(self, history_id: str):
+        self.id = history_id
+        self.job_states = JobStates()
+        self.errored = []
+        self.restart_counts = dict()
+        self.update_time = None
+        self.last_poll = None
+        self.waiting = True
+        self.ok = True
+
+
+class HistoryWaiter:
+    """
+    Waits for the jobs in one or more histories to reach a terminal state.
+
+    Every tick makes a single *get_histories* call to find the watched
+    histories whose *update_time* has changed, and only those histories have
+    their job lists fetched.  Every history is still polled at least once
+    every *max_interval* seconds in case the server does not bump the
+    *update_time*.
+
+    The time between ticks starts at *min_interval* and is multiplied by
+    *backoff* after every tick where nothing changed, up to *max_interval*.
+    It drops back to *min_interval* as soon as any job changes state.
+    """
+
+    def __init__(
+        self,
+        gi: GalaxyInstance,
+        min_interval: float = POLL_MIN_INTERVAL,
+        max_interval: float = POLL_MAX_INTERVAL,
+        backoff: float = POLL_BACKOFF,
+    ):
+        self.gi = gi
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.interval = min_interval
+        self.histories = dict()
+
+    def add(self, history_id: str):
+        if history_id not in self.histories:
+            self.histories[history_id] = WatchedHistory(history_id)
+
+    def pending(self) -> list:
+        return [h for h in self.histories.values() if h.waiting]
+
+    def wait(self) -> dict:
+        """
+        Blocks until every watched history has finished.
+
+        :return: a dictionary mapping each history ID to True if all its jobs
+          finished, or False if waiting was abandoned because of failed jobs.
+        """
+        while True:
+            changed = self.tick()
+            if len(self.pending()) == 0:
+                break
+            if changed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+            time.sleep(self.interval)
+        return {id: history.ok for id, history in self.histories.items()}
+
+    def tick(self) -> bool:
+        """
+        Polls every history that has changed since the last tick, or that has
+        not been polled in *max_interval* seconds.
+
+        :return: True if any job changed state.
+        """
+        pending = self.pending()
+        updated = self._updated(pending)
+        now = time.monotonic()
+        changed = False
+        for history in pending:
+            stale = (
+                history.last_poll is None
+                or now - history.last_poll >= self.max_interval
+            )
+            if stale or history.id in updated:
+                if self._poll(history):
+                    changed = True
+                history.last_poll = now
+        return changed
+
+    def _updated(self, pending: list) -> set:
+        """
+        Returns the set of history IDs whose update_time differs from the value
+        seen on the previous tick.
+        """
+        ids = set(h.id for h in pending)
+        known = [h.update_time for h in pending if h.update_time is not None]
+        kwargs = {'keys': ['id', 'update_time']}
+        if len(known) == len(pending) and len(known) > 0:
+            # Only histories modified since the oldest one we are watching.
+            kwargs['update_time_min'] = min(known)
+        try:
+            histories = self.gi.histories.get_histories(**kwargs)
+        except Exception:
+            # Fall back to polling everything this tick.
+            return ids
+        updated = set()
+        for summary in histories:
+            history = self.histories.get(summary['id'])
+            if history is None or history.id not in ids:
+                continue
+            update_time = summary.get('update_time')
+            if update_time != history.update_time:
+                history.update_time = update_time
+                updated.add(history.id)
+        return updated
+
+    def _poll(self, history: WatchedHistory) -> bool:
+        """
+        Fetches the jobs in the history, restarts failed jobs, and determines
+        if all jobs are in a terminal state.
+
+        :return: True if any job changed state since the last poll.
+        """
+        gi = self.gi
         restart = []
-        status_counts = dict()
         terminal = 0
-        job_list = try_for(lambda: gi.jobs.get_jobs(history_id=history_id))
+        changed = False
+        job_list = try_for(lambda: gi.jobs.get_jobs(history_id=history.id), gi=gi)
         for job in job_list:
-            job_states.update(job)
+            if history.job_states.update(job):
+                changed = True
             state = job['state']
             id = job['id']
-            # Count how many jobs are in each state.
-            if state not in status_counts:
-                status_counts[state] = 1
-            else:
-                status_counts[state] += 1
             # Count jobs in a terminal state and mark failed jobs for a restart
             if state == 'ok':
                 terminal += 1
             elif state == 'error':
                 terminal += 1
-                if id not in errored:
+                if id not in history.errored:
                     tool = job['tool_id']
-                    if tool in restart_counts:
-                        restart_counts[tool] += 1
+                    if tool in history.restart_counts:
+                        history.restart_counts[tool] += 1
                     else:
-                        restart_counts[tool] = 1
-                    if restart_counts[tool] < RESTART_MAX:
+                        history.restart_counts[tool] = 1
+                    if history.restart_counts[tool] < RESTART_MAX:
                         restart.append(id)
                     else:
                         kill_all_jobs(gi, job_list)
-                        waiting = False
-                    errored.append(id)
-        if len(restart) > 0 and waiting:
+                        history.waiting = False
+                        history.ok = False
+                    history.errored.append(id)
+        if len(restart) > 0 and history.waiting:
             for job in restart:
                 print(f"Restaring job {job}")
                 try:
@@ -501,19 +718,24 @@ def wait_for(gi: GalaxyInstance, history_id: str):
                         gi.jobs.rerun_job(job, remap=False)
                     except:
                         print(f"Failed to restart job {job}")
-                        waiting = False
+                        history.waiting = False
+                        history.ok = False
         elif len(job_list) == terminal:
-            print("All jobs are in a terminal state")
-            waiting = False
-        if waiting:
-            time.sleep(30)
+            print(f"All jobs in history {history.id} are in a terminal state")
+            history.waiting = False
+        return changed
 
 
 class JobStates:
     def __init__(self):
         self._jobs = dict()
 
-    def update(self, job):
+    def update(self, job) -> bool:
+        """
+        Records the state of the job and prints a message if it changed.
+
+        :return: True if the job is new or its state has changed.
+        """
         id = job['id']
         state = job['state']
         tool = job['tool_id']
@@ -523,4 +745,7 @@ class JobStates:
             print(f"Job {id} {tool} state {state}")
         elif state != self._jobs[id]:
             print(f"Job {id} {tool} {self._jobs[id]} -> {state}")
+        else:
+            return False
         self._jobs[id] = state
+        return True
@@ -1,6 +1,7 @@
 import argparse
 
-from common import (
+from lib import job_cache
+from lib.common import (
     Context,
     connect,
     get_float_key,
@@ -50,6 +51,9 @@ def summarize(context: Context, args: list):
     parser.add_argument('id', nargs=1)
     parser.add_argument('--markdown', action='store_true')
     parser.add_argument('-s', '--sort-by', choices=['runtime', 'memory', 'tool'])
+    parser.add_argument(
+        '--no-cache', action='store_true', help='do not use the cache of job metrics'
+    )
     argv = parser.parse_args(args)
     gi = connect(context)
     id = argv.id[0]
@@ -59,7 +63,8 @@ def summarize(context: Context, args: list):
         job['invocation_id'] = id
         job['workflow_id'] = ''
         all_jobs.append(job)
-    table = summarize_metrics(gi, all_jobs)
+    with job_cache.bypass(argv.no_cache):
+        table = summarize_metrics(gi, all_jobs)
     if argv.sort_by:
         reverse = True
         get_key = None
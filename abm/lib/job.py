@@ -4,6 +4,8 @@ import json
 import logging
 import time
 
+from lib import job_cache
+
 from .common import Context, connect, find_history, print_json
 
 log = logging.getLogger('abm')
@@ -89,44 +91,50 @@ def get_value(metric: dict):
 def metrics(context: Context, args: list):
     if len(args) == 0:
         print("ERROR: no job ID provided")
-        return
+        return False
+    no_cache = '--no-cache' in args
+    if no_cache:
+        args.remove('--no-cache')
     gi = connect(context)
+    with job_cache.bypass(no_cache):
+        metrics = _get_job_metrics(gi, args)
+    if metrics is not None:
+        print(json.dumps(metrics, indent=4))
+    # metrics = {}
+    # for m in gi.jobs.get_metrics(args[0]):
+    #     metrics[m['name']] = get_value(m)
+    # try:
+    #     print(f"{metrics['galaxy_slots']},{metrics['galaxy_memory_mb']},{metrics['runtime_seconds']}")
+    # except:
+    #     print(',,')
+
+
+def _get_job_metrics(gi, args: list):
+    """
+    :return: the metrics for the job, or the jobs in the history, named by
+      *args*, or None if the arguments are invalid.
+    """
     if len(args) > 1:
         arg = args.pop(0)
-        if arg in ['-h', '--history']:
-            history_id = args.pop(0)
-            log.debug(f"Getting metrics for jobs from history {history_id}")
-            job_list = gi.jobs.get_jobs(history_id=history_id)
-            metrics = []
-            for job in job_list:
-                metrics.append(
-                    {
-                        'job_id': job['id'],
-                        'job_state': job['state'],
-                        'tool_id': job['tool_id'],
-                        'job_metrics': gi.jobs.get_metrics(job['id']),
-                    }
-                )
-        else:
+        if arg not in ['-h', '--history']:
             print(f"ERROR: Unrecognized argument {arg}")
+            return None
+        history_id = args.pop(0)
+        log.debug(f"Getting metrics for jobs from history {history_id}")
+        job_list = gi.jobs.get_jobs(history_id=history_id)
     else:
-        job = gi.jobs.show_job(args[0])
-        metrics = [
+        job_list = [job_cache.show_job(gi, args[0])]
+    metrics = []
+    for job in job_list:
+        metrics.append(
             {
                 'job_id': job['id'],
                 'job_state': job['state'],
                 'tool_id': job['tool_id'],
-                'job_metrics': gi.jobs.get_metrics(args[0]),
+                'job_metrics': job_cache.get_metrics(gi, job),
             }
-        ]
-    print(json.dumps(metrics, indent=4))
-    # metrics = {}
-    # for m in gi.jobs.get_metrics(args[0]):
-    #     metrics[m['name']] = get_value(m)
-    # try:
-    #     print(f"{metrics['galaxy_slots']},{metrics['galaxy_memory_mb']},{metrics['runtime_seconds']}")
-    # except:
-    #     print(',,')
+        )
+    return metrics
 
 
 def cancel(context: Context, args: list):
@@ -0,0 +1,261 @@
+"""
+A persistent cache of job details and job metrics.
+
+Once a job is in a terminal state (ok, error, deleted or skipped) its details
+and metrics never change, yet every summarize command, ``abm job metrics``
+and the metrics harvest after a benchmark fetch them again.  The JobCache
+keeps the results of ``show_job`` and ``get_metrics`` for terminal jobs in a
+SQLite database in ``~/.abm/cache/jobs.db``, keyed by server and job ID, so
+reports over old runs make no API calls at all.
+
+The least recently used entries are removed once the cache holds more than
+*max_entries*.  ``--no-cache`` bypasses the cache for a single command, see
+*bypass*, and ``abm <cloud> cache clear jobs`` empties it for a server.
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import lib
+from lib.cache import CACHE_DIR, server_key
+
+JOBS_FILE = 'jobs.db'
+
+# The default maximum number of cached entries.
+DEFAULT_MAX_ENTRIES = 200000
+
+# A hit only records the access time again once it is this many seconds old,
+# so reading cached jobs does not write to the database for every job.
+TOUCH_INTERVAL = 3600
+
+# Jobs in these states will not change again.
+TERMINAL_STATES = ['ok', 'error', 'deleted', 'skipped']
+
+# The kinds of results that are cached.
+JOB = 'job'
+JOB_DETAILS = 'job_details'
+METRICS = 'metrics'
+
+
+class JobCache:
+    """
+    A size bounded, thread safe map of (server, job ID, kind) to a JSON value.
+
+    :param path: the SQLite database, or None to keep the cache in memory.
+    :param max_entries: the number of entries kept before the least recently
+      used are removed.
+    """
+
+    def __init__(self, path: str = None, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(
+            path or ':memory:', check_same_thread=False, isolation_level=None
+        )
+        if path is not None:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'server TEXT, job_id TEXT, kind TEXT, value TEXT, accessed REAL, '
+            'PRIMARY KEY (server, job_id, kind))'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_accessed ON jobs (accessed)')
+
+    def get(self, server: str, job_id: str, kind: str):
+        """
+        Returns the cached value, or None.
+        """
+        key = (server, job_id, kind)
+        with self._lock:
+            try:
+                row = self._db.execute(
+                    'SELECT value, accessed FROM jobs '
+                    'WHERE server=? AND job_id=? AND kind=?',
+                    key,
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                now = time.time()
+                if now - row[1] > TOUCH_INTERVAL:
+                    self._db.execute(
+                        'UPDATE jobs SET accessed=? '
+                        'WHERE server=? AND job_id=? AND kind=?',
+                        (now, *key),
+                    )
+            except sqlite3.Error as e:
+                print(f"WARNING: unable to read the job cache: {e}")
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, server: str, job_id: str, kind: str, value):
+        with self._lock:
+            try:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?)',
+                    (server, job_id, kind, json.dumps(value), time.time()),
+                )
+                self._writes += 1
+                if self._writes % 1000 == 1:
+                    self._evict()
+            except sqlite3.Error as e:
+                print(f"WARNING: unable to update the job cache: {e}")
+
+    def _evict(self):
+        (count,) = self._db.execute('SELECT COUNT(*) FROM jobs').fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                'DELETE FROM jobs WHERE rowid IN '
+                '(SELECT rowid FROM jobs ORDER BY accessed LIMIT ?)',
+                (excess,),
+            )
+
+    def count(self, server: str = None) -> int:
+        with self._lock:
+            if server is None:
+                row = self._db.execute('SELECT COUNT(*) FROM jobs').fetchone()
+            else:
+                row = self._db.execute(
+                    'SELECT COUNT(*) FROM jobs WHERE server=?', (server,)
+                ).fetchone()
+        return row[0]
+
+    def clear(self, server: str = None) -> int:
+        """
+        Removes every entry, or every entry for *server*.
+
+        :return: the number of entries removed.
+        """
+        with self._lock:
+            if server is None:
+                cursor = self._db.execute('DELETE FROM jobs')
+            else:
+                cursor = self._db.execute('DELETE FROM jobs WHERE server=?', (server,))
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def get_job_cache() -> JobCache:
+    """
+    Returns the JobCache shared by everything in this process.  If the cache
+    file can not be opened an in-memory cache is used instead.
+    """
+    if lib.jobs is None:
+        path = os.path.join(os.path.expanduser(CACHE_DIR), JOBS_FILE)
+        try:
+            lib.jobs = JobCache(path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"WARNING: unable to open the job cache {path}: {e}")
+            lib.jobs = JobCache()
+    return lib.jobs
+
+
+@contextlib.contextmanager
+def bypass(enabled: bool = True):
+    """
+    Within the block the cache is neither read nor updated, by this thread
+    or by the asyncio tasks started in it.  Other commands, e.g. later lines
+    of ``abm batch``, are not affected.
+
+        with job_cache.bypass(argv.no_cache):
+            table = asyncio.run(summarize_histories(agi, ids))
+
+    :param enabled: bypass the cache, False leaves it in use
+    """
+    token = lib.jobs_bypassed.set(enabled)
+    try:
+        yield
+    finally:
+        lib.jobs_bypassed.reset(token)
+
+
+class _NoCache:
+    """
+    Stands in for the JobCache while it is bypassed.
+    """
+
+    def get(self, server: str, job_id: str, kind: str):
+        return None
+
+    def put(self, server: str, job_id: str, kind: str, value):
+        pass
+
+
+def _cache():
+    return _NoCache() if lib.jobs_bypassed.get() else get_job_cache()
+
+
+def is_terminal(job: dict) -> bool:
+    return job is not None and job.get('state') in TERMINAL_STATES
+
+
+def show_job(gi, job_id: str, full_details: bool = False) -> dict:
+    """
+    ``gi.jobs.show_job`` using the cache for terminal jobs.
+    """
+    server = server_key(gi)
+    kind = JOB_DETAILS if full_details else JOB
+    job = _cache().get(server, job_id, kind)
+    if job is None:
+        job = gi.jobs.show_job(job_id, full_details=full_details)
+        if is_terminal(job):
+            _cache().put(server, job_id, kind, job)
+    return job
+
+
+def get_metrics(gi, job: dict) -> list:
+    """
+    ``gi.jobs.get_metrics`` using the cache if *job* is terminal.
+    """
+    server = server_key(gi)
+    metrics = _cache().get(server, job['id'], METRICS)
+    if metrics is None:
+        metrics = gi.jobs.get_metrics(job['id'])
+        if is_terminal(job):
+            _cache().put(server, job['id'], METRICS, metrics)
+    return metrics
+
+
+async def show_job_async(agi, job_id: str, full_details: bool = False) -> dict:
+    """
+    Like *show_job* for an AsyncGalaxy client.  The cache is read and
+    updated on a worker thread so the event loop is not blocked.
+    """
+    cache = _cache()
+    kind = JOB_DETAILS if full_details else JOB
+    job = await asyncio.to_thread(cache.get, agi.server, job_id, kind)
+    if job is None:
+        job = await agi.jobs.show_job(job_id, full_details=full_details)
+        if is_terminal(job):
+            await asyncio.to_thread(cache.put, agi.server, job_id, kind, job)
+    return job
+
+
+async def get_metrics_async(agi, job: dict) -> list:
+    """
+    Like *get_metrics* for an AsyncGalaxy client.
+    """
+    cache = _cache()
+    metrics = await asyncio.to_thread(cache.get, agi.server, job['id'], METRICS)
+    if metrics is None:
+        metrics = await agi.jobs.get_metrics(job['id'])
+        if is_terminal(job):
+            await asyncio.to_thread(cache.put, agi.server, job['id'], METRICS, metrics)
+    return metrics
@@ -2,22 +2,39 @@ import json
 from pprint import pprint
 
 from common import Context, find_executable, get_env, run
+from shell import run_all
 
 
 def pods(context: Context, args: list):
-    namespace = '-n galaxy'
-    if len(args) > 0:
-        if args[0] == 'all':
-            namespace = '-A'
-        else:
-            namespace = f"-n {args[0]}"
+    """
+    Lists the pods in one or more namespaces.  The namespaces are queried at
+    the same time.
+
+    :param args: the namespaces, 'all' for every namespace, or nothing for
+      the galaxy namespace
+    """
+    if len(args) == 0:
+        args = ['galaxy']
 
     kubectl = find_executable('kubectl')
     if kubectl is None:
         print("ERROR: kubectl is not on the $PATH")
         return
 
-    print(run(f"{kubectl} get pods {namespace}"))
+    commands = []
+    for namespace in args:
+        if namespace == 'all':
+            commands.append(f"{kubectl} get pods -A")
+        else:
+            commands.append(f"{kubectl} get pods -n {namespace}")
+    results = run_all(commands, get_env(context))
+    for namespace, result in zip(args, results):
+        if len(args) > 1:
+            print(f"Namespace: {namespace}")
+        if isinstance(result, Exception):
+            print(f"ERROR: {result}")
+        else:
+            print(result)
 
 
 def url(context: Context, args: list):
@@ -0,0 +1,145 @@
+"""
+A durable record of the progress of an experiment.
+
+Every state change of a benchmark run is appended to a JSON lines file in the
+``invocations`` directory and flushed to disk before the run continues, so
+the ledger survives the ``abm`` process being killed.  When an experiment is
+restarted with ``--resume`` the ledger is replayed: benchmark runs that
+completed are skipped, and workflow invocations that were started but not
+finished are waited for again instead of being invoked a second time.
+
+Two kinds of entries are recorded:
+
+* one per *work item*, identified by (cloud, job_conf, benchmark, run), with
+  the state ``started``, ``complete`` or ``failed``.
+* one per workflow invocation within a work item, identified by the history
+  name, with the state ``invoked`` (and the invocation ID), ``complete`` or
+  ``failed``.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+from lib import INVOCATIONS_DIR
+
+STARTED = 'started'
+INVOKED = 'invoked'
+COMPLETE = 'complete'
+FAILED = 'failed'
+
+
+def ledger_path(experiment: str) -> str:
+    """
+    The path to the ledger for the experiment named *experiment*.
+    """
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '-', experiment).strip('-')
+    return os.path.join(INVOCATIONS_DIR, f"{name}.ledger.jsonl")
+
+
+class RunLedger:
+    """
+    An append-only ledger file.
+
+    :param path: the ledger file
+    :param resume: if True the existing entries are loaded, otherwise an
+      existing ledger is renamed to *path*.old and a new one is started.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path):
+            if resume:
+                self._load()
+            else:
+                os.replace(path, f"{path}.old")
+                print(f"Saved the previous ledger to {path}.old")
+        self._file = open(path, 'a')
+
+    def record(self, key: list, state: str, **fields):
+        """
+        Appends an entry and flushes it to disk.
+        """
+        entry = {'key': key, 'state': state, 'time': time.time(), **fields}
+        line = json.dumps(entry)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.entries[json.dumps(key)] = entry
+
+    def get(self, key: list) -> dict:
+        """
+        Returns the latest entry for *key*, or None.
+        """
+        with self._lock:
+            return self.entries.get(json.dumps(key))
+
+    def state(self, key: list) -> str:
+        entry = self.get(key)
+        return None if entry is None else entry['state']
+
+    def item(self, cloud: str, job_conf: str, benchmark: str, run) -> 'ItemLedger':
+        """
+        Returns a view of the ledger for a single work item.
+        """
+        return ItemLedger(self, [cloud, job_conf, benchmark, run])
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be incomplete if abm was killed.
+                    continue
+                self.entries[json.dumps(entry['key'])] = entry
+
+
+class ItemLedger:
+    """
+    The ledger entries for one work item and the workflow invocations it
+    starts.
+    """
+
+    def __init__(self, ledger: RunLedger, key: list):
+        self.ledger = ledger
+        self.key = key
+
+    def state(self) -> str:
+        return self.ledger.state(self.key)
+
+    def started(self):
+        self.ledger.record(self.key, STARTED)
+
+    def finished(self, ok: bool):
+        self.ledger.record(self.key, COMPLETE if ok else FAILED)
+
+    def invocation(self, history_name: str) -> dict:
+        """
+        The latest entry for the invocation that runs in *history_name*.
+        """
+        return self.ledger.get(self.key + [history_name])
+
+    def invoked(self, history_name: str, invocation_id: str):
+        self.ledger.record(
+            self.key + [history_name], INVOKED, invocation_id=invocation_id
+        )
+
+    def invocation_finished(self, history_name: str, invocation_id: str, ok: bool):
+        self.ledger.record(
+            self.key + [history_name],
+            COMPLETE if ok else FAILED,
+            invocation_id=invocation_id,
+        )
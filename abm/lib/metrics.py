@@ -0,0 +1,301 @@
+"""
+Collects the runtime metrics for the jobs in a benchmark history.
+
+Each job needs two API calls (the full job details and the job metrics) so the
+requests are fanned out concurrently through an AsyncGalaxy client, which also
+limits the number of requests in flight to each server.  Every request is
+retried on its own.
+
+Records are handed to a *sink*.  The default JsonSink writes one JSON file per
+job to ``metrics/<experiment>/``, atomically so a partially written metrics
+file is never left behind.  The SqliteSink appends the records to a single
+SQLite database instead, which ``experiment summarize --db`` can read without
+touching hundreds of thousands of small files.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+from lib import job_cache
+from lib.async_galaxy import AsyncGalaxy, bounded_gather
+from lib.common import Context
+
+# The default number of jobs whose metrics are fetched concurrently.
+DEFAULT_THREADS = 8
+
+
+def harvest(
+    context: Context,
+    gi,
+    invocations: dict,
+    jobs: list,
+    threads: int = DEFAULT_THREADS,
+    sink=None,
+) -> int:
+    """
+    Fetches the details and metrics for every job and saves one record per
+    job for the *output_dir* recorded in *invocations*.
+
+    :param context: the context object used to connect to the Galaxy server.
+    :param gi: the connection object to the Galaxy instance
+    :param invocations: the invocation data saved by ``benchmark.run``
+    :param jobs: the jobs, as returned by ``gi.jobs.get_jobs``
+    :param threads: the maximum number of jobs fetched concurrently
+    :param sink: where the records are saved. Defaults to a JsonSink.
+    :return: the number of jobs whose metrics could not be collected
+    """
+    return asyncio.run(
+        harvest_async(context, AsyncGalaxy(gi), invocations, jobs, threads, sink)
+    )
+
+
+async def harvest_async(
+    context: Context,
+    agi: AsyncGalaxy,
+    invocations: dict,
+    jobs: list,
+    threads: int = DEFAULT_THREADS,
+    sink=None,
+) -> int:
+    """
+    The coroutine behind *harvest*, for callers that already run an event loop.
+    """
+    if sink is None:
+        sink = JsonSink()
+    output_dir = invocations['output_dir']
+
+    async def save(job: dict) -> bool:
+        try:
+            data = await fetch_job(agi, job['id'])
+        except Exception as e:
+            print(f"ERROR: unable to fetch metrics for job {job['id']}: {e}")
+            return False
+        record = make_record(context, invocations, job, data)
+        location = sink.write(output_dir, job['id'], record)
+        print(f"Wrote metrics to {location}")
+        return True
+
+    saved = await bounded_gather(threads, [save(job) for job in jobs])
+    return saved.count(False)
+
+
+async def fetch_job(agi: AsyncGalaxy, job_id: str) -> dict:
+    """
+    Fetches the full job details with the job metrics attached.  The details
+    and metrics of finished jobs are read from the job cache when possible.
+
+    :param agi: the AsyncGalaxy client for the Galaxy instance
+    :param job_id: the Galaxy job ID
+    :return: the dictionary returned by ``show_job`` with a *job_metrics* entry
+    """
+    data = await job_cache.show_job_async(agi, job_id, full_details=True)
+    data['job_metrics'] = await job_cache.get_metrics_async(agi, data)
+    return data
+
+
+def make_record(context: Context, invocations: dict, job: dict, data: dict) -> dict:
+    """
+    Builds the metrics record that is saved for each job.
+    """
+    return {
+        'run': invocations['run'],
+        'cloud': invocations['cloud'],
+        'job_conf': invocations['job_conf'],
+        'workflow_id': invocations['workflow_id'],
+        'history_id': invocations['history_id'],
+        'inputs': invocations['inputs'],
+        'metrics': data,
+        'status': job['state'],
+        'server': context.GALAXY_SERVER,
+        'ref_data_size': invocations['ref_data_size'],
+        'input_data_size': invocations['input_data_size'],
+    }
+
+
+# The umask can only be read by changing it, which is not safe once threads
+# are writing files, so it is read once when the module is loaded.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def write_json(path: str, data) -> None:
+    """
+    Writes *data* to *path* as JSON.  The data is written to a temporary file
+    in the same directory which is then renamed, so readers only ever see a
+    complete file.  The file gets the permissions of the umask, as if it was
+    created with open().
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=4)
+        # mkstemp creates the file readable by its owner only.
+        os.chmod(temp_path, 0o666 & ~_UMASK)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class JsonSink:
+    """
+    Saves each job record as ``<output_dir>/<job_id>.json``.
+    """
+
+    def write(self, output_dir: str, job_id: str, record: dict) -> str:
+        output_path = os.path.join(output_dir, f"{job_id}.json")
+        write_json(output_path, record)
+        return output_path
+
+    def close(self):
+        pass
+
+
+class SqliteSink:
+    """
+    Saves job records to a SQLite database.
+
+    Records are grouped by *experiment*, the name of the directory the JSON
+    file would have been written to (``metrics/<experiment>``), so a database
+    can hold any number of experiments and directories migrated with
+    ``experiment ingest`` line up with records written during a run.  The
+    connection is shared between threads and guarded by a lock.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS job_metrics (
+            experiment TEXT NOT NULL,
+            job_id TEXT NOT NULL,
+            run TEXT,
+            cloud TEXT,
+            job_conf TEXT,
+            workflow_id TEXT,
+            history_id TEXT,
+            tool_id TEXT,
+            state TEXT,
+            server TEXT,
+            record TEXT NOT NULL,
+            PRIMARY KEY (experiment, job_id)
+        )
+    """
+
+    INSERT = """
+        INSERT OR REPLACE INTO job_metrics
+        (experiment, job_id, run, cloud, job_conf, workflow_id, history_id,
+         tool_id, state, server, record)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    # The number of records read or written at a time.
+    BATCH_SIZE = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(self.SCHEMA)
+
+    def write(self, output_dir: str, job_id: str, record: dict) -> str:
+        experiment = experiment_name(output_dir)
+        with self._lock, self._connection:
+            self._connection.execute(self.INSERT, self._row(experiment, job_id, record))
+        return f"{self.path}:{experiment}/{job_id}"
+
+    def write_many(self, experiment: str, records) -> int:
+        """
+        Saves (job_id, record) pairs, which may be a generator, one
+        transaction per BATCH_SIZE records.
+
+        :return: the number of records saved.
+        """
+        count = 0
+        rows = []
+        for job_id, record in records:
+            rows.append(self._row(experiment, job_id, record))
+            if len(rows) == self.BATCH_SIZE:
+                count += self._insert(rows)
+                rows = []
+        return count + self._insert(rows)
+
+    def _insert(self, rows: list) -> int:
+        if len(rows) > 0:
+            with self._lock, self._connection:
+                self._connection.executemany(self.INSERT, rows)
+        return len(rows)
+
+    def records(self, experiments: list = None):
+        """
+        Yields (experiment, job_id, record) tuples for all saved jobs, or only
+        the jobs in the given experiments.
+        """
+        query = 'SELECT experiment, job_id, record FROM job_metrics'
+        params = []
+        if experiments:
+            query += f" WHERE experiment IN ({','.join('?' * len(experiments))})"
+            params = list(experiments)
+        with self._lock:
+            cursor = self._connection.execute(query, params)
+        try:
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(self.BATCH_SIZE)
+                if len(rows) == 0:
+                    break
+                for experiment, job_id, record in rows:
+                    yield experiment, job_id, json.loads(record)
+        finally:
+            with self._lock:
+                try:
+                    cursor.close()
+                except sqlite3.ProgrammingError:
+                    # The sink was closed before the records were read.
+                    pass
+
+    def experiments(self) -> list:
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT experiment, COUNT(*) FROM job_metrics GROUP BY experiment'
+            ).fetchall()
+        return rows
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _row(self, experiment: str, job_id: str, record: dict) -> tuple:
+        metrics = record.get('metrics', {})
+        return (
+            experiment,
+            job_id,
+            str(record.get('run')),
+            record.get('cloud'),
+            record.get('job_conf'),
+            record.get('workflow_id'),
+            record.get('history_id'),
+            metrics.get('tool_id'),
+            metrics.get('state'),
+            record.get('server'),
+            json.dumps(record),
+        )
+
+
+def open_sink(database: str = None):
+    """
+    Returns a SqliteSink for *database*, or a JsonSink if no database is given.
+    """
+    if database is None:
+        return JsonSink()
+    return SqliteSink(database)
+
+
+def experiment_name(output_dir: str) -> str:
+    """
+    The name records from *output_dir* are stored under in a SqliteSink.
+    """
+    return os.path.basename(os.path.normpath(output_dir))
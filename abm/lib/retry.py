@@ -0,0 +1,219 @@
+"""
+Retries Galaxy API calls that fail for transient reasons.
+
+Only errors that are likely to go away are retried: timeouts, dropped or
+refused connections, and the HTTP status codes a busy server or proxy returns
+(408, 429, 500, 502, 503 and 504).  Anything else, e.g. a 404 or a bad
+request, is raised immediately.
+
+Requests sent through a *connection.PooledGalaxyInstance* are retried by the
+connection itself, which knows which requests are safe to send again.  Calls
+made through any other client are retried by *call* or *call_async*, never
+both.
+
+Retries are spaced with exponential backoff and full jitter so that many
+clients that failed at the same moment do not retry at the same moment.  Each
+server also has a RetryBudget: every retry spends a token and every successful
+call earns back a fraction of one.  When a server is failing most calls the
+budget runs out and calls fail fast instead of multiplying the load on the
+server.
+"""
+
+import asyncio
+import logging
+import random
+import socket
+import threading
+import time
+
+import requests
+from bioblend import ConnectionError as GalaxyConnectionError
+
+log = logging.getLogger('abm')
+
+# HTTP status codes that indicate a transient problem.
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class RetryPolicy:
+    """
+    How many times a call is attempted and how long to wait between attempts.
+
+    The wait before retry *n* is a random time between zero and
+    ``min(max_delay, base_delay * multiplier ** (n - 1))`` seconds.
+    """
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        multiplier: float = 2.0,
+    ):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+
+    def delay(self, attempt: int) -> float:
+        """
+        The number of seconds to wait after the *attempt*-th failure.
+        """
+        ceiling = min(
+            self.max_delay, self.base_delay * self.multiplier ** (attempt - 1)
+        )
+        return random.uniform(0, ceiling)
+
+
+class RetryBudget:
+    """
+    Limits the number of retries sent to a server that is failing.
+
+    Retries are allowed while more than half of *max_tokens* remain.  Each
+    retry spends one token and each successful call returns *refill* tokens.
+    """
+
+    def __init__(self, max_tokens: float = 10, refill: float = 0.1):
+        self.max_tokens = max_tokens
+        self.refill = refill
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def try_spend(self) -> bool:
+        """
+        Spends a token if a retry is allowed.
+
+        :return: True if the call may be retried.
+        """
+        with self._lock:
+            if self.tokens <= self.max_tokens / 2:
+                return False
+            self.tokens -= 1
+            return True
+
+    def success(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.refill)
+
+
+# Up to six attempts spread over about a minute, long enough to ride out a
+# server that is briefly overloaded or restarting.
+DEFAULT_POLICY = RetryPolicy(attempts=6, base_delay=2.0, max_delay=60.0)
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def get_budget(server: str = None) -> RetryBudget:
+    """
+    Returns the RetryBudget for *server*. Calls that are not tied to a server
+    share a single budget.
+    """
+    with _budgets_lock:
+        if server not in _budgets:
+            _budgets[server] = RetryBudget()
+        return _budgets[server]
+
+
+def retries_requests(gi) -> bool:
+    """
+    Returns True if the connection *gi* retries its own requests, e.g. a
+    *connection.PooledGalaxyInstance*.  Calls made through such a connection
+    must not be retried again or the attempts multiply.
+    """
+    return getattr(gi, 'RETRIES_REQUESTS', False) is True
+
+
+def is_retryable(e: BaseException) -> bool:
+    """
+    Returns True if the error *e* is likely to be transient.
+    """
+    if isinstance(e, GalaxyConnectionError):
+        # bioblend reports dropped connections without a status code.
+        return e.status_code is None or e.status_code in RETRYABLE_STATUS
+    if isinstance(e, requests.exceptions.HTTPError):
+        response = e.response
+        return response is not None and response.status_code in RETRYABLE_STATUS
+    return isinstance(
+        e,
+        (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            ConnectionError,
+            TimeoutError,
+            socket.timeout,
+        ),
+    )
+
+
+def call(
+    f,
+    attempts: int = None,
+    server: str = None,
+    policy: RetryPolicy = None,
+    retryable=is_retryable,
+):
+    """
+    Calls *f()*, retrying transient errors.
+
+    :param f: the function to call
+    :param attempts: the maximum number of attempts, *policy.attempts* by default
+    :param server: the server whose RetryBudget is used
+    :param policy: the RetryPolicy that sets the delay between attempts,
+      DEFAULT_POLICY by default
+    :param retryable: the function that decides if an error is transient
+    :return: the result of calling f()
+    """
+    policy = policy or DEFAULT_POLICY
+    attempts = attempts or policy.attempts
+    budget = get_budget(server)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            result = f()
+        except Exception as e:
+            if not _should_retry(e, attempt, attempts, budget, retryable):
+                raise
+            time.sleep(policy.delay(attempt))
+            continue
+        budget.success()
+        return result
+
+
+async def call_async(
+    f,
+    attempts: int = None,
+    server: str = None,
+    policy: RetryPolicy = None,
+    retryable=is_retryable,
+):
+    """
+    Like *call* but *f* returns an awaitable and the delays do not block the
+    event loop.
+    """
+    policy = policy or DEFAULT_POLICY
+    attempts = attempts or policy.attempts
+    budget = get_budget(server)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            result = await f()
+        except Exception as e:
+            if not _should_retry(e, attempt, attempts, budget, retryable):
+                raise
+            await asyncio.sleep(policy.delay(attempt))
+            continue
+        budget.success()
+        return result
+
+
+def _should_retry(e, attempt: int, attempts: int, budget: RetryBudget, retryable):
+    if attempt >= attempts or not retryable(e):
+        return False
+    if not budget.try_spend():
+        print(f"WARNING: retry budget exhausted, not retrying: {e}")
+        return False
+    log.warning(f"attempt {attempt} of {attempts} failed, retrying: {e}")
+    return True
@@ -0,0 +1,295 @@
+"""
+Schedules the benchmark runs of an experiment across clouds.
+
+An experiment is expanded into WorkItems, one for every combination of
+cloud, job configuration, benchmark configuration and run number.  Each cloud
+has its own queue and a pool of worker threads, so a fast cloud is never held
+back by a slow one and the number of benchmarks running on a cluster at the
+same time is bounded.
+
+A job configuration is applied to the whole cluster with ``helm upgrade``, so
+items for different job configurations can not run on the same cloud at the
+same time.  Workers take items for the job configuration that is currently
+applied first.  The configuration is only changed once every running item on
+the cloud has finished, and the next configuration is the one with the
+highest priority item still queued.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+from datetime import timedelta
+from time import perf_counter
+
+log = logging.getLogger('abm')
+
+
+class WorkItem:
+    """
+    A single benchmark run.
+
+    :param cloud: the profile name of the cloud the benchmark runs on
+    :param job_conf: the job configuration, or None if the cluster is not
+      reconfigured
+    :param benchmark: the path to the benchmark configuration
+    :param run_number: the run number used in the history names
+    :param priority: items with a lower priority value run first
+    """
+
+    def __init__(
+        self,
+        cloud: str,
+        job_conf: str,
+        benchmark: str,
+        run_number: int,
+        priority: int = 0,
+    ):
+        self.cloud = cloud
+        self.job_conf = job_conf
+        self.benchmark = benchmark
+        self.run_number = run_number
+        self.priority = priority
+
+    def history_prefix(self) -> str:
+        if self.job_conf is None:
+            return f"{self.run_number} {self.cloud}"
+        return f"{self.run_number} {self.cloud} {self.job_conf}"
+
+    def __repr__(self):
+        return f"{self.history_prefix()} {self.benchmark}"
+
+
+def make_work_items(config: dict, clouds: list, start: int, end: int) -> list:
+    """
+    Expands an experiment configuration into WorkItems.
+
+    Entries in *benchmark_confs* and *job_configs* may either be a name or a
+    dictionary with a *name* (or *path*) and a *priority*.  The priority of an
+    item is the sum of the priorities of its benchmark and job configuration.
+
+    :param config: the experiment configuration
+    :param clouds: the clouds the experiment runs on
+    :param start: the first run number
+    :param end: one past the last run number
+    """
+    job_confs = [_named(c, 'name') for c in config.get('job_configs') or []]
+    if len(job_confs) == 0:
+        job_confs = [(None, 0)]
+    benchmarks = [_named(b, 'path') for b in config['benchmark_confs']]
+    items = []
+    for cloud in clouds:
+        for conf, conf_priority in job_confs:
+            for path, benchmark_priority in benchmarks:
+                for n in range(start, end):
+                    items.append(
+                        WorkItem(
+                            cloud, conf, path, n, conf_priority + benchmark_priority
+                        )
+                    )
+    return items
+
+
+def _named(entry, key: str) -> tuple:
+    if isinstance(entry, dict):
+        return entry.get(key, entry.get('name')), int(entry.get('priority', 0))
+    return entry, 0
+
+
+class CloudQueue:
+    """
+    The queued WorkItems for one cloud and the job configuration applied to it.
+    """
+
+    def __init__(self, cloud: str, concurrency: int = 1):
+        self.cloud = cloud
+        self.concurrency = max(1, concurrency)
+        self.heap = []
+        self.active_conf = None
+        self.configured = False
+        self.switching = False
+        self.running = 0
+        self.durations = []
+        self._counter = itertools.count()
+
+    def push(self, item: WorkItem):
+        heapq.heappush(self.heap, (item.priority, next(self._counter), item))
+
+    def __len__(self):
+        return len(self.heap)
+
+    def take(self, conf):
+        """
+        Removes and returns the highest priority item for *conf*, or None.
+        """
+        best = None
+        for entry in self.heap:
+            if entry[2].job_conf == conf and (best is None or entry < best):
+                best = entry
+        if best is None:
+            return None
+        self.heap.remove(best)
+        heapq.heapify(self.heap)
+        return best[2]
+
+    def drop(self, conf) -> int:
+        """
+        Removes every item for *conf*.
+
+        :return: the number of items removed
+        """
+        before = len(self.heap)
+        self.heap = [entry for entry in self.heap if entry[2].job_conf != conf]
+        heapq.heapify(self.heap)
+        return before - len(self.heap)
+
+    def next_conf(self):
+        return self.heap[0][2].job_conf
+
+
+class Scheduler:
+    """
+    Runs WorkItems on per-cloud worker pools.
+
+    :param items: the WorkItems to run
+    :param run_item: called as ``run_item(item)`` to run a benchmark. Returns
+      False if the benchmark failed.
+    :param apply_conf: called as ``apply_conf(cloud, job_conf)`` before items
+      for a new job configuration are started. Returns False if the
+      configuration could not be applied, in which case its items are skipped.
+    :param concurrency: the maximum number of items running on each cloud,
+      either a single number or a dictionary of cloud names to numbers.
+    """
+
+    def __init__(self, items: list, run_item, apply_conf, concurrency=1):
+        self.run_item = run_item
+        self.apply_conf = apply_conf
+        self.queues = {}
+        for item in items:
+            if item.cloud not in self.queues:
+                self.queues[item.cloud] = CloudQueue(
+                    item.cloud, _limit(concurrency, item.cloud)
+                )
+            self.queues[item.cloud].push(item)
+        self.total = len(items)
+        self.completed = 0
+        self.failed = []
+        self.skipped = 0
+        self.start = None
+        self._condition = threading.Condition()
+
+    def run(self) -> bool:
+        """
+        Runs every item and blocks until they have all finished.
+
+        :return: True if every item ran successfully.
+        """
+        self.start = perf_counter()
+        workers = []
+        for queue in self.queues.values():
+            for i in range(queue.concurrency):
+                t = threading.Thread(
+                    target=self._work, args=(queue,), name=f"{queue.cloud}-{i}"
+                )
+                workers.append(t)
+                t.start()
+        for t in workers:
+            t.join()
+        return len(self.failed) == 0 and self.skipped == 0
+
+    def _work(self, queue: CloudQueue):
+        while True:
+            item = self._next(queue)
+            if item is None:
+                return
+            started = perf_counter()
+            ok = False
+            try:
+                ok = self.run_item(item) is not False
+            except Exception as e:
+                print(f"ERROR: {item} failed: {e}")
+            with self._condition:
+                queue.running -= 1
+                queue.durations.append(perf_counter() - started)
+                self.completed += 1
+                if not ok:
+                    self.failed.append(item)
+                self._condition.notify_all()
+                print(self.progress())
+
+    def _next(self, queue: CloudQueue):
+        """
+        Waits until an item can be started on the queue's cloud and returns
+        it, or None once the queue is empty.
+        """
+        with self._condition:
+            while True:
+                if len(queue) == 0:
+                    return None
+                if queue.configured:
+                    item = queue.take(queue.active_conf)
+                    if item is not None:
+                        queue.running += 1
+                        return item
+                if queue.running == 0 and not queue.switching:
+                    self._switch(queue)
+                    continue
+                self._condition.wait()
+
+    def _switch(self, queue: CloudQueue):
+        """
+        Applies the job configuration of the highest priority queued item.
+        Called with the condition held and nothing running on the cloud. The
+        condition is released while the configuration is applied so other
+        clouds are not held up.
+        """
+        conf = queue.next_conf()
+        queue.configured = False
+        queue.switching = True
+        self._condition.release()
+        try:
+            ok = conf is None or self.apply_conf(queue.cloud, conf) is not False
+        except Exception as e:
+            print(f"ERROR: unable to apply {conf} on {queue.cloud}: {e}")
+            ok = False
+        finally:
+            self._condition.acquire()
+            queue.switching = False
+            self._condition.notify_all()
+        if not ok:
+            count = queue.drop(conf)
+            self.skipped += count
+            self.total -= count
+            log.warning(f"job configuration not applied: {conf}")
+            print(f"WARNING: skipping {count} runs on {queue.cloud} for {conf}")
+            return
+        queue.active_conf = conf
+        queue.configured = True
+
+    def eta(self) -> float:
+        """
+        The estimated number of seconds until every item has finished, based
+        on the mean run time on each cloud so far.
+        """
+        eta = 0.0
+        for queue in self.queues.values():
+            if len(queue.durations) == 0:
+                continue
+            mean = sum(queue.durations) / len(queue.durations)
+            remaining = len(queue) + queue.running
+            eta = max(eta, mean * remaining / queue.concurrency)
+        return eta
+
+    def progress(self) -> str:
+        elapsed = timedelta(seconds=int(perf_counter() - self.start))
+        eta = timedelta(seconds=int(self.eta()))
+        return (
+            f"Progress: {self.completed} of {self.total} runs complete, "
+            f"{len(self.failed)} failed, elapsed {elapsed}, ETA {eta}"
+        )
+
+
+def _limit(concurrency, cloud: str) -> int:
+    if isinstance(concurrency, dict):
+        return int(concurrency.get(cloud, concurrency.get('default', 1)))
+    return int(concurrency)
@@ -0,0 +1,171 @@
+"""
+Runs the helm and kubectl executables.
+
+Executable paths are looked up once per process, and the environment for
+a Context is prepared once and reused.  The time taken by every command is
+recorded per executable and sub-command, e.g. ``kubectl get``, so slow
+cluster operations show up in the summary printed at the end of an
+experiment.  Independent queries can be run at the same time with
+*run_all*.
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import lib
+
+# The maximum number of commands run at the same time by run_all.
+MAX_WORKERS = 4
+
+
+class CommandStats:
+    """
+    The number of times a command was run and how long it took.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, latency: float, error: bool):
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+        if error:
+            self.errors += 1
+
+
+class CommandRunner:
+    """
+    Remembers executable paths and prepared environments, and records the
+    time taken by each command.
+    """
+
+    def __init__(self):
+        self.executables = {}
+        self.environments = {}
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def find_executable(self, name: str):
+        with self._lock:
+            if name not in self.executables:
+                self.executables[name] = shutil.which(name)
+            return self.executables[name]
+
+    def get_env(self, context) -> dict:
+        names = getattr(context, 'EXPORTED', context.__dict__)
+        values = tuple(
+            (name, str(getattr(context, name)))
+            for name in names
+            if getattr(context, name, None) is not None
+        )
+        with self._lock:
+            env = self.environments.get(values)
+            if env is None:
+                env = os.environ.copy()
+                env.update(values)
+                self.environments[values] = env
+            return env
+
+    def run(self, command: str, env: dict = None) -> str:
+        if env is None:
+            env = os.environ
+        argv = command.split()
+        start = perf_counter()
+        result = subprocess.run(argv, capture_output=True, env=env)
+        self.record(argv, perf_counter() - start, result.returncode != 0)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.decode('utf-8').strip())
+        return result.stdout.decode('utf-8').strip()
+
+    def record(self, argv: list, latency: float, error: bool):
+        name = os.path.basename(argv[0])
+        if len(argv) > 1 and not argv[1].startswith('-'):
+            name = f"{name} {argv[1]}"
+        with self._lock:
+            if name not in self.stats:
+                self.stats[name] = CommandStats()
+            self.stats[name].record(latency, error)
+
+    def summary(self) -> str:
+        """
+        One line per command with the number of runs and the mean and maximum
+        time taken.
+        """
+        with self._lock:
+            stats = sorted(self.stats.items())
+        lines = []
+        for name, s in stats:
+            lines.append(
+                f"{name}: {s.count} runs, {s.errors} errors, "
+                f"mean {s.total / s.count:.2f}s, max {s.max:.2f}s"
+            )
+        return '\n'.join(lines)
+
+
+def get_runner() -> CommandRunner:
+    """
+    Returns the CommandRunner shared by everything in this process.
+    """
+    if lib.commands is None:
+        lib.commands = CommandRunner()
+    return lib.commands
+
+
+def find_executable(name: str):
+    """
+    Returns the full path to the executable *name*, or None if it is not on
+    the $PATH.  The result is remembered for the life of the process.
+    """
+    return get_runner().find_executable(name)
+
+
+def get_env(context) -> dict:
+    """
+    Returns a copy of os.environ with the settings of *context*, those named
+    in its EXPORTED list, added.  The dictionary is shared by every command
+    run for the same settings, so it must not be modified.
+    """
+    return get_runner().get_env(context)
+
+
+def run(command: str, env: dict = None) -> str:
+    """
+    Runs *command* and returns its output.
+
+    :raises RuntimeError: if the command exits with a non-zero status.
+    """
+    return get_runner().run(command, env)
+
+
+def run_all(commands: list, env: dict = None) -> list:
+    """
+    Runs independent *commands* at the same time.
+
+    :return: the output of each command, or the RuntimeError it raised, in
+      the same order as *commands*.
+    """
+    if len(commands) == 0:
+        return []
+    runner = get_runner()
+    workers = min(MAX_WORKERS, len(commands))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(runner.run, command, env) for command in commands]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except RuntimeError as e:
+            results.append(e)
+    return results
+
+
+def summary() -> str:
+    return get_runner().summary()
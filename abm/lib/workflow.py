@@ -1,4 +1,5 @@
 import argparse
+import asyncio
 import json
 import logging
 import os
@@ -7,15 +8,21 @@ from pprint import pprint
 
 import requests
 import yaml
-from common import (
+from lib import job_cache
+from lib.async_galaxy import AsyncGalaxy
+from lib.common import (
     Context,
     connect,
     find_config,
+    get_all_invocations_async,
+    get_all_jobs_async,
     get_float_key,
     get_str_key,
+    print_markdown_header,
+    print_markdown_row,
     print_markdown_table,
     print_table_header,
-    summarize_metrics,
+    summarize_metrics_async,
 )
 from planemo.galaxy.workflows import install_shed_repos
 from planemo.runnable import for_path, for_uri
@@ -53,14 +60,13 @@ def upload(context: Context, args: list):
             path = arg
     if path is None:
         print("ERROR: no workflow given")
-        return
+        return False
 
     if path.startswith('http'):
-        import_from_url(context, args)
-        return
+        return import_from_url(context, args)
     if not os.path.exists(path):
         print(f'ERROR: file not found: {path}')
-        return
+        return False
     print("Uploading workflow")
     gi = connect(context)
     print("Importing the workflow")
@@ -73,6 +79,12 @@ def upload(context: Context, args: list):
 
 
 def import_from_url(context: Context, args: list):
+    """
+    Imports the workflow at a URL and, unless --no-tools is given, installs
+    its tools.
+
+    :return: False if the workflow could not be downloaded or parsed
+    """
     print("Importing workflow from URL")
     url = None
     install = True
@@ -84,8 +96,32 @@ def import_from_url(context: Context, args: list):
             url = arg
     if url is None:
         print("ERROR: no URL given")
-        return
+        return False
+
+    loaded = _load_workflow(url)
+    if loaded is None:
+        return False
+    workflow, cached_file = loaded
 
+    gi = connect(context)
+    result = gi.workflows.import_workflow_dict(workflow, publish=True)
+    print(json.dumps(result, indent=4))
+    runnable = for_path(cached_file)
+    if install:
+        print("Installing tools")
+        result = install_shed_repos(runnable, gi, False, install_tool_dependencies=True)
+        pprint(result)
+    return True
+
+
+def _load_workflow(url: str):
+    """
+    Downloads a workflow, or reads it from the local cache if it has been
+    downloaded before.
+
+    :return: a tuple (workflow, path) with the parsed workflow and the path to
+      the cached file, or None if the workflow could not be loaded.
+    """
     # There is a bug in ephemeris (for lack of a better term) that assumes all
     # Runnable objects can be found on the local file system
     input_text = None
@@ -104,7 +140,7 @@ def import_from_url(context: Context, args: list):
                 f"ERROR: There was a problem downloading the workflow: {response.status_code}"
             )
             print(response.reason)
-            return
+            return None
         input_text = response.text
         with open(cached_file, 'w') as f:
             f.write(input_text)
@@ -113,16 +149,8 @@ def import_from_url(context: Context, args: list):
     except Exception as e:
         print("ERROR: Unable to parse workflow")
         print(e)
-        return
-
-    gi = connect(context)
-    result = gi.workflows.import_workflow_dict(workflow, publish=True)
-    print(json.dumps(result, indent=4))
-    runnable = for_path(cached_file)
-    if install:
-        print("Installing tools")
-        result = install_shed_repos(runnable, gi, False, install_tool_dependencies=True)
-        pprint(result)
+        return None
+    return workflow, cached_file
 
 
 def import_from_config(context: Context, args: list):
@@ -139,11 +167,10 @@ def import_from_config(context: Context, args: list):
             key = arg
     if key is None:
         print("ERROR: no workflow ID given")
-        return
+        return False
 
     if key.startswith('http'):
-        import_from_url(context, args)
-        return
+        return import_from_url(context, args)
 
     if config is None:
         config = find_config("workflows.yml")
@@ -155,13 +182,13 @@ def import_from_config(context: Context, args: list):
         workflows = yaml.safe_load(f)
     if not key in workflows:
         print(f"ERROR: no such workflow: {key}")
-        return
+        return False
 
     url = workflows[key]
     argv = [url]
     if not install:
         argv.append('-n')
-    import_from_url(context, argv)
+    return import_from_url(context, argv)
 
 
 def download(context: Context, args: list):
@@ -271,33 +298,87 @@ def summarize(context: Context, args: list):
     parser.add_argument('id', nargs=1)
     parser.add_argument('--markdown', action='store_true')
     parser.add_argument('-s', '--sort-by', choices=['runtime', 'memory', 'tool'])
+    parser.add_argument('--state', help='only include jobs in this state, e.g. ok')
+    parser.add_argument(
+        '--since', help='only include jobs updated on or after this date (YYYY-MM-DD)'
+    )
+    parser.add_argument(
+        '--until', help='only include jobs updated on or before this date (YYYY-MM-DD)'
+    )
+    parser.add_argument(
+        '--no-cache', action='store_true', help='do not use the cache of job metrics'
+    )
     argv = parser.parse_args(args)
     gi = connect(context)
-    wid = argv.id
-    all_jobs = []
-    invocations = gi.invocations.get_invocations(workflow_id=wid)
-    for invocation in invocations:
-        id = invocation['id']
-        jobs = gi.jobs.get_jobs(invocation_id=id, workflow_id=wid)
-        for job in jobs:
-            job['invocation_id'] = id
-            job['workflow_id'] = wid
-            all_jobs.append(job)
-    table = summarize_metrics(gi, all_jobs)
-    if argv.sort_by:
-        reverse = True
-        get_key = None
-        if argv.sort_by == 'runtime':
-            get_key = get_float_key(15)
-        elif argv.sort_by == 'memory':
-            get_key = get_float_key(11)
-        elif argv.sort_by == 'tool':
-            get_key = get_str_key(4)
-            reverse = False
-        table.sort(key=get_key, reverse=reverse)
+    wid = argv.id[0]
+    # These filters are applied by the server when the jobs are listed.
+    filters = {}
+    if argv.state:
+        filters['state'] = argv.state
+    if argv.since:
+        filters['date_range_min'] = argv.since
+    if argv.until:
+        filters['date_range_max'] = argv.until
+
+    # Without sorting, rows are printed as soon as each invocation is done.
+    emit = None
+    if not argv.sort_by:
+        if argv.markdown:
+            print_markdown_header()
+            emit = print_markdown_row
+        else:
+            print_table_header()
+            emit = lambda row: print(','.join(row))
+    with job_cache.bypass(argv.no_cache):
+        table = asyncio.run(summarize_workflow(AsyncGalaxy(gi), wid, filters, emit))
+    if not argv.sort_by:
+        return
+
+    reverse = True
+    get_key = None
+    if argv.sort_by == 'runtime':
+        get_key = get_float_key(15)
+    elif argv.sort_by == 'memory':
+        get_key = get_float_key(11)
+    elif argv.sort_by == 'tool':
+        get_key = get_str_key(4)
+        reverse = False
+    table.sort(key=get_key, reverse=reverse)
     if argv.markdown:
         print_markdown_table(table)
     else:
         print_table_header()
         for row in table:
             print(','.join(row))
+
+
+async def summarize_workflow(
+    agi: AsyncGalaxy, wid: str, filters: dict = None, emit=None
+) -> list:
+    """
+    Collects the job metrics for every invocation of a workflow.  The
+    invocations are listed a page at a time, and the jobs and metrics of
+    each invocation are fetched concurrently.
+
+    :param filters: extra get_jobs filters, e.g. state or date_range_min
+    :param emit: called with each row as soon as the metrics for its
+      invocation are available.
+    :return: the rows for every invocation
+    """
+    filters = filters or {}
+    invocations = await get_all_invocations_async(agi, workflow_id=wid)
+
+    async def summarize_one(invocation: dict) -> list:
+        id = invocation['id']
+        jobs = await get_all_jobs_async(agi, invocation_id=id, **filters)
+        for job in jobs:
+            job['invocation_id'] = id
+            job['workflow_id'] = wid
+        rows = await summarize_metrics_async(agi, jobs)
+        if emit is not None:
+            for row in rows:
+                emit(row)
+        return rows
+
+    tables = await asyncio.gather(*[summarize_one(i) for i in invocations])
+    return [row for table in tables for row in table]
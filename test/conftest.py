@@ -0,0 +1,22 @@
+import importlib
+
+import pytest
+
+from abm.lib import job_cache, retry
+
+
+@pytest.fixture(autouse=True)
+def memory_job_cache(monkeypatch):
+    # Keep the tests away from the job cache in ~/.abm/cache
+    monkeypatch.setattr(job_cache.lib, 'jobs', job_cache.JobCache())
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    # The same number of attempts without waiting between them.  The modules
+    # in abm/lib are also imported as lib.*, see abm/lib/__init__.py
+    for module in (retry, importlib.import_module('lib.retry')):
+        policy = retry.RetryPolicy(
+            attempts=module.DEFAULT_POLICY.attempts, base_delay=0
+        )
+        monkeypatch.setattr(module, 'DEFAULT_POLICY', policy)
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+from unittest.mock import MagicMock
+
+from abm.lib.async_galaxy import (
+    DEFAULT_LIMIT,
+    AsyncGalaxy,
+    bounded_gather,
+    get_limit,
+    set_limit,
+)
+from abm.lib.common import summarize_metrics
+
+
+def test_requests_to_a_server_are_limited():
+    gi = MagicMock()
+    gi.base_url = 'https://limited.example.org'
+    set_limit(gi.base_url, 2)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def get_metrics(id):
+        with lock:
+            running.append(id)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(id)
+        return [id]
+
+    gi.jobs.get_metrics.side_effect = get_metrics
+
+    async def fetch_all():
+        agi = AsyncGalaxy(gi)
+        return await asyncio.gather(*[agi.jobs.get_metrics(n) for n in range(8)])
+
+    assert asyncio.run(fetch_all()) == [[n] for n in range(8)]
+    assert max(peak) == 2
+
+
+def test_calls_are_retried():
+    gi = MagicMock()
+    gi.histories.show_history.side_effect = [ConnectionError('reset'), {'id': 'h1'}]
+
+    history = asyncio.run(AsyncGalaxy(gi).histories.show_history('h1'))
+
+    assert history == {'id': 'h1'}
+    assert gi.histories.show_history.call_count == 2
+
+
+def test_bounded_gather_keeps_order():
+    async def square(n):
+        await asyncio.sleep(0.001 * (5 - n))
+        return n * n
+
+    result = asyncio.run(bounded_gather(2, [square(n) for n in range(5)]))
+    assert result == [0, 1, 4, 9, 16]
+
+
+def test_summarize_metrics_rows_follow_jobs():
+    gi = MagicMock()
+    gi.jobs.get_metrics.side_effect = lambda id: [
+        {'name': 'runtime_seconds', 'raw_value': id[1:]}
+    ]
+    gi.histories.show_history.side_effect = lambda id: {'name': f'name-{id}'}
+    jobs = [
+        {'id': f'j{n}', 'history_id': f'async-h{n % 2}', 'tool_id': 'a/b/bwa/1.0'}
+        for n in range(6)
+    ]
+
+    table = summarize_metrics(gi, jobs)
+
+    assert [row[0] for row in table] == [f'j{n}' for n in range(6)]
+    assert [row[2] for row in table] == [f'name-async-h{n % 2}' for n in range(6)]
+    assert gi.histories.show_history.call_count == 2
+
+
+def test_limit_is_reported():
+    set_limit('https://reported.example.org', 3)
+    assert get_limit('https://reported.example.org') == 3
+    assert get_limit('https://unused.example.org') == DEFAULT_LIMIT
@@ -0,0 +1,268 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from bioblend import ConnectionError
+
+from abm.lib.benchmark import CollectionIndex, RunTracker, _invoke_workflow
+
+
+def test_run_tracker_serial_runs_in_caller_thread():
+    tracker = RunTracker()
+    threads = []
+
+    def work(history_id):
+        threads.append(threading.current_thread())
+        return history_id
+
+    tracker.submit('run 1', work, 'h1')
+    tracker.submit('run 2', work, 'h2')
+
+    assert tracker.wait()
+    assert tracker.finished == ['h1', 'h2']
+    assert threads == [threading.current_thread()] * 2
+
+
+def test_run_tracker_limits_runs_in_flight():
+    tracker = RunTracker(2)
+    lock = threading.Lock()
+    in_flight = [0]
+    peak = [0]
+
+    def work(history_id):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.05)
+        with lock:
+            in_flight[0] -= 1
+        return history_id
+
+    for n in range(6):
+        tracker.submit(f'run {n}', work, f'h{n}')
+
+    assert tracker.wait()
+    assert sorted(tracker.finished) == [f'h{n}' for n in range(6)]
+    assert peak[0] == 2
+
+
+def test_run_tracker_records_failures():
+    tracker = RunTracker(2)
+
+    def fail():
+        raise RuntimeError('invocation failed')
+
+    tracker.submit('bad run', fail)
+    tracker.submit('good run', lambda: 'h1')
+
+    assert not tracker.wait()
+    assert tracker.failed == ['bad run']
+    assert tracker.finished == ['h1']
+
+
+def make_collection(id, name, history_id='h1', **kwargs):
+    collection = {
+        'id': id,
+        'name': name,
+        'type': 'collection',
+        'populated_state': 'ok',
+        'deleted': False,
+        'visible': True,
+        'history_id': history_id,
+    }
+    collection.update(kwargs)
+    return collection
+
+
+def test_collection_index_uses_server_side_filter():
+    gi = MagicMock()
+    gi.datasets.get_datasets.return_value = [
+        make_collection('c1', 'reads', populated_state='failed'),
+        make_collection('c2', 'reads'),
+    ]
+    gi.histories.show_history.return_value = {'deleted': False, 'purged': False}
+    gi.histories.show_dataset_collection.return_value = {
+        'populated_state': 'ok',
+        'deleted': False,
+        'visible': True,
+    }
+    index = CollectionIndex(page_size=10)
+
+    assert index.find(gi, 'reads') == 'c2'
+    assert index.find(gi, 'reads') == 'c2'
+    gi.datasets.get_datasets.assert_called_once_with(
+        limit=10, offset=0, name='reads', visible=True, deleted=False
+    )
+    gi.histories.show_history.assert_called_once_with('h1')
+    # The cached collection is checked before it is used again.
+    gi.histories.show_dataset_collection.assert_called_once_with('h1', 'c2')
+
+
+def test_collection_index_scans_past_first_page():
+    datasets = [{'id': f'd{n}', 'name': f'd{n}', 'type': 'file'} for n in range(25)]
+    datasets.append(make_collection('c1', ' reads '))
+    datasets.append(make_collection('c2', 'other', history_id='h2'))
+
+    def get_datasets(limit, offset, name=None, **kwargs):
+        if name is not None:
+            return []
+        return datasets[offset : offset + limit]
+
+    gi = MagicMock()
+    gi.datasets.get_datasets.side_effect = get_datasets
+    gi.histories.show_history.side_effect = lambda id: {'deleted': id == 'h2'}
+    index = CollectionIndex(page_size=10)
+
+    assert index.find(gi, 'reads') == 'c1'
+    assert index.scan_offset == 27 and index.scan_complete
+    assert index.find(gi, 'other') is None
+    assert index.find(gi, 'missing') is None
+
+
+def test_invoke_workflow_is_not_sent_twice():
+    from datetime import datetime, timedelta, timezone
+
+    def iso(seconds):
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return (now + timedelta(seconds=seconds)).isoformat()
+
+    gi = MagicMock()
+    gi.workflows.invoke_workflow.side_effect = ConnectionError(
+        'timeout', status_code=504
+    )
+    gi.histories.get_histories.return_value = [{'id': 'h1', 'create_time': iso(60)}]
+    gi.invocations.get_invocations.return_value = [
+        {'id': 'older', 'create_time': iso(-60)},
+        {'id': 'new', 'create_time': iso(60)},
+    ]
+
+    invocation = _invoke_workflow(gi, 'w1', {}, 'run 1')
+
+    assert invocation['id'] == 'new'
+    assert gi.workflows.invoke_workflow.call_count == 1
+    assert gi.invocations.get_invocations.call_args.kwargs == {
+        'workflow_id': 'w1',
+        'history_id': 'h1',
+    }
+
+    # An earlier run in a history with the same name is not this run.
+    gi.histories.get_histories.return_value = [{'id': 'h0', 'create_time': iso(-3600)}]
+    gi.invocations.get_invocations.return_value = [
+        {'id': 'old', 'create_time': iso(-3600)}
+    ]
+    with pytest.raises(ConnectionError):
+        _invoke_workflow(gi, 'w1', {}, 'run 1')
+    gi.histories.get_histories.return_value = [{'id': 'h1', 'create_time': iso(60)}]
+    with pytest.raises(ConnectionError):
+        _invoke_workflow(gi, 'w1', {}, 'run 1')
+    assert gi.workflows.invoke_workflow.call_count == 3
+
+
+def test_collection_index_drops_deleted_candidates():
+    gi = MagicMock()
+    gi.datasets.get_datasets.return_value = [make_collection('c1', 'reads')]
+    gi.histories.show_history.return_value = {'deleted': False, 'purged': False}
+    gi.histories.show_dataset_collection.return_value = {'deleted': True}
+    index = CollectionIndex(page_size=10)
+
+    assert index.find(gi, 'reads') == 'c1'
+    gi.datasets.get_datasets.return_value = []
+    assert index.find(gi, 'reads') is None
+    assert index.candidates['reads'] == []
+
+
+def test_collection_index_scan_is_limited():
+    datasets = [{'id': f'd{n}', 'name': f'd{n}', 'type': 'file'} for n in range(100)]
+    gi = MagicMock()
+    gi.datasets.get_datasets.side_effect = lambda limit, offset, name=None, **kw: (
+        [] if name is not None else datasets[offset : offset + limit]
+    )
+    index = CollectionIndex(page_size=10, scan_limit=30)
+
+    assert index.find(gi, 'missing') is None
+    assert index.find(gi, 'missing') is None
+    assert index.scan_offset == 30 and index.scan_limited
+    # Two filtered lookups and three pages of the full scan.
+    assert gi.datasets.get_datasets.call_count == 5
+
+
+def test_collection_index_scans_in_parallel():
+    datasets = [{'id': f'd{n}', 'name': f'd{n}', 'type': 'file'} for n in range(40)]
+    datasets.append(make_collection('c1', ' reads '))
+    in_flight = []
+    peak = []
+    lock = threading.Lock()
+
+    def get_datasets(limit, offset, name=None, **kwargs):
+        if name is not None:
+            return []
+        with lock:
+            in_flight.append(offset)
+            peak.append(len(in_flight))
+        time.sleep(0.02)
+        with lock:
+            in_flight.remove(offset)
+        return datasets[offset : offset + limit]
+
+    gi = MagicMock()
+    gi.datasets.get_datasets.side_effect = get_datasets
+    gi.histories.show_history.return_value = {'deleted': False}
+    gi.histories.show_dataset_collection.return_value = {}
+    index = CollectionIndex(page_size=10)
+
+    threads = [
+        threading.Thread(target=lambda: results.append(index.find(gi, 'reads')))
+        for _ in range(4)
+    ]
+    results = []
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ['c1'] * 4
+    assert max(peak) > 1
+
+
+def test_run_fails_when_a_paired_dataset_is_missing(tmp_path, monkeypatch):
+    from abm.lib import benchmark
+
+    monkeypatch.chdir(tmp_path)
+    gi = MagicMock()
+    gi.workflows.get_workflow_inputs.return_value = ['0']
+    gi.histories.get_histories.return_value = [{'id': 'h1'}]
+    workflow = {
+        'workflow_id': 'dna',
+        'runs': [
+            {
+                'inputs': [
+                    {
+                        'name': 'reads',
+                        'history': 'Inputs',
+                        'paired': [{'forward': 'r1.fq', 'reverse': 'r2.fq'}],
+                    }
+                ]
+            }
+        ],
+    }
+    monkeypatch.setattr(benchmark, 'connect', lambda context: gi)
+    monkeypatch.setattr(benchmark, 'parse_workflow', lambda path: [workflow])
+    monkeypatch.setattr(benchmark, 'find_workflow_id', lambda gi, name: 'w1')
+    monkeypatch.setattr(benchmark, '_get_dataset_data', lambda gi, name: None)
+
+    assert benchmark.run(None, 'dna.yml', None, None) is False
+    gi.workflows.invoke_workflow.assert_not_called()
+
+
+def test_run_cli_errors_are_batch_failures(tmp_path, monkeypatch, capsys):
+    from abm import __main__ as main
+    from abm.lib import benchmark
+
+    monkeypatch.setattr(main, 'stand_alone_commands', ['fake'])
+    monkeypatch.setitem(main.all_commands, 'fake', {'run': benchmark.run_cli})
+    missing = tmp_path / 'missing.yml'
+
+    assert benchmark.run_cli(None, []) is False
+    assert main.run_batch([], ['fake run', f'fake run {missing}']) == 2
+    assert 'can not find workflow configuration' in capsys.readouterr().out
@@ -0,0 +1,77 @@
+import time
+from unittest.mock import MagicMock
+
+from abm.lib.cache import COLLECTION, WORKFLOW, ResolutionCache
+
+
+def test_resolve_looks_up_each_name_once():
+    cache = ResolutionCache()
+    lookup = MagicMock(return_value='wf1')
+
+    for _ in range(5):
+        assert cache.resolve('https://a', WORKFLOW, 'RNA-seq', lookup) == 'wf1'
+
+    assert lookup.call_count == 1
+    assert (cache.hits, cache.misses) == (4, 1)
+
+
+def test_resolve_is_per_server_and_skips_failures():
+    cache = ResolutionCache()
+    cache.resolve('https://a', WORKFLOW, 'RNA-seq', lambda: 'wf1')
+
+    assert cache.resolve('https://b', WORKFLOW, 'RNA-seq', lambda: 'wf2') == 'wf2'
+    assert cache.resolve('https://a', COLLECTION, 'reads', lambda: None) is None
+    assert cache.resolve('https://a', COLLECTION, 'reads', lambda: 'c1') == 'c1'
+
+
+def test_invalidate_matching_entries():
+    cache = ResolutionCache()
+    cache.resolve('https://a', WORKFLOW, 'one', lambda: 'w1')
+    cache.resolve('https://a', COLLECTION, 'two', lambda: 'c2')
+    cache.resolve('https://b', WORKFLOW, 'one', lambda: 'w3')
+
+    assert cache.invalidate('https://a', WORKFLOW) == 1
+    assert cache.invalidate(kind=WORKFLOW) == 1
+    assert [entry[:3] for entry in cache.list()] == [('https://a', COLLECTION, 'two')]
+
+
+def test_saved_entries_expire(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cache' / 'resolutions.json')
+    cache = ResolutionCache(path, ttl=60)
+    cache.resolve('https://a', WORKFLOW, 'one', lambda: 'w1')
+    cache.save()
+
+    lookup = MagicMock(return_value='w2')
+    assert (
+        ResolutionCache(path, ttl=60).resolve('https://a', WORKFLOW, 'one', lookup)
+        == 'w1'
+    )
+    assert lookup.call_count == 0
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 120)
+    assert (
+        ResolutionCache(path, ttl=60).resolve('https://a', WORKFLOW, 'one', lookup)
+        == 'w2'
+    )
+
+
+def test_resolutions_are_per_user(monkeypatch):
+    from types import SimpleNamespace
+
+    from abm.lib import cache
+
+    monkeypatch.setattr(cache.lib, 'resolutions', None)
+    alice = SimpleNamespace(base_url='https://a/', key='alice')
+    bob = SimpleNamespace(base_url='https://a', key='bob')
+
+    assert cache.resolve(alice, WORKFLOW, 'RNA-seq', lambda: 'wf1') == 'wf1'
+    assert cache.resolve(bob, WORKFLOW, 'RNA-seq', lambda: 'wf2') == 'wf2'
+    assert cache.resolve(alice, WORKFLOW, 'RNA-seq', lambda: 'wf3') == 'wf1'
+    assert 'alice' not in cache.scope_key(alice)
+
+    # Clearing a server removes the names resolved for every user.
+    assert cache.get_resolution_cache().invalidate('https://a') == 2
+    cache.resolve(alice, WORKFLOW, 'RNA-seq', lambda: 'wf1')
+    cache.reset()
+    assert cache.resolve(alice, WORKFLOW, 'RNA-seq', lambda: 'wf4') == 'wf4'
@@ -0,0 +1,35 @@
+import asyncio
+from unittest.mock import MagicMock
+
+from abm.lib.async_galaxy import AsyncGalaxy
+from abm.lib.common import LRUCache, get_all_jobs_async
+
+
+def test_lru_cache_forgets_least_recently_used():
+    cache = LRUCache(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert len(cache) == 2
+
+
+def test_get_all_jobs_pages_until_a_short_page():
+    jobs = [{'id': str(i)} for i in range(5)]
+    gi = MagicMock()
+    gi.base_url = 'https://galaxy.test'
+    gi.jobs.get_jobs.side_effect = lambda limit, offset, **kwargs: jobs[
+        offset : offset + limit
+    ]
+
+    result = asyncio.run(
+        get_all_jobs_async(AsyncGalaxy(gi), page_size=2, history_id='h')
+    )
+
+    assert result == jobs
+    assert gi.jobs.get_jobs.call_count == 3
+    kwargs = gi.jobs.get_jobs.call_args.kwargs
+    assert kwargs['history_id'] == 'h'
+    assert kwargs['order_by'] == 'create_time'
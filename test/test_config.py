@@ -1,12 +1,14 @@
 import json
+import threading
 import tempfile
 import os
 import yaml
 from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import patch, mock_open, MagicMock
 import pytest
 
-from abm.lib.config import create, kube, bootstrap, _extract_filename_from_url, _import_dataset_with_metadata
+from abm.lib.config import create, kube, bootstrap, _extract_filename_from_url, _import_dataset_with_metadata, _process_terra_workspaces
 from abm.lib.common import Context
 
 
@@ -389,4 +391,218 @@ def test_bootstrap_version_1_enhanced_format(mock_context_class, mock_connect, m
     assert calls[0][1]['file_name'] == "file1.fastq"  # URL only
     assert calls[1][1]['file_name'] == "custom_file2"  # Custom name
     assert calls[2][1]['file_name'] == "custom_file3"  # Custom name + datatype
-    assert calls[2][1]['file_type'] == "fastqsanger"
\ No newline at end of file
+    assert calls[2][1]['file_type'] == "fastqsanger"
+
+@patch('abm.lib.config.workflow')
+@patch('abm.lib.config.history')
+@patch('abm.lib.config.connect')
+@patch('abm.lib.config.Context')
+def test_bootstrap_batches_dataset_uploads(mock_context_class, mock_connect, mock_history, mock_workflow, temp_bootstrap_config, capsys):
+    """Test that --batch-size sends several URLs in one upload request."""
+    mock_gi = MagicMock()
+    mock_connect.return_value = mock_gi
+    mock_gi.histories.get_histories.return_value = [{'id': 'existing_history_id'}]
+
+    with patch('abm.lib.config.dataset') as mock_dataset:
+        bootstrap(None, ['test_server', temp_bootstrap_config['v1'], '--batch-size', '2'])
+
+    mock_dataset._import_from_url.assert_not_called()
+    calls = mock_dataset._import_from_urls.call_args_list
+    assert len(calls) == 2
+    assert calls[0][0][1] == 'existing_history_id'
+    assert [e['name'] for e in calls[0][0][2]] == ["file1.fastq", "custom_file2"]
+    assert calls[1][0][2] == [{
+        'url': "https://example.com/file3.fastq",
+        'name': "custom_file3",
+        'ext': "fastqsanger",
+    }]
+    mock_gi.histories.create_history.assert_not_called()
+
+
+@patch('abm.lib.config.workflow')
+@patch('abm.lib.config.history')
+@patch('abm.lib.config.connect')
+@patch('abm.lib.config.Context')
+def test_bootstrap_runs_tasks_concurrently(mock_context_class, mock_connect, mock_history, mock_workflow, temp_bootstrap_config, capsys):
+    """Test that histories and workflows are imported at the same time."""
+    mock_connect.return_value = MagicMock()
+    # Both imports must be running at the same time to pass the barrier.
+    barrier = threading.Barrier(2, timeout=5)
+    mock_history._import.side_effect = lambda context, args: barrier.wait()
+    mock_workflow.import_from_url.side_effect = lambda context, args: barrier.wait()
+
+    with patch('abm.lib.config.dataset'):
+        bootstrap(None, ['test_server', temp_bootstrap_config['v0'], '--workers', '3'])
+
+    captured = capsys.readouterr()
+    assert "[3/3]" in captured.out
+    assert "FAILED" not in captured.out
+    assert "Instance configuration complete!" in captured.out
+
+
+@patch('abm.lib.config.workflow')
+@patch('abm.lib.config.history')
+@patch('abm.lib.config.connect')
+@patch('abm.lib.config.Context')
+def test_bootstrap_reports_failed_tasks(mock_context_class, mock_connect, mock_history, mock_workflow, temp_bootstrap_config, capsys):
+    """Test that tasks returning False are reported as failed."""
+    mock_gi = MagicMock()
+    mock_connect.return_value = mock_gi
+    mock_gi.histories.get_histories.return_value = []
+    mock_history._import.return_value = True
+    mock_workflow.import_from_url.return_value = False
+
+    with patch('abm.lib.config.dataset'):
+        bootstrap(None, ['test_server', temp_bootstrap_config['v0']])
+
+    captured = capsys.readouterr()
+    assert "FAILED: import workflow from https://example.com/workflow1" in captured.out
+    assert "WARNING: 1 of 3 tasks failed" in captured.out
+
+
+def _instance_with_existing_data():
+    """A mock Galaxy instance that already has some of the bootstrap items."""
+    gi = MagicMock()
+    gi.histories.get_histories.return_value = [{'name': 'Test History', 'id': 'hid'}]
+    gi.histories.show_history.return_value = [
+        {'name': 'file1.fastq', 'state': 'ok', 'file_size': 10},
+        {'name': 'renamed', 'state': 'ok', 'sources': [{'source_uri': 'https://example.com/file2.fastq'}]},
+        {'name': 'custom_file3', 'state': 'error'},
+    ]
+    gi.workflows.get_workflows.return_value = [{'name': 'Existing workflow'}]
+    return gi
+
+
+@patch('abm.lib.config.workflow')
+@patch('abm.lib.config.history')
+@patch('abm.lib.config.connect')
+@patch('abm.lib.config.Context')
+def test_bootstrap_skips_items_already_present(mock_context_class, mock_connect, mock_history, mock_workflow, temp_bootstrap_config, capsys):
+    """Test that only missing datasets and workflows are imported."""
+    mock_connect.return_value = _instance_with_existing_data()
+    mock_workflow._load_workflow.return_value = ({'name': 'Existing workflow'}, 'path')
+
+    with patch('abm.lib.config.dataset') as mock_dataset:
+        bootstrap(None, ['test_server', temp_bootstrap_config['v1']])
+
+    # file1 matches by name, file2 by its source URL and file3 failed before.
+    calls = mock_dataset._import_from_url.call_args_list
+    assert len(calls) == 1
+    assert calls[0][0][1] == 'hid'
+    assert calls[0][1]['file_name'] == 'custom_file3'
+
+    with patch('abm.lib.config.dataset') as mock_dataset:
+        bootstrap(None, ['test_server', temp_bootstrap_config['v0']])
+
+    mock_dataset._import_from_url.assert_not_called()
+    mock_workflow.import_from_url.assert_not_called()
+    # Histories can not be checked before they are imported.
+    mock_history._import.assert_called_once()
+
+
+@patch('abm.lib.config.workflow')
+@patch('abm.lib.config.history')
+@patch('abm.lib.config.connect')
+@patch('abm.lib.config.Context')
+def test_bootstrap_reports_invalid_datasets_after_reconcile(mock_context_class, mock_connect, mock_history, mock_workflow, tmp_path, capsys):
+    """Test that an invalid dataset entry is not dropped by the check for existing items."""
+    mock_connect.return_value = _instance_with_existing_data()
+    config_file = tmp_path / 'bootstrap.yml'
+    config_file.write_text(yaml.dump({'version': 1, 'datasets': {'Test History': [{'name': 'no url'}]}}))
+
+    with patch('abm.lib.config.dataset') as mock_dataset:
+        bootstrap(None, ['test_server', str(config_file)])
+
+    mock_dataset._import_from_url.assert_not_called()
+    captured = capsys.readouterr()
+    assert "FAILED: import datasets into 'Test History'" in captured.out
+    assert "WARNING: 1 of 1 tasks failed" in captured.out
+
+
+@patch('abm.lib.config.workflow')
+@patch('abm.lib.config.history')
+@patch('abm.lib.config.connect')
+@patch('abm.lib.config.Context')
+def test_bootstrap_dry_run(mock_context_class, mock_connect, mock_history, mock_workflow, temp_bootstrap_config, capsys):
+    """Test that a dry run reports what would be imported without importing it."""
+    mock_connect.return_value = _instance_with_existing_data()
+    mock_workflow._load_workflow.return_value = ({'name': 'New workflow'}, 'path')
+
+    with patch('abm.lib.config.dataset') as mock_dataset:
+        bootstrap(None, ['test_server', temp_bootstrap_config['v1'], '--dry-run'])
+        bootstrap(None, ['test_server', temp_bootstrap_config['v0'], '--dry-run'])
+
+    captured = capsys.readouterr()
+    assert "import   dataset https://example.com/file3.fastq -> 'Test History'" in captured.out
+    assert "present  dataset file1.fastq in 'Test History' (10 bytes)" in captured.out
+    assert "import   workflow https://example.com/workflow1" in captured.out
+    assert "Dry run, nothing was imported." in captured.out
+    mock_dataset._import_from_url.assert_not_called()
+    mock_workflow.import_from_url.assert_not_called()
+    mock_history._import.assert_not_called()
+
+
+class FakeAnVILFS:
+    """An in-memory stand-in for AnVILFS that counts directory listings."""
+
+    scans = []
+
+    def __init__(self, namespace, workspace):
+        self.files = {
+            "Tables/sample": ["a.fastq", "b.fastq", "c.bam"],
+            "/": ["readme.txt"],
+        }
+
+    def scandir(self, path):
+        FakeAnVILFS.scans.append(path)
+        return [SimpleNamespace(is_file=True, size=1, name=name) for name in self.files[path]]
+
+    def open(self, path, mode='r'):
+        raise AssertionError("files should not be opened")
+
+
+@patch('abm.lib.config.dataset')
+def test_terra_workspaces_share_directory_listings(mock_dataset):
+    """Test that patterns in the same directory are matched against a single listing."""
+    gi = MagicMock()
+    gi.histories.get_histories.return_value = [{'id': 'hid'}]
+    FakeAnVILFS.scans = []
+    terra = [{
+        'namespace': 'ns',
+        'workspace': 'ws',
+        'datasets': {
+            'Terra': [
+                'Tables/sample/*.fastq',
+                {'pattern': 'Tables/sample/*.bam', 'datatype': 'unsorted.bam'},
+                'Tables/sample/a.*',
+                '*.txt',
+            ]
+        },
+    }]
+
+    assert _process_terra_workspaces(gi, terra, workers=3, anvil_fs_factory=FakeAnVILFS)
+
+    assert sorted(FakeAnVILFS.scans) == ['/', 'Tables/sample']
+    calls = mock_dataset._import_from_url.call_args_list
+    urls = sorted(call[0][2] for call in calls)
+    assert urls == [
+        'anvil://ns/ws//readme.txt',
+        'anvil://ns/ws/Tables/sample/a.fastq',
+        'anvil://ns/ws/Tables/sample/b.fastq',
+        'anvil://ns/ws/Tables/sample/c.bam',
+    ]
+    types = {call[1]['file_name']: call[1]['file_type'] for call in calls}
+    assert types['c.bam'] == 'unsorted.bam'
+    assert types['a.fastq'] == 'fastqsanger'
+
+
+@patch('abm.lib.config.dataset')
+def test_terra_workspaces_report_failed_imports(mock_dataset, capsys):
+    """Test that a failed import fails the Terra workspace task."""
+    gi = MagicMock()
+    gi.histories.get_histories.return_value = [{'id': 'hid'}]
+    mock_dataset._import_from_url.side_effect = [None, RuntimeError('upload failed')]
+    terra = [{'namespace': 'ns', 'workspace': 'ws', 'datasets': {'Terra': ['Tables/sample/*.fastq']}}]
+
+    assert not _process_terra_workspaces(gi, terra, workers=2, anvil_fs_factory=FakeAnVILFS)
+    assert "ERROR importing" in capsys.readouterr().out
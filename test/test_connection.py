@@ -0,0 +1,51 @@
+from unittest.mock import MagicMock
+
+import pytest
+from bioblend import ConnectionError
+
+from abm.lib.connection import ConnectionRegistry, PooledGalaxyInstance
+
+
+def make_response(status_code=200, body=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = body
+    response.text = str(body)
+    return response
+
+
+def test_registry_shares_connections_per_server_and_key():
+    registry = ConnectionRegistry()
+
+    a = registry.get('https://a.example.org', 'key1', pool_size=4)
+    assert registry.get('https://a.example.org', 'key1') is a
+    assert registry.get('https://a.example.org', 'key2') is not a
+    assert registry.get('https://b.example.org', 'key1') is not a
+    assert (registry.stats.hits, registry.stats.misses) == (1, 3)
+    assert a.session.get_adapter('https://a.example.org')._pool_maxsize == 4
+    registry.close()
+    assert registry.connections == {}
+
+
+def test_requests_use_the_session():
+    session = MagicMock()
+    session.request.return_value = make_response(body=[{'id': 'h1'}])
+    gi = PooledGalaxyInstance('https://galaxy.example.org', 'key', session)
+
+    assert gi.histories.get_histories() == [{'id': 'h1'}]
+    method, url = session.request.call_args.args
+    assert method == 'GET'
+    assert url == 'https://galaxy.example.org/api/histories'
+    assert session.request.call_args.kwargs['headers']['x-api-key'] == 'key'
+    assert gi.stats.requests == 1 and gi.stats.errors == 0
+
+
+def test_failed_updates_raise_connection_error():
+    session = MagicMock()
+    session.request.return_value = make_response(500, 'boom')
+    gi = PooledGalaxyInstance('https://galaxy.example.org', 'key', session)
+
+    with pytest.raises(ConnectionError):
+        gi.histories.update_history('h1', name='new')
+    assert session.request.call_args.args[0] == 'PUT'
+    assert gi.stats.errors == 1
@@ -0,0 +1,238 @@
+import json
+import random
+
+import yaml
+
+from abm.lib.analytics import aggregate
+from abm.lib.common import get_float_key
+from abm.lib.experiment import external_sort, summarize
+
+
+def write_metrics(directory, job_id, tool_id, runtime, job_conf='4x8', state='ok'):
+    record = {
+        'run': 1,
+        'cloud': 'aws',
+        'job_conf': job_conf,
+        'workflow_id': 'wf1',
+        'history_id': 'h1',
+        'inputs': 'reads.fastq',
+        'metrics': {
+            'id': job_id,
+            'tool_id': tool_id,
+            'state': state,
+            'job_metrics': [
+                {'name': 'runtime_seconds', 'raw_value': str(runtime)},
+                {'name': 'memory.peak', 'raw_value': '1024'},
+                {'name': 'hostname', 'raw_value': 'node1'},
+            ],
+        },
+    }
+    with open(directory / f'{job_id}.json', 'w') as f:
+        json.dump(record, f)
+
+
+def test_external_sort_matches_list_sort():
+    rows = [[n % 7, str(n)] for n in range(1000)]
+    random.Random(42).shuffle(rows)
+    key = lambda row: row[0]
+
+    expected = sorted(rows, key=key, reverse=True)
+    assert (
+        list(external_sort(iter(rows), key, reverse=True, buffer_size=64)) == expected
+    )
+    assert list(external_sort(rows, key, buffer_size=10000)) == sorted(rows, key=key)
+
+
+def test_summarize_parallel_sorted_by_runtime(tmp_path, capsys):
+    for n in range(20):
+        write_metrics(tmp_path, f'j{n}', 'toolshed/repos/devteam/bwa/1.0', n)
+    write_metrics(tmp_path, 'upload', 'upload1', 100)
+    (tmp_path / 'broken.json').write_text('{')
+
+    summarize(
+        None,
+        [str(tmp_path), '--tsv', '-j', '2', '-s', 'runtime', '--sort-buffer', '5'],
+    )
+
+    lines = capsys.readouterr().out.splitlines()
+    rows = [line.split('\t') for line in lines if line.startswith('1\taws')]
+    assert len(rows) == 20
+    assert [row[10] for row in rows] == [str(n) for n in reversed(range(20))]
+    assert any(line.startswith('Unable to process') for line in lines)
+    assert rows == sorted(rows, key=get_float_key(10), reverse=True)
+
+
+def test_summarize_only_parses_changed_files(tmp_path, capsys, monkeypatch):
+    from abm.lib import experiment
+
+    for n in range(5):
+        write_metrics(tmp_path, f'j{n}', 'toolshed/repos/devteam/bwa/1.0', n)
+    summarize(None, [str(tmp_path), '--tsv'])
+    first = capsys.readouterr().out
+
+    parsed = []
+    summarize_file = experiment._summarize_file
+
+    def counting(task):
+        parsed.append(task[0])
+        return summarize_file(task)
+
+    monkeypatch.setattr(experiment, '_summarize_file', counting)
+    summarize(None, [str(tmp_path), '--tsv'])
+    assert parsed == []
+    assert sorted(capsys.readouterr().out.splitlines()) == sorted(first.splitlines())
+
+    write_metrics(tmp_path, 'j5', 'toolshed/repos/devteam/bwa/1.0', 5)
+    summarize(None, [str(tmp_path), '--tsv'])
+    assert parsed == [str(tmp_path / 'j5.json')]
+    assert len(capsys.readouterr().out.splitlines()) == 7
+
+    # Changing the accepted metrics invalidates every cached row.
+    parsed.clear()
+    summarize(None, [str(tmp_path), '--tsv', '--v1'])
+    assert len(parsed) == 6
+
+
+def test_aggregate_groups_by_cloud_job_conf_and_tool():
+    def row(cloud, conf, tool, state, runtime, memory):
+        return [
+            1,
+            cloud,
+            conf,
+            'wf',
+            'h',
+            'in',
+            tool,
+            state,
+            '1',
+            '',
+            runtime,
+            '',
+            '',
+            memory,
+        ]
+
+    rows = [
+        row('aws', '4x8', f'bwa,1.{n}', 'ok', str(n), str(2**30)) for n in range(1, 101)
+    ]
+    rows.append(row('aws', '4x8', 'bwa,1.0', 'error', '5000', ''))
+    rows.append(row('aws', '2x4', 'bwa,1.0', 'ok', '7', ''))
+    rows.append(row('gcp', '4x8', 'fastqc,0.7', 'ok', '', ''))
+
+    table = aggregate(rows, ['ok'])
+
+    assert [r[:4] for r in table] == [
+        ['aws', '2x4', 'bwa', '1'],
+        ['aws', '4x8', 'bwa', '100'],
+        ['gcp', '4x8', 'fastqc', '1'],
+    ]
+    assert table[0][4:] == ['7.0', '7.0', '7.0', '', '', '']
+    assert table[1][4:] == ['50.5', '50.5', '95.0', '1.000', '1.000', '1.000']
+    assert table[2][4:] == ['', '', '', '', '', '']
+    assert len(aggregate(rows)) == 3
+    assert aggregate(rows)[1][3] == '101'
+
+
+def test_summarize_stats(tmp_path, capsys):
+    for n in range(10):
+        write_metrics(tmp_path, f'j{n}', 'toolshed/repos/devteam/bwa/1.0', n)
+    write_metrics(tmp_path, 'big', 'toolshed/repos/devteam/bwa/1.0', 999, state='error')
+    write_metrics(tmp_path, 'small', 'toolshed/repos/devteam/bwa/1.0', 3, '2x4')
+
+    summarize(None, [str(tmp_path), '--csv', '--stats'])
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith('Cloud,Job Conf,Tool,Jobs,Runtime Mean')
+    assert lines[1:] == [
+        'aws,2x4,bwa,1,3.0,3.0,3.0,0.000,0.000,0.000',
+        'aws,4x8,bwa,10,4.5,4.5,8.5,0.000,0.000,0.000',
+    ]
+
+
+def test_fit_linear_fits_every_group():
+    import numpy as np
+
+    from abm.lib.analytics import fit_linear
+
+    group = np.array([0, 0, 0, 1, 1, 2])
+    x = np.array([1.0, 2.0, 3.0, 5.0, 5.0, 1.0])
+    y = np.array([12.0, 14.0, 16.0, 4.0, 6.0, np.nan])
+
+    intercept, slope, r2 = fit_linear(group, x, y, 3)
+
+    assert list(intercept[:2]) == [10.0, 5.0]
+    assert list(slope[:2]) == [2.0, 0.0]
+    assert r2[0] == 1.0
+    assert np.isnan(slope[2])
+
+
+def test_model_writes_rules(tmp_path, capsys):
+    from abm.lib.experiment import model
+
+    GB = 1073741824
+    for n in range(1, 5):
+        record = {
+            'input_data_size': [n * GB],
+            'metrics': {
+                'id': f'j{n}',
+                'tool_id': f'toolshed.g2.bx.psu.edu/repos/devteam/bwa/bwa_mem/0.{n}',
+                'state': 'ok',
+                'job_metrics': [
+                    {'name': 'runtime_seconds', 'raw_value': str(100 * n)},
+                    {'name': 'memory.peak', 'raw_value': str(2 * n * GB)},
+                    {'name': 'cpuacct.usage', 'raw_value': str(250 * n * 10**9)},
+                ],
+            },
+        }
+        (tmp_path / f'j{n}.json').write_text(json.dumps(record))
+    output = tmp_path / 'rules.yml'
+
+    model(None, [str(tmp_path), '-o', str(output), '--input-size', '10'])
+
+    values = yaml.safe_load(output.read_text())
+    content = values['jobs']['rules']['container_mapper_rules.yml']['content']
+    rules = yaml.safe_load(content)
+    assert rules['mappings'] == [
+        {
+            'tool_ids': ['toolshed.g2.bx.psu.edu/repos/devteam/bwa/bwa_mem/.*'],
+            'resource_set': 'bwa_mem',
+        }
+    ]
+    resources = rules['resources']['resource_sets']['bwa_mem']
+    # 2 GB per GB of input for 10 GB, with 20% headroom
+    assert resources['requests'] == {'cpu': 3, 'memory': '24G'}
+    assert rules['resources']['default_resource_set'] == 'default'
+
+    model(None, [str(tmp_path), '--csv'])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[-1].startswith(
+        'toolshed.g2.bx.psu.edu/repos/devteam/bwa/bwa_mem/.*,4,4.000,0.0,100.000,1.000,'
+    )
+
+
+def test_model_cpu_from_cgroup_v2_or_slots():
+    from abm.lib import analytics
+    from abm.lib.experiment import make_model_row
+
+    def row(tool_id, *job_metrics):
+        data = {
+            'metrics': {
+                'id': 'j1',
+                'tool_id': tool_id,
+                'state': 'ok',
+                'job_metrics': [
+                    {'name': name, 'raw_value': value} for name, value in job_metrics
+                ],
+            }
+        }
+        return make_model_row(data)
+
+    rows = [
+        row('v2', ('runtime_seconds', '10'), ('cpu.stat.usage_usec', '35000000')),
+        row('slots', ('runtime_seconds', '10'), ('galaxy_slots', '4')),
+    ]
+    models = analytics.ToolModels(rows)
+
+    assert list(models.tools) == ['slots', 'v2']
+    assert list(models.max_cpu) == [4.0, 3.5]
+    assert models.missing_cpu == 1
@@ -0,0 +1,56 @@
+import json
+
+from abm.lib import helm
+
+
+def deployment(name, generation=2, observed=2, replicas=1, updated=1, available=1):
+    return {
+        'metadata': {'name': name, 'generation': generation},
+        'spec': {'replicas': replicas},
+        'status': {
+            'observedGeneration': observed,
+            'replicas': replicas,
+            'updatedReplicas': updated,
+            'availableReplicas': available,
+        },
+    }
+
+
+def test_rollout_status():
+    assert helm.rollout_status(deployment('galaxy-web')) == (True, None)
+    assert helm.rollout_status(deployment('galaxy-web', observed=1)) == (False, None)
+    assert helm.rollout_status(deployment('galaxy-web', updated=0)) == (False, None)
+    assert helm.rollout_status(deployment('galaxy-web', available=0)) == (False, None)
+    stalled = deployment('galaxy-web', updated=0)
+    stalled['status']['conditions'] = [{'reason': 'ProgressDeadlineExceeded'}]
+    done, message = helm.rollout_status(stalled)
+    assert not done and message is not None
+
+
+def test_wait_until_ready_polls_all_deployments_together(monkeypatch):
+    ticks = [
+        [
+            deployment('galaxy-job-0', observed=1),
+            deployment('galaxy-web', available=0),
+            deployment('galaxy-postgres', observed=1),
+        ],
+        [deployment('galaxy-job-0'), deployment('galaxy-web', available=0)],
+        [deployment('galaxy-job-0'), deployment('galaxy-web')],
+    ]
+    commands = []
+
+    def run(command, env):
+        commands.append(command)
+        return json.dumps({'items': ticks[len(commands) - 1]})
+
+    monkeypatch.setattr(helm, 'find_executable', lambda name: name)
+    monkeypatch.setattr(helm, 'run', run)
+    assert helm.wait_until_ready('galaxy', {}, interval=0)
+    assert commands == ['kubectl get deployment -n galaxy -o json'] * 3
+
+
+def test_wait_until_ready_times_out(monkeypatch):
+    data = json.dumps({'items': [deployment('galaxy-web', available=0)]})
+    monkeypatch.setattr(helm, 'find_executable', lambda name: name)
+    monkeypatch.setattr(helm, 'run', lambda command, env: data)
+    assert not helm.wait_until_ready('galaxy', {}, timeout=0, interval=0)
@@ -0,0 +1,123 @@
+from unittest.mock import MagicMock, patch
+
+from abm.lib.history import HistoryWaiter
+
+
+def job(id, state, tool='toolshed/repos/iuc/fastp/fastp/1.0'):
+    return {'id': id, 'state': state, 'tool_id': tool}
+
+
+def make_gi(jobs: dict, update_times: dict):
+    gi = MagicMock()
+    gi.jobs.get_jobs.side_effect = lambda history_id: jobs[history_id]
+    gi.histories.get_histories.side_effect = lambda **kwargs: [
+        {'id': id, 'update_time': t} for id, t in update_times.items()
+    ]
+    return gi
+
+
+def test_waiter_only_polls_changed_histories():
+    jobs = {'h1': [job('j1', 'running')], 'h2': [job('j2', 'running')]}
+    update_times = {'h1': 't0', 'h2': 't0'}
+    gi = make_gi(jobs, update_times)
+    waiter = HistoryWaiter(gi, min_interval=1, max_interval=60)
+    waiter.add('h1')
+    waiter.add('h2')
+
+    assert waiter.tick()
+    assert gi.jobs.get_jobs.call_count == 2
+
+    # Nothing changed on the server, so no job lists are fetched.
+    assert not waiter.tick()
+    assert gi.jobs.get_jobs.call_count == 2
+
+    jobs['h2'] = [job('j2', 'ok')]
+    update_times['h2'] = 't1'
+    assert waiter.tick()
+    assert gi.jobs.get_jobs.call_count == 3
+    gi.jobs.get_jobs.assert_called_with(history_id='h2')
+    assert [h.id for h in waiter.pending()] == ['h1']
+
+
+@patch('abm.lib.history.time.sleep')
+def test_waiter_backs_off_until_a_job_changes(mock_sleep):
+    jobs = {'h1': [job('j1', 'running')]}
+    update_times = {'h1': 't0'}
+    gi = make_gi(jobs, update_times)
+    waiter = HistoryWaiter(gi, min_interval=1, max_interval=8, backoff=2)
+    waiter.add('h1')
+
+    ticks = []
+
+    def finish_after_four_sleeps(seconds):
+        ticks.append(seconds)
+        if len(ticks) == 4:
+            jobs['h1'] = [job('j1', 'ok')]
+            update_times['h1'] = 't1'
+
+    mock_sleep.side_effect = finish_after_four_sleeps
+
+    assert waiter.wait() == {'h1': True}
+    assert ticks == [1, 2, 4, 8]
+
+
+def test_waiter_restarts_failed_jobs():
+    jobs = {'h1': [job('j1', 'error')]}
+    gi = make_gi(jobs, {'h1': 't0'})
+    waiter = HistoryWaiter(gi)
+    waiter.add('h1')
+
+    waiter.tick()
+
+    gi.jobs.rerun_job.assert_called_once_with('j1', remap=True)
+    assert len(waiter.pending()) == 1
+
+
+def test_summarize_histories_reuses_names_and_streams_rows():
+    import asyncio
+
+    from abm.lib.async_galaxy import AsyncGalaxy
+    from abm.lib.history import summarize_histories
+
+    jobs = {'h1': [job('j1', 'ok'), job('j2', 'ok')], 'h2': [job('j3', 'error')]}
+    gi = MagicMock()
+    gi.base_url = 'https://galaxy.test'
+    gi.histories.show_history.side_effect = lambda hid: {
+        'id': hid,
+        'name': f"name {hid}",
+    }
+    gi.jobs.get_jobs.side_effect = lambda history_id, **kwargs: jobs[history_id]
+    gi.jobs.get_metrics.return_value = [{'name': 'runtime_seconds', 'raw_value': '3'}]
+    rows = []
+
+    table = asyncio.run(summarize_histories(AsyncGalaxy(gi), ['h1', 'h2'], rows.append))
+
+    assert [row[0] for row in table] == ['j1', 'j2', 'j3']
+    assert sorted(row[0] for row in rows) == ['j1', 'j2', 'j3']
+    assert table[2][2] == 'name h2'
+    # Each history is shown once, to resolve it, and its name is reused.
+    assert gi.histories.show_history.call_count == 2
+
+
+def test_summarize_histories_reports_failed_histories(capsys):
+    import asyncio
+
+    from abm.lib.async_galaxy import AsyncGalaxy
+    from abm.lib.history import summarize_histories
+
+    gi = MagicMock()
+    gi.base_url = 'https://failing.test'
+    gi.histories.show_history.side_effect = lambda hid: {'id': hid, 'name': hid}
+
+    def get_jobs(history_id, **kwargs):
+        if history_id == 'h1':
+            raise ValueError('jobs unavailable')
+        return [job('j2', 'ok')]
+
+    gi.jobs.get_jobs.side_effect = get_jobs
+    gi.jobs.get_metrics.return_value = []
+
+    table = asyncio.run(summarize_histories(AsyncGalaxy(gi), ['h1', 'h2']))
+
+    assert [row[0] for row in table] == ['j2']
+    assert "ERROR: Unable to summarize history h1" in capsys.readouterr().out
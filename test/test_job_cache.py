@@ -0,0 +1,100 @@
+import asyncio
+from unittest.mock import MagicMock
+
+from abm.lib import job_cache
+from abm.lib.async_galaxy import AsyncGalaxy
+from abm.lib.job_cache import JobCache
+from abm.lib.metrics import fetch_job
+
+
+def make_gi(state='ok'):
+    gi = MagicMock()
+    gi.base_url = 'https://jobs.test'
+    gi.jobs.show_job.side_effect = lambda job_id, full_details=False: {
+        'id': job_id,
+        'state': state,
+        'tool_id': 'cat1',
+    }
+    gi.jobs.get_metrics.return_value = [{'name': 'runtime_seconds', 'raw_value': '3'}]
+    return gi
+
+
+def test_entries_are_saved_to_disk(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    cache = JobCache(path)
+    cache.put('server', 'j1', job_cache.METRICS, [{'name': 'x'}])
+    cache.close()
+
+    cache = JobCache(path)
+    assert cache.get('server', 'j1', job_cache.METRICS) == [{'name': 'x'}]
+    assert cache.get('other', 'j1', job_cache.METRICS) is None
+    assert cache.count('server') == 1
+
+
+def test_least_recently_used_entries_are_evicted(monkeypatch):
+    cache = JobCache(max_entries=2)
+    cache.put('s', 'j1', job_cache.JOB, 1)
+    cache.put('s', 'j2', job_cache.JOB, 2)
+    now = job_cache.time.time() + job_cache.TOUCH_INTERVAL + 1
+    monkeypatch.setattr(job_cache.time, 'time', lambda: now)
+    assert cache.get('s', 'j1', job_cache.JOB) == 1
+    cache.put('s', 'j3', job_cache.JOB, 3)
+    cache._evict()
+    assert cache.count() == 2
+    assert cache.get('s', 'j2', job_cache.JOB) is None
+    assert cache.get('s', 'j1', job_cache.JOB) == 1
+
+
+def test_clear_only_removes_one_server():
+    cache = JobCache()
+    cache.put('a', 'j1', job_cache.JOB, 1)
+    cache.put('b', 'j1', job_cache.JOB, 1)
+    assert cache.clear('a') == 1
+    assert cache.count() == 1
+
+
+def test_fetch_job_only_caches_terminal_jobs():
+    gi = make_gi()
+    for _ in range(2):
+        data = asyncio.run(fetch_job(AsyncGalaxy(gi), 'j1'))
+        assert data['job_metrics'][0]['name'] == 'runtime_seconds'
+    assert gi.jobs.show_job.call_count == 1
+    assert gi.jobs.get_metrics.call_count == 1
+
+    gi = make_gi('running')
+    job_cache.show_job(gi, 'j2')
+    job_cache.show_job(gi, 'j2')
+    assert gi.jobs.show_job.call_count == 2
+
+
+def test_bypass_applies_to_one_command():
+    gi = make_gi()
+    with job_cache.bypass():
+        job = job_cache.show_job(gi, 'j1')
+        job_cache.get_metrics(gi, job)
+        job_cache.get_metrics(gi, job)
+        assert asyncio.run(fetch_job(AsyncGalaxy(gi), 'j1'))['job_metrics']
+    assert gi.jobs.get_metrics.call_count == 3
+    assert job_cache.get_job_cache().count() == 0
+
+    with job_cache.bypass(False):
+        job_cache.get_metrics(gi, job)
+    job_cache.get_metrics(gi, job)
+    assert gi.jobs.get_metrics.call_count == 4
+
+
+def test_hits_only_record_old_access_times(monkeypatch):
+    cache = JobCache()
+    cache.put('server', 'j1', job_cache.METRICS, [])
+    statements = []
+    cache._db.set_trace_callback(statements.append)
+
+    cache.get('server', 'j1', job_cache.METRICS)
+    assert not any(s.startswith('UPDATE') for s in statements)
+
+    now = job_cache.time.time()
+    monkeypatch.setattr(
+        job_cache.time, 'time', lambda: now + job_cache.TOUCH_INTERVAL + 1
+    )
+    cache.get('server', 'j1', job_cache.METRICS)
+    assert any(s.startswith('UPDATE') for s in statements)
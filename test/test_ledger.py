@@ -0,0 +1,84 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from abm.lib import benchmark
+from abm.lib.ledger import COMPLETE, FAILED, INVOKED, RunLedger, ledger_path
+
+
+def test_ledger_path_is_safe():
+    assert ledger_path('Benchmarking DNA/v2').endswith(
+        'Benchmarking-DNA-v2.ledger.jsonl'
+    )
+
+
+def test_resume_replays_latest_state(tmp_path):
+    path = str(tmp_path / 'exp.ledger.jsonl')
+    ledger = RunLedger(path)
+    item = ledger.item('aws', '4x8', 'dna.yml', 1)
+    item.started()
+    item.invoked('history 1', 'inv1')
+    item.invocation_finished('history 1', 'inv1', True)
+    item.invoked('history 2', 'inv2')
+    ledger.close()
+    with open(path, 'a') as f:
+        f.write('{"key": ["aws"')
+
+    resumed = RunLedger(path, resume=True).item('aws', '4x8', 'dna.yml', 1)
+    assert resumed.state() == 'started'
+    assert resumed.invocation('history 1')['state'] == COMPLETE
+    assert resumed.invocation('history 2')['state'] == INVOKED
+    assert resumed.invocation('history 2')['invocation_id'] == 'inv2'
+
+    RunLedger(path).close()
+    assert (tmp_path / 'exp.ledger.jsonl.old').exists()
+    assert RunLedger(path, resume=True).entries == {}
+
+
+def test_invoked_runs_are_reattached(tmp_path, monkeypatch):
+    ledger = RunLedger(str(tmp_path / 'ledger.jsonl'))
+    item = ledger.item('aws', None, 'dna.yml', 1)
+    item.invoked('history 1', 'inv1')
+    gi = MagicMock()
+    gi.invocations.wait_for_invocation.return_value = {'history_id': 'h1'}
+    waited = []
+    monkeypatch.setattr(
+        benchmark, 'wait_for_jobs', lambda context, gi, inv, *args: waited.append(inv)
+    )
+
+    history_id = benchmark._invoke_and_wait(
+        None, gi, 'wf1', {}, 'history 1', {}, str(tmp_path), ledger=item
+    )
+
+    assert history_id == 'h1'
+    gi.workflows.invoke_workflow.assert_not_called()
+    gi.invocations.wait_for_invocation.assert_called_once()
+    assert gi.invocations.wait_for_invocation.call_args.args[0] == 'inv1'
+    assert item.invocation('history 1')['state'] == COMPLETE
+    assert len(waited) == 1
+
+
+def test_interrupted_runs_stay_invoked(tmp_path, monkeypatch):
+    ledger = RunLedger(str(tmp_path / 'ledger.jsonl'))
+    item = ledger.item('aws', None, 'dna.yml', 1)
+    gi = MagicMock()
+    gi.workflows.invoke_workflow.return_value = {'id': 'inv1'}
+    gi.invocations.wait_for_invocation.side_effect = KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        benchmark._invoke_and_wait(
+            None, gi, 'wf1', {}, 'history 1', {}, str(tmp_path), ledger=item
+        )
+    assert item.invocation('history 1')['state'] == INVOKED
+
+    gi.invocations.wait_for_invocation.side_effect = None
+    gi.invocations.wait_for_invocation.return_value = {
+        'history_id': 'h1',
+        'state': 'failed',
+    }
+    monkeypatch.setattr(benchmark, 'wait_for_jobs', lambda *args: None)
+    benchmark._invoke_and_wait(
+        None, gi, 'wf1', {}, 'history 1', {}, str(tmp_path), ledger=item
+    )
+    gi.workflows.invoke_workflow.assert_called_once()
+    assert item.invocation('history 1')['state'] == FAILED
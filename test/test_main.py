@@ -0,0 +1,101 @@
+import os
+
+import yaml
+
+from abm import __main__ as main
+
+MENU = os.path.join(os.path.dirname(main.__file__), 'lib', 'menu.yml')
+
+
+def test_every_menu_handler_resolves():
+    with open(MENU) as f:
+        menu_data = yaml.safe_load(f)
+    for item in menu_data:
+        for submenu_item in item['menu']:
+            handler = main.LazyHandler(submenu_item['handler'])
+            assert callable(handler.resolve()), submenu_item['handler']
+
+
+def test_load_menu_uses_the_cache(tmp_path, monkeypatch):
+    cache_path = tmp_path / 'menu.json'
+    monkeypatch.setattr(main, 'MENU_CACHE', str(cache_path))
+    menu_config = tmp_path / 'menu.yml'
+    menu_config.write_text("- name: [a]\n  help: first\n  menu: []\n")
+
+    assert main.load_menu(str(menu_config))[0]['help'] == 'first'
+    assert cache_path.exists()
+    # A cached menu is returned without parsing the YAML.
+    monkeypatch.setattr(yaml, 'safe_load', None)
+    assert main.load_menu(str(menu_config))[0]['help'] == 'first'
+
+    monkeypatch.undo()
+    monkeypatch.setattr(main, 'MENU_CACHE', str(cache_path))
+    menu_config.write_text("- name: [a]\n  help: second one\n  menu: []\n")
+    assert main.load_menu(str(menu_config))[0]['help'] == 'second one'
+
+
+def test_run_batch_dispatches_through_the_command_table(monkeypatch, capsys):
+    calls = []
+
+    def handler(context, args):
+        calls.append(args)
+        if args == ['fail']:
+            return False
+        if args == ['boom']:
+            raise RuntimeError('boom')
+
+    monkeypatch.setattr(main, 'stand_alone_commands', ['fake'])
+    monkeypatch.setitem(main.all_commands, 'fake', {'do': handler})
+    lines = [
+        'fake do one "two words"',
+        '# a comment',
+        '',
+        'abm fake do fail',
+        'fake do boom',
+        'batch nested.txt',
+    ]
+    assert main.run_batch([], lines) == 3
+    assert calls == [['one', 'two words'], ['fail'], ['boom']]
+    assert 'line 5' in capsys.readouterr().out
+
+    calls.clear()
+    assert main.run_batch([], lines, stop_on_error=True) == 1
+    assert calls == [['one', 'two words'], ['fail']]
+
+
+def test_contexts_are_reused(monkeypatch):
+    import lib.common
+
+    created = []
+    monkeypatch.setattr(lib.common, 'Context', lambda p: created.append(p) or p)
+    monkeypatch.setattr(main, 'contexts', {})
+    assert main.get_context('aws') == 'aws'
+    assert main.get_context('aws') == 'aws'
+    assert created == ['aws']
+
+
+def test_serve_socket_is_private_from_creation(tmp_path, monkeypatch):
+    import socket
+
+    import pytest
+
+    if not hasattr(socket, 'AF_UNIX'):
+        pytest.skip('Unix sockets are not supported')
+    path = str(tmp_path / 'abm.sock')
+    modes = []
+
+    class Server(main.socketserver.UnixStreamServer):
+        def serve_forever(self, poll_interval=0.5):
+            modes.append(os.stat(path).st_mode & 0o777)
+            raise KeyboardInterrupt()
+
+    monkeypatch.setattr(main.socketserver, 'UnixStreamServer', Server)
+    umask = os.umask(0o022)
+    try:
+        main.serve([], path)
+        assert os.umask(0o022) == 0o022
+    finally:
+        os.umask(umask)
+    # Only the owner can connect.
+    assert len(modes) == 1 and modes[0] & 0o077 == 0
+    assert not os.path.exists(path)
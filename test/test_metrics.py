@@ -0,0 +1,145 @@
+import json
+import os
+from unittest.mock import MagicMock
+
+from abm.lib.common import Context
+from abm.lib.metrics import SqliteSink, harvest, write_json
+
+
+def make_invocations(output_dir):
+    return {
+        'workflow_id': 'wf1',
+        'history_id': 'h1',
+        'run': '1',
+        'cloud': 'aws',
+        'job_conf': '4x8',
+        'inputs': 'reads.fastq',
+        'output_dir': output_dir,
+        'ref_data_size': [],
+        'input_data_size': [1024],
+    }
+
+
+def test_harvest_writes_one_record_per_job(tmp_path):
+    gi = MagicMock()
+    gi.jobs.show_job.side_effect = lambda id, full_details: {'id': id, 'tool_id': 't'}
+    gi.jobs.get_metrics.side_effect = lambda id: [{'name': 'runtime_seconds'}]
+    jobs = [{'id': f'j{n}', 'state': 'ok'} for n in range(10)]
+    context = Context('https://galaxy.example.org', 'key', None)
+
+    failed = harvest(context, gi, make_invocations(str(tmp_path)), jobs, threads=4)
+
+    assert failed == 0
+    assert sorted(os.listdir(tmp_path)) == sorted(f'j{n}.json' for n in range(10))
+    with open(tmp_path / 'j3.json') as f:
+        record = json.load(f)
+    assert record['metrics']['id'] == 'j3'
+    assert record['metrics']['job_metrics'] == [{'name': 'runtime_seconds'}]
+    assert record['server'] == 'https://galaxy.example.org'
+    assert record['status'] == 'ok'
+
+
+def test_harvest_retries_each_request(tmp_path):
+    gi = MagicMock()
+    gi.jobs.show_job.return_value = {'id': 'j1'}
+    gi.jobs.get_metrics.side_effect = [ConnectionError('reset'), []]
+    context = Context('server', 'key', None)
+
+    failed = harvest(
+        context, gi, make_invocations(str(tmp_path)), [{'id': 'j1', 'state': 'ok'}]
+    )
+
+    assert failed == 0
+    assert gi.jobs.show_job.call_count == 1
+    assert gi.jobs.get_metrics.call_count == 2
+
+
+def test_harvest_reports_failed_jobs(tmp_path):
+    gi = MagicMock()
+    gi.jobs.show_job.side_effect = ConnectionError('down')
+    context = Context('server', 'key', None)
+
+    failed = harvest(
+        context, gi, make_invocations(str(tmp_path)), [{'id': 'j1', 'state': 'ok'}]
+    )
+
+    assert failed == 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_write_json_replaces_file(tmp_path):
+    path = str(tmp_path / 'record.json')
+    write_json(path, {'a': 1})
+    write_json(path, {'a': 2})
+
+    with open(path) as f:
+        assert json.load(f) == {'a': 2}
+    assert os.listdir(tmp_path) == ['record.json']
+    umask = os.umask(0)
+    os.umask(umask)
+    assert os.stat(path).st_mode & 0o777 == 0o666 & ~umask
+
+
+def test_sqlite_sink_groups_records_by_experiment(tmp_path):
+    sink = SqliteSink(str(tmp_path / 'metrics.db'))
+    record = {'run': 1, 'metrics': {'tool_id': 'bwa', 'state': 'ok'}}
+    sink.write('metrics/exp1/', 'j1', record)
+    sink.write('metrics/exp1', 'j1', dict(record, run=2))
+    sink.write('metrics/exp2', 'j2', record)
+
+    assert sorted(sink.experiments()) == [('exp1', 1), ('exp2', 1)]
+    rows = list(sink.records(['exp1']))
+    assert rows == [('exp1', 'j1', dict(record, run=2))]
+    assert len(list(sink.records())) == 2
+    sink.close()
+
+
+def test_sqlite_sink_reads_and_writes_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(SqliteSink, 'BATCH_SIZE', 2)
+    sink = SqliteSink(str(tmp_path / 'metrics.db'))
+    records = ((f'j{n}', {'run': n, 'metrics': {}}) for n in range(5))
+
+    assert sink.write_many('exp', records) == 5
+
+    rows = sink.records(['exp'])
+    first = next(rows)
+    # Other threads can use the sink while the records are being read.
+    sink.write('metrics/exp', 'j9', {'run': 9, 'metrics': {}})
+    assert len([first] + list(rows)) >= 5
+    assert sink.experiments() == [('exp', 6)]
+    sink.close()
+
+
+def test_harvest_to_sqlite_sink(tmp_path):
+    gi = MagicMock()
+    gi.jobs.show_job.side_effect = lambda id, full_details: {'id': id, 'tool_id': 't'}
+    gi.jobs.get_metrics.return_value = []
+    jobs = [{'id': f'j{n}', 'state': 'ok'} for n in range(5)]
+    context = Context('server', 'key', None)
+    output_dir = str(tmp_path / 'exp')
+    sink = SqliteSink(str(tmp_path / 'metrics.db'))
+
+    failed = harvest(context, gi, make_invocations(output_dir), jobs, sink=sink)
+
+    assert failed == 0
+    assert not os.path.exists(output_dir)
+    assert sink.experiments() == [('exp', 5)]
+    sink.close()
+
+
+def test_ingest_metrics_directory(tmp_path):
+    from abm.lib.experiment import ingest
+
+    metrics_dir = tmp_path / 'exp1'
+    metrics_dir.mkdir()
+    for n in range(3):
+        write_json(str(metrics_dir / f'j{n}.json'), {'run': n, 'metrics': {}})
+    (metrics_dir / 'broken.json').write_text('{')
+    database = str(tmp_path / 'metrics.db')
+
+    ingest(None, ['--db', database, str(metrics_dir)])
+
+    sink = SqliteSink(database)
+    assert sink.experiments() == [('exp1', 3)]
+    assert sorted(job_id for _, job_id, _ in sink.records()) == ['j0', 'j1', 'j2']
+    sink.close()
@@ -0,0 +1,86 @@
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+from bioblend import ConnectionError
+
+from abm.lib import retry
+from abm.lib.async_galaxy import AsyncGalaxy
+from abm.lib.common import try_for
+from abm.lib.connection import PooledGalaxyInstance
+
+FAST = retry.RetryPolicy(attempts=4, base_delay=0)
+
+
+def test_delay_grows_exponentially_up_to_the_maximum():
+    policy = retry.RetryPolicy(base_delay=1, max_delay=5, multiplier=2)
+    for attempt, ceiling in [(1, 1), (2, 2), (3, 4), (4, 5), (10, 5)]:
+        delays = [policy.delay(attempt) for _ in range(50)]
+        assert all(0 <= d <= ceiling for d in delays)
+
+
+def test_transient_errors_are_retried():
+    f = MagicMock(side_effect=[ConnectionError('busy', status_code=503), 'ok'])
+    assert retry.call(f, server='transient', policy=FAST) == 'ok'
+    assert f.call_count == 2
+
+
+def test_fatal_errors_are_not_retried():
+    f = MagicMock(side_effect=ConnectionError('missing', status_code=404))
+    with pytest.raises(ConnectionError):
+        retry.call(f, server='fatal', policy=FAST)
+    assert f.call_count == 1
+
+
+def test_budget_stops_retries_to_a_failing_server():
+    f = MagicMock(side_effect=TimeoutError())
+    for _ in range(3):
+        with pytest.raises(TimeoutError):
+            retry.call(f, server='overloaded', policy=FAST)
+    # Five retries are allowed from a full budget, then calls fail fast.
+    assert f.call_count == 3 + 5
+    budget = retry.get_budget('overloaded')
+    for _ in range(10):
+        budget.success()
+    assert budget.try_spend()
+
+
+def make_gi(*statuses):
+    responses = []
+    for status in statuses:
+        response = MagicMock(status_code=status, text='')
+        response.json.return_value = {'status': status}
+        responses.append(response)
+    session = MagicMock()
+    session.request.side_effect = responses
+    gi = PooledGalaxyInstance('https://retry.example.org', 'key', session)
+    gi.retry_policy = FAST
+    gi.max_get_attempts = 1
+    return gi, session
+
+
+def test_get_requests_retry_transient_status():
+    gi, session = make_gi(502, 503, 200)
+    assert gi.histories.show_history('h1') == {'status': 200}
+    assert session.request.call_count == 3
+
+
+def test_updates_are_not_resent():
+    gi, session = make_gi(503, 200)
+    with pytest.raises(ConnectionError):
+        gi.histories.update_history('h1', name='new')
+    assert session.request.call_count == 1
+
+    ok = MagicMock(status_code=200)
+    session.request.side_effect = [requests.exceptions.ConnectTimeout(), ok]
+    gi.histories.update_history('h1', name='new')
+    assert session.request.call_count == 3
+
+
+def test_requests_are_retried_in_one_layer():
+    gi, session = make_gi(503, 503, 503, 503, 503)
+    with pytest.raises(ConnectionError):
+        try_for(lambda: gi.jobs.get_jobs(history_id='h1'), gi=gi)
+    # Only the connection retries, once per attempt of its policy.
+    assert session.request.call_count == FAST.attempts
+    assert AsyncGalaxy(gi).attempts == 1
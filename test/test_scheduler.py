@@ -0,0 +1,89 @@
+import threading
+import time
+
+from abm.lib.scheduler import Scheduler, WorkItem, make_work_items
+
+
+def test_make_work_items_with_priorities():
+    config = {
+        'benchmark_confs': ['a.yml', {'path': 'b.yml', 'priority': -1}],
+        'job_configs': ['4x8', {'name': '8x16', 'priority': 5}],
+    }
+    items = make_work_items(config, ['aws', 'gcp'], 1, 3)
+
+    assert len(items) == 2 * 2 * 2 * 2
+    item = [i for i in items if i.benchmark == 'b.yml' and i.job_conf == '8x16'][0]
+    assert item.priority == 4
+    assert item.history_prefix() == f"{item.run_number} {item.cloud} 8x16"
+    assert (
+        make_work_items({'benchmark_confs': ['a.yml']}, ['aws'], 1, 2)[
+            0
+        ].history_prefix()
+        == '1 aws'
+    )
+
+
+def test_job_configs_never_overlap_on_a_cloud():
+    items = make_work_items(
+        {'benchmark_confs': ['a.yml', 'b.yml'], 'job_configs': ['c1', 'c2']},
+        ['aws', 'gcp'],
+        1,
+        4,
+    )
+    lock = threading.Lock()
+    active = {'aws': None, 'gcp': None}
+    running = {'aws': [], 'gcp': []}
+    applied = []
+    peak = {'aws': 0, 'gcp': 0}
+
+    def apply_conf(cloud, conf):
+        with lock:
+            assert running[cloud] == []
+            active[cloud] = conf
+            applied.append((cloud, conf))
+        return True
+
+    def run_item(item):
+        with lock:
+            assert active[item.cloud] == item.job_conf
+            running[item.cloud].append(item)
+            peak[item.cloud] = max(peak[item.cloud], len(running[item.cloud]))
+        time.sleep(0.01)
+        with lock:
+            running[item.cloud].remove(item)
+        return True
+
+    scheduler = Scheduler(items, run_item, apply_conf, {'aws': 3, 'gcp': 2})
+    assert scheduler.run()
+
+    assert scheduler.completed == 24
+    assert sorted(applied) == [
+        ('aws', 'c1'),
+        ('aws', 'c2'),
+        ('gcp', 'c1'),
+        ('gcp', 'c2'),
+    ]
+    assert peak == {'aws': 3, 'gcp': 2}
+    assert 'ETA' in scheduler.progress()
+
+
+def test_failed_configs_are_skipped_and_failures_reported():
+    items = [
+        WorkItem('aws', 'bad', 'a.yml', 1),
+        WorkItem('aws', 'good', 'a.yml', 1, priority=1),
+        WorkItem('aws', 'good', 'b.yml', 2, priority=1),
+    ]
+    ran = []
+
+    def run_item(item):
+        ran.append(item)
+        if item.benchmark == 'b.yml':
+            raise RuntimeError('boom')
+        return True
+
+    scheduler = Scheduler(items, run_item, lambda cloud, conf: conf == 'good')
+
+    assert not scheduler.run()
+    assert [item.benchmark for item in ran] == ['a.yml', 'b.yml']
+    assert scheduler.skipped == 1
+    assert [item.benchmark for item in scheduler.failed] == ['b.yml']
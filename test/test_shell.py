@@ -0,0 +1,68 @@
+import os
+import sys
+from unittest.mock import patch
+
+from abm.lib import shell
+from abm.lib.common import Context
+
+
+def test_find_executable_is_cached():
+    runner = shell.CommandRunner()
+    with patch.object(shell.shutil, 'which', return_value='/bin/kubectl') as which:
+        assert runner.find_executable('kubectl') == '/bin/kubectl'
+        assert runner.find_executable('kubectl') == '/bin/kubectl'
+    which.assert_called_once_with('kubectl')
+    with patch.object(shell.shutil, 'which', return_value=None):
+        assert runner.find_executable('helm') is None
+
+
+def test_get_env_is_reused_per_context():
+    runner = shell.CommandRunner()
+    context = Context({'GALAXY_SERVER': 'https://a', 'API_KEY': 'k', 'KUBECONFIG': 'c'})
+    context.POOL_SIZE = 4
+    env = runner.get_env(context)
+    assert env['KUBECONFIG'] == 'c'
+    assert 'POOL_SIZE' not in env
+    assert runner.get_env(context) is env
+    other = Context({'GALAXY_SERVER': 'https://b', 'API_KEY': 'k', 'KUBECONFIG': 'c'})
+    assert runner.get_env(other) is not env
+
+
+def test_run_records_latency_per_command():
+    runner = shell.CommandRunner()
+    assert runner.run(f"{sys.executable} -c print(1)") == '1'
+    try:
+        runner.run(f"{sys.executable} -c exit(2)")
+        assert False, 'expected a RuntimeError'
+    except RuntimeError:
+        pass
+    stats = runner.stats[os.path.basename(sys.executable)]
+    assert stats.count == 2
+    assert stats.errors == 1
+    assert 'runs, 1 errors' in runner.summary()
+
+
+def test_run_all_keeps_order_and_errors():
+    commands = [
+        f"{sys.executable} -c print('a')",
+        f"{sys.executable} -c exit(1)",
+        f"{sys.executable} -c print('c')",
+    ]
+    results = shell.run_all(commands)
+    assert results[0] == 'a'
+    assert isinstance(results[1], RuntimeError)
+    assert results[2] == 'c'
+
+
+def test_profiles_are_parsed_once(tmp_path, monkeypatch):
+    from abm.lib import common
+
+    path = tmp_path / 'profile.yml'
+    path.write_text("aws:\n  url: https://a\n  key: k\n  pool_size: 16\n")
+    monkeypatch.setattr(common, 'PROFILE_SEARCH_PATH', [str(path)])
+    with patch.object(common, 'load_profiles', wraps=common.load_profiles) as load:
+        context = Context('aws')
+        Context('aws')
+    assert load.call_count == 1
+    assert context.POOL_SIZE == 16
+    assert 'POOL_SIZE' not in shell.CommandRunner().get_env(context)
@@ -0,0 +1,53 @@
+import asyncio
+from unittest.mock import MagicMock
+
+from abm.lib.async_galaxy import AsyncGalaxy
+from abm.lib.workflow import summarize_workflow
+
+
+def make_gi():
+    jobs = {
+        'i1': [{'id': 'j1', 'state': 'ok', 'history_id': 'h1'}],
+        'i2': [
+            {'id': 'j2', 'state': 'ok', 'history_id': 'h2'},
+            {'id': 'j3', 'state': 'running', 'history_id': 'h2'},
+        ],
+    }
+    gi = MagicMock()
+    gi.base_url = 'https://workflow.test'
+    gi.invocations.get_invocations.side_effect = lambda limit, offset, **kwargs: [
+        {'id': 'i1'},
+        {'id': 'i2'},
+    ][offset : offset + limit]
+    gi.jobs.get_jobs.side_effect = lambda invocation_id, **kwargs: jobs[invocation_id]
+    gi.jobs.get_metrics.return_value = [{'name': 'runtime_seconds', 'raw_value': '3'}]
+    gi.histories.show_history.side_effect = lambda hid: {'id': hid, 'name': hid}
+    return gi
+
+
+def test_summarize_workflow_caches_terminal_job_metrics():
+    gi = make_gi()
+    rows = []
+
+    table = asyncio.run(
+        summarize_workflow(AsyncGalaxy(gi), 'w1', {'state': 'ok'}, rows.append)
+    )
+
+    assert sorted(row[0] for row in table) == ['j1', 'j2', 'j3']
+    assert len(rows) == 3
+    assert {row[5] for row in table} == {'i1', 'i2'}
+    assert gi.jobs.get_jobs.call_args.kwargs['state'] == 'ok'
+    assert gi.jobs.get_metrics.call_count == 3
+
+    asyncio.run(summarize_workflow(AsyncGalaxy(gi), 'w1'))
+    # Only the running job is fetched again.
+    assert gi.jobs.get_metrics.call_count == 4
+
+
+def test_summarize_commands_share_common():
+    # abm/lib is also on sys.path, so importing the bare common module would
+    # create a second copy with its own caches.
+    from abm.lib import history, invocation, workflow
+
+    assert workflow.summarize_metrics_async is history.summarize_metrics_async
+    assert invocation.summarize_metrics.__module__ == 'lib.common'